@@ -6,11 +6,113 @@ It creates custom admin classes for each model, specifying:
     - Fieldsets for grouping related fields in the admin interface
     - List displays to define the columns shown in the admin list view
     - Custom methods to display related model data in a clear way (e.g., election_name, candidate_name)
+
+The Vote and Voted_User tables grow with every ballot, so their admin classes are built to stay fast with tens of
+millions of rows: related rows are joined into the list query, the rows are counted by estimate, the list is paged
+by primary key ranges (keyset pagination) instead of offsets, and filtering and search only use indexed columns.
 """
 
 from django.contrib import admin
+from django.contrib.admin import ShowFacets
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList, ORDER_VAR
+from django.db.models import Q
+
+from .models import (VotingUser, Election, Voted_User, Candidate, Election_Candidate, Vote, Ballot)
+from .paginators import EstimatedCountPaginator
+
+AFTER_VAR = 'after'
+BEFORE_VAR = 'before'
+
+
+class KeysetChangeList(ChangeList):
+    """
+    A changelist paging by primary key ranges: the next page holds the rows with a primary key below the last one of
+    the current page, so every page is read from the primary key index without skipping over the earlier pages.
+
+    Keyset pagination is used while the list is in its default order (newest first); when the list is sorted by a
+    column, it falls back to the usual numbered pages.
+    """
+
+    keyset = False
+    previous_url = None
+    next_url = None
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(AFTER_VAR, None)
+        lookup_params.pop(BEFORE_VAR, None)
+        return lookup_params
+
+    def get_query_string(self, new_params=None, remove=None):
+        # Changing the filters or the order starts again from the first page.
+        return super().get_query_string(new_params, [*(remove or []), AFTER_VAR, BEFORE_VAR])
+
+    def get_results(self, request):
+        if ORDER_VAR in self.params:
+            return super().get_results(request)
+
+        try:
+            after = int(request.GET[AFTER_VAR]) if AFTER_VAR in request.GET else None
+            before = int(request.GET[BEFORE_VAR]) if BEFORE_VAR in request.GET else None
+        except ValueError:
+            raise IncorrectLookupParameters
+
+        queryset = self.queryset
+        first_page = after is None
+        if before is not None:
+            # The previous page holds the list_per_page rows following the cursor.
+            newer = list(queryset.filter(pk__gt=before).order_by('pk')
+                         .values_list('pk', flat=True)[:self.list_per_page + 1])
+            first_page = len(newer) <= self.list_per_page
+            if not first_page:
+                queryset = queryset.filter(pk__lte=newer[self.list_per_page - 1])
+        elif after is not None:
+            queryset = queryset.filter(pk__lt=after)
+
+        result_list = queryset[:self.list_per_page]
+        rows = list(result_list)
+        if rows and not first_page:
+            self.previous_url = self.get_query_string({BEFORE_VAR: rows[0].pk})
+        if len(rows) == self.list_per_page and self.queryset.filter(pk__lt=rows[-1].pk).exists():
+            self.next_url = self.get_query_string({AFTER_VAR: rows[-1].pk})
+
+        self.paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        self.result_count = self.paginator.count
+        self.full_result_count = None
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.result_list = result_list
+        self.can_show_all = False
+        self.multi_page = bool(self.previous_url or self.next_url)
+        self.keyset = True
 
-from .models import (VotingUser, Election, Voted_User, Candidate, Election_Candidate, Vote)
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Base admin class for the tables that grow with every vote.
+    """
+    ordering = ['-pk']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    show_facets = ShowFacets.NEVER
+    exact_search_fields = []
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Matches the search term exactly against the exact_search_fields, which can use an index, unlike the
+        case-insensitive substring search of search_fields.
+        """
+        search_term = search_term.strip()
+        if not search_term or not self.exact_search_fields:
+            return super().get_search_results(request, queryset, search_term)
+        matches = Q()
+        for field in self.exact_search_fields:
+            matches |= Q(**{field: search_term})
+        return queryset.filter(matches), False
 
 
 class CandidateAdmin(admin.ModelAdmin):
@@ -42,6 +144,8 @@ class ElectionCandidatesAdmin(admin.ModelAdmin):
     Admin class for the Election_Candidate model (relationship between Elections and Candidates).
     """
     list_display = ["election_name", "candidate_name", "candidate_surname"]
+    list_select_related = ["election", "candidate"]
+    list_filter = ["election"]
 
     def election_name(self, obj):
         """
@@ -62,11 +166,17 @@ class ElectionCandidatesAdmin(admin.ModelAdmin):
         return obj.candidate.surname
 
 
-class VotedUserAdmin(admin.ModelAdmin):
+class VotedUserAdmin(LargeTableAdmin):
     """
-    Admin class for the Voted_User model.
+    Admin class for the Voted_User model. Voters are searched by their exact e-mail address or PESEL number.
     """
     list_display = ["user_name", "election_name"]
+    # The user of the voter is part of the row's name, shown in the action checkbox of each row.
+    list_select_related = ["user__user", "election"]
+    list_filter = ["election"]
+    search_fields = ["user__email", "user__nr_pesel"]
+    exact_search_fields = ["user__email", "user__nr_pesel"]
+    raw_id_fields = ["user"]
 
     def election_name(self, obj):
         """
@@ -103,7 +213,7 @@ class ElectionsAdmin(admin.ModelAdmin):
     list_display = ["type", "start_date", "end_date"]
 
 
-class VoteAdmin(admin.ModelAdmin):
+class VoteAdmin(LargeTableAdmin):
     """
     Admin class for the Vote model.
     """
@@ -116,6 +226,9 @@ class VoteAdmin(admin.ModelAdmin):
         }),
     )
     list_display = ["candidate_name", "candidate_surname", "election_name", "date"]
+    list_select_related = ["election", "candidate"]
+    list_filter = ["election", "date"]
+    raw_id_fields = ["candidate"]
 
     def election_name(self, obj):
         """
@@ -136,9 +249,27 @@ class VoteAdmin(admin.ModelAdmin):
         return obj.candidate.surname
 
 
+class BallotAdmin(LargeTableAdmin):
+    """
+    Admin class for the Ballot model.
+    """
+    list_display = ["id", "election_name", "candidate_ids", "date"]
+    list_select_related = ["election"]
+    list_filter = ["election", "date"]
+    readonly_fields = ["election", "date", "candidate_ids"]
+    exclude = ["selections"]
+
+    def election_name(self, obj):
+        """
+        Custom method to display the election type for Ballot objects.
+        """
+        return obj.election.type
+
+
 admin.site.register(VotingUser, VotingUserAdmin)
 admin.site.register(Election, ElectionsAdmin)
 admin.site.register(Voted_User, VotedUserAdmin)
 admin.site.register(Candidate, CandidateAdmin)
 admin.site.register(Election_Candidate, ElectionCandidatesAdmin)
 admin.site.register(Vote, VoteAdmin)
+admin.site.register(Ballot, BallotAdmin)
@@ -0,0 +1,376 @@
+"""
+This file compacts the ballots of ended elections into ballot archives, binary files that are read through a memory
+map.
+
+Once an election has ended, its ballots are only read for reports and recounts, yet they stay in the tables that take
+the ballots of the running elections. compact_election writes them to BALLOT_ARCHIVE_DIR/election-<ID>.vba together
+with a snapshot of the election's tallies, the names of its candidates and its turnout, and can then purge the Vote
+and Ballot rows of the election. The reports of an archived election (see reports.py) are built from the snapshot,
+and recounts (see the `tallies` command) count the archived ballots, without querying the ballot tables.
+
+Layout of an archive, with all integers little-endian:
+    header:   HEADER: the magic bytes, the format version, the number of ballot columns, the election ID, the number
+              of ballots, the number of tallied candidates, the length of the metadata and the SHA-256 digest of
+              everything after the header.
+    tallies:  The tallied votes of the candidates as 64-bit integers, followed by the candidate IDs as 32-bit
+              integers.
+    metadata: JSON with the election's details, the candidates' names and the turnout, padded to 4 bytes.
+    ballots:  One column of 32-bit candidate IDs per ballot slot. Column i holds the i-th lowest selected candidate ID
+              of every ballot, or 0 for the ballots with fewer selections.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from . import partitions
+from .ballots import group_votes
+from .models import Ballot, Election_Candidate, Vote, Voted_User, unpack_candidate_ids
+from .tallies import count_tallies
+
+MAGIC = b'VBAR'
+
+VERSION = 1
+
+HEADER = struct.Struct('<4sHHqqII32s')
+
+# The number of ballots buffered in memory per column while an archive is written.
+CHUNK_SIZE = 65536
+
+
+class ArchiveError(Exception):
+    """
+    Raised when an election cannot be archived or an archive cannot be read.
+    """
+
+
+def get_archive_dir():
+    """
+    Returns the directory holding the ballot archives, configurable with the BALLOT_ARCHIVE_DIR setting.
+    """
+    return Path(getattr(settings, 'BALLOT_ARCHIVE_DIR', Path(settings.BASE_DIR) / 'ballot_archives'))
+
+
+def archive_path(election_id):
+    return get_archive_dir() / f'election-{election_id}.vba'
+
+
+def _to_little_endian(values):
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_little_endian(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+class _ColumnWriter:
+    """
+    Spools the ballot columns of an archive to temporary files.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.files = []
+        self.buffers = []
+        self.count = 0
+        self.flushed = 0
+
+    def add(self, candidate_ids):
+        while len(self.buffers) < len(candidate_ids):
+            # A ballot with more selections than any before it opens a column, empty for the earlier ballots.
+            column = tempfile.TemporaryFile(dir=self.directory)
+            for start in range(0, self.flushed, CHUNK_SIZE):
+                column.write(bytes(4 * min(CHUNK_SIZE, self.flushed - start)))
+            self.files.append(column)
+            self.buffers.append(array('i', bytes(4 * (self.count - self.flushed))))
+        for i, buffer in enumerate(self.buffers):
+            buffer.append(candidate_ids[i] if i < len(candidate_ids) else 0)
+        self.count += 1
+        if self.count - self.flushed >= CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        for column, buffer in zip(self.files, self.buffers):
+            column.write(_to_little_endian(buffer))
+        self.buffers = [array('i') for _ in self.files]
+        self.flushed = self.count
+
+    def close(self):
+        for column in self.files:
+            column.close()
+
+
+def _election_ballots(election):
+    """
+    Yields the sorted candidate IDs of every ballot of an election, from its Ballot rows and its Vote rows.
+    """
+    ballots = (Ballot.objects.filter(election_id=election.id).order_by('id')
+               .values_list('selections', flat=True).iterator(chunk_size=5000))
+    for selections in ballots:
+        yield unpack_candidate_ids(selections)
+    votes = (Vote.objects.filter(election_id=election.id).order_by('id')
+             .values_list('id', 'candidate_id', 'date').iterator(chunk_size=5000))
+    for _, candidate_ids in group_votes(votes, election.max_votes):
+        yield sorted(candidate_ids)
+
+
+def compact_election(election, purge=False):
+    """
+    Writes the ballots of an ended election to its archive, and optionally deletes them from the database.
+
+    The archive is only written if the counted ballots match the tallies of the election, so that reports built from
+    its snapshot agree with the ballots it holds. It replaces an earlier archive of the election.
+
+    Parameters:
+    election (Election): The election to archive.
+    purge (bool): Whether to delete the Vote and Ballot rows of the election once the archive is written.
+
+    Returns:
+    dict: The path of the archive, its size in bytes, the number of ballots and the number of purged rows.
+
+    Raises:
+    ArchiveError: If the election has not ended yet, or its tallies do not match its ballots.
+    """
+    if election.end_date >= timezone.now().date():
+        raise ArchiveError(f"Election {election.id} has not ended yet.")
+
+    path = archive_path(election.id)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tallies = count_tallies(election.id)
+    counted = Counter()
+    columns = _ColumnWriter(path.parent)
+    try:
+        for candidate_ids in _election_ballots(election):
+            counted.update(candidate_ids)
+            columns.add(candidate_ids)
+        columns.flush()
+        if dict(counted) != tallies:
+            raise ArchiveError(f"The tallies of election {election.id} do not match its ballots. "
+                               f"Run 'manage.py tallies rebuild --election {election.id}' first.")
+
+        candidate_ids = sorted(tallies)
+        names = {
+            candidate_id: f'{name} {surname}'
+            for candidate_id, name, surname in Election_Candidate.objects.filter(election_id=election.id)
+            .values_list('candidate_id', 'candidate__name', 'candidate__surname')
+        }
+        metadata = json.dumps({
+            'type': election.type,
+            'start_date': election.start_date.isoformat(),
+            'end_date': election.end_date.isoformat(),
+            'max_votes': election.max_votes,
+            'candidates': {str(candidate_id): names.get(candidate_id, '') for candidate_id in candidate_ids},
+            'voted_users': Voted_User.objects.filter(election_id=election.id).count(),
+            'eligible_voters': User.objects.filter(groups__in=election.allowed_groups.all()).distinct().count(),
+            'compacted_at': timezone.now().isoformat(),
+        }).encode('utf-8')
+        metadata += b' ' * (-len(metadata) % 4)
+
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as archive:
+                archive.write(bytes(HEADER.size))
+
+                def write(data):
+                    digest.update(data)
+                    archive.write(data)
+
+                write(_to_little_endian(array('q', [tallies[candidate_id] for candidate_id in candidate_ids])))
+                write(_to_little_endian(array('i', candidate_ids)))
+                write(metadata)
+                for column in columns.files:
+                    column.seek(0)
+                    while data := column.read(4 * CHUNK_SIZE):
+                        write(data)
+
+                archive.seek(0)
+                archive.write(HEADER.pack(MAGIC, VERSION, len(columns.files), election.id, columns.count,
+                                          len(candidate_ids), len(metadata), digest.digest()))
+                archive.flush()
+                os.fsync(archive.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    finally:
+        columns.close()
+
+    purged = purge_ballots(election.id) if purge else 0
+    return {'path': path, 'bytes': path.stat().st_size, 'ballots': columns.count, 'purged': purged}
+
+
+def purge_ballots(election_id):
+    """
+    Deletes the Vote and Ballot rows of an election, by truncating its partitions if the tables are partitioned.
+
+    Returns:
+    int: The number of deleted rows.
+    """
+    deleted = 0
+    with transaction.atomic():
+        for model in (Vote, Ballot):
+            # The partition of the election is emptied without leaving dead rows behind.
+            truncated = partitions.truncate_partition(model._meta.db_table, election_id)
+            if truncated is None:
+                truncated = model.objects.filter(election_id=election_id).delete()[0]
+            deleted += truncated
+    return deleted
+
+
+class BallotArchive:
+    """
+    A ballot archive opened for reading.
+
+    The ballot columns are not read when the archive is opened, but mapped into memory and paged in by the operating
+    system as they are counted. Use the archive as a context manager, or close it, to unmap the file.
+
+    Attributes:
+    election_id (int): The primary key of the archived election.
+    ballot_count (int): The number of archived ballots.
+    width (int): The number of ballot columns.
+    tallies (dict): The snapshot of the tallies, mapping candidate primary keys to vote counts.
+    metadata (dict): The election's details, the candidates' names and the turnout.
+    columns_offset (int): The offset of the first ballot column in the file. The columns follow each other, so the
+                          ballots form one array of width * ballot_count candidate IDs from there.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, 'rb') as archive:
+            try:
+                self._map = mmap.mmap(archive.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise ArchiveError(f"{self.path} is empty.")
+        try:
+            self._read_header()
+        except BaseException:
+            self._map.close()
+            raise
+
+    def _read_header(self):
+        if len(self._map) < HEADER.size:
+            raise ArchiveError(f"{self.path} is not a ballot archive.")
+        (magic, version, self.width, self.election_id, self.ballot_count, candidate_count, metadata_length,
+         self.checksum) = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ArchiveError(f"{self.path} is not a ballot archive.")
+        if version != VERSION:
+            raise ArchiveError(f"{self.path} has an unsupported version: {version}.")
+
+        offset = HEADER.size
+        votes = _from_little_endian('q', self._map[offset:offset + 8 * candidate_count])
+        offset += 8 * candidate_count
+        candidate_ids = _from_little_endian('i', self._map[offset:offset + 4 * candidate_count])
+        offset += 4 * candidate_count
+        self.tallies = dict(zip(candidate_ids, votes))
+        self.metadata = json.loads(bytes(self._map[offset:offset + metadata_length]))
+        self.columns_offset = offset + metadata_length
+        if len(self._map) != self.columns_offset + 4 * self.width * self.ballot_count:
+            raise ArchiveError(f"{self.path} is truncated.")
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def verify(self):
+        """
+        Tells whether the content of the archive matches the checksum in its header.
+        """
+        digest = hashlib.sha256()
+        with memoryview(self._map) as data:
+            digest.update(data[HEADER.size:])
+        return digest.digest() == self.checksum
+
+    def column_bytes(self, index):
+        """
+        Returns a memory view of the little-endian bytes of a ballot column. Release it before closing the archive.
+        """
+        start = self.columns_offset + 4 * self.ballot_count * index
+        with memoryview(self._map) as data:
+            return data[start:start + 4 * self.ballot_count]
+
+    def count_ballots(self):
+        """
+        Counts the votes per candidate from the archived ballots.
+
+        Returns:
+        dict: A dictionary mapping candidate primary keys to their vote counts.
+        """
+        counts = Counter()
+        for index in range(self.width):
+            with self.column_bytes(index) as column:
+                if sys.byteorder == 'little':
+                    with column.cast('i') as candidate_ids:
+                        counts.update(candidate_ids)
+                else:
+                    counts.update(_from_little_endian('i', column))
+        counts.pop(0, None)
+        return dict(counts)
+
+    def ballots(self, chunk_size=CHUNK_SIZE):
+        """
+        Yields the selected candidate IDs of every archived ballot, in the order they were archived.
+
+        Parameters:
+        chunk_size (int): The number of ballots read from each column at a time.
+
+        Yields:
+        list: The sorted candidate IDs of a ballot.
+        """
+        for start in range(0, self.ballot_count, chunk_size):
+            end = min(start + chunk_size, self.ballot_count)
+            columns = []
+            for index in range(self.width):
+                with self.column_bytes(index) as column:
+                    columns.append(_from_little_endian('i', column[4 * start:4 * end]))
+            for selections in zip(*columns):
+                yield [candidate_id for candidate_id in selections if candidate_id]
+
+    def results(self):
+        """
+        Returns the results of the archived election from its tally snapshot, in the form of
+        tallies.get_election_results.
+        """
+        candidate_votes = {}
+        for candidate_id, votes in sorted(self.tallies.items()):
+            if votes:
+                name = self.metadata['candidates'].get(str(candidate_id), '')
+                candidate_votes[name] = candidate_votes.get(name, 0) + votes
+        return sum(candidate_votes.values()), candidate_votes
+
+
+def open_archive(election_id):
+    """
+    Opens the archive of an election.
+
+    Returns:
+    BallotArchive: The archive, or None if the election has not been archived.
+    """
+    try:
+        return BallotArchive(archive_path(election_id))
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,182 @@
+"""
+This file defines native async versions of the busiest views of the voting application.
+
+They behave like their counterparts in views.py, but use the async ORM, cache and authentication APIs, so that under
+the ASGI entry point (votingsite/asgi.py) a waiting database query or slow client does not hold a worker thread.
+The work that Django only offers synchronously - transactions when casting a ballot and PDF rendering - is handed to
+a thread with sync_to_async.
+
+votingapp/urls.py routes to these views when the ASYNC_VIEWS setting is enabled, which asgi.py does by default.
+election_live_results only exists in an async version and is always routed.
+"""
+
+import logging
+
+from asgiref.sync import sync_to_async
+from django.contrib import messages
+from django.contrib.auth.views import redirect_to_login
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.shortcuts import render, redirect
+from django.utils import timezone
+
+from . import ballot_cache, election_cache, http_caching, live_results, principal
+from .ballots import AlreadyVotedError, InvalidCandidateError, cast_ballot
+from .ingest import IngestError
+from .models import Election, Voted_User
+from .reports import REPORT_TEMPLATE, abuild_report_context
+from .views import INGEST_RETRY_AFTER, generate_pdf, live_results_url
+
+logger = logging.getLogger('votingapp.views')
+
+
+async def aget_election_or_404(election_id):
+    try:
+        return await Election.objects.aget(pk=election_id)
+    except Election.DoesNotExist:
+        raise Http404("No Election matches the given query.")
+
+
+async def aget_voting_user(request):
+    """
+    Returns the authenticated user and their VotingUser, or the user and None if the user is not a voter.
+    """
+    user = await request.auser()
+    return user, await principal.aget_voting_user(user)
+
+
+async def election_list(request):
+    """
+    Async version of views.election_list.
+    """
+    user = await request.auser()
+    if not user.is_authenticated:
+        return redirect_to_login(request.get_full_path())
+
+    user, voting_user = await aget_voting_user(request)
+    if voting_user is None:
+        messages.error(request, 'You are not authorized to access this page.')
+        logger.warning("Unauthorized access attempt by user: %s", user.username)
+        return redirect('login')
+
+    group_ids = await principal.aget_group_ids(user)
+    current_date = timezone.now().date()
+    ongoing, ended = await election_cache.aget_group_elections(group_ids, current_date)
+    voted_elections = await election_cache.aget_voted_election_ids(voting_user.id)
+    ongoing_elections = [{'id': election_id, 'type': ongoing[election_id]}
+                         for election_id in sorted(ongoing) if election_id not in voted_elections]
+    ended_elections = [{'id': election_id, 'type': ended[election_id]} for election_id in sorted(ended)]
+
+    logger.info("Election list accessed by user: %s", user.username)
+
+    return render(request, 'election_list.html',
+                  {'ongoing_elections': ongoing_elections, 'ended_elections': ended_elections})
+
+
+async def ended_elections_report(request, election_id):
+    """
+    Async version of views.ended_elections_report.
+    """
+    election = await aget_election_or_404(election_id)
+
+    if 'pdf' in request.GET:
+        logger.debug("Generating PDF report for election ID: %s", election_id)
+        return await sync_to_async(generate_pdf)(REPORT_TEMPLATE, await abuild_report_context(election))
+
+    validators = await http_caching.areport_validators(election)
+    response = http_caching.not_modified(request, election, validators)
+    if response is not None:
+        return response
+
+    logger.info("Ended elections report accessed for election ID: %s", election_id)
+    context = await abuild_report_context(election)
+    response = render(request, 'ended_elections_report.html',
+                      {**context, 'live_results_url': live_results_url(election)})
+    return http_caching.patch_report_headers(response, election, validators)
+
+
+async def election_live_results(request, election_id):
+    """
+    Streams the results of an election as Server-Sent Events while it is open, see live_results.py.
+
+    Parameters:
+    request (HttpRequest): The HTTP request object containing metadata about the request.
+    election_id (int): The primary key of the election.
+
+    Returns:
+    HttpResponse:
+        - A text/event-stream response that sends the results whenever they change, until the election ends.
+        - Under WSGI, a response with the current results only, asking the browser to reconnect later.
+        - A 204 response once the election has ended, which tells the browser to stop reconnecting; the final
+          results are in its report.
+    """
+    election = await aget_election_or_404(election_id)
+    if http_caching.is_final(election):
+        return HttpResponse(status=204)
+    if not isinstance(request, ASGIRequest):
+        event = await sync_to_async(live_results.results_event)(election.id, retry=live_results.get_refresh())
+        response = HttpResponse(event, content_type='text/event-stream')
+    else:
+        response = StreamingHttpResponse(live_results.stream_results(election), content_type='text/event-stream')
+        # Keeps proxies such as nginx from buffering the events.
+        response['X-Accel-Buffering'] = 'no'
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+async def election_detail(request, election_id):
+    """
+    Async version of views.election_detail.
+    """
+    ballot = await ballot_cache.aget_ballot(election_id)
+    if ballot is None:
+        raise Http404("No Election matches the given query.")
+    election, candidate_ids, candidates_html = ballot
+    user, voting_user = await aget_voting_user(request)
+
+    if voting_user is None:
+        messages.error(request, 'You are not authorized to access this page.')
+        logger.warning("Unauthorized access attempt by user: %s", user.username)
+        return redirect('login')
+
+    if await Voted_User.objects.filter(user=voting_user, election=election).aexists():
+        messages.error(request, 'You have already voted in this election.')
+        logger.info("User %s attempted to vote again in election ID: %s", user.username, election_id)
+        return redirect('election_list')
+
+    if request.method == 'POST':
+        selected_candidates = request.POST.getlist('candidate')
+        max_votes = election.max_votes
+
+        if len(selected_candidates) > max_votes:
+            messages.error(request, f'Please select maximally {max_votes} candidates.')
+            logger.warning("User %s selected too many candidates in election ID: %s", user.username, election_id)
+        elif len(selected_candidates) == 0:
+            messages.error(request, 'Please select at least one candidate')
+            logger.warning("User %s selected zero candidates in election ID: %s", user.username, election_id)
+        else:
+            try:
+                await sync_to_async(cast_ballot)(voting_user, election, selected_candidates, candidate_ids)
+            except InvalidCandidateError:
+                logger.warning("User %s selected an invalid candidate in election ID: %s", user.username, election_id)
+                raise Http404("No Candidate matches the given query.")
+            except AlreadyVotedError:
+                messages.error(request, 'You have already voted in this election.')
+                logger.info("User %s attempted to vote again in election ID: %s", user.username, election_id)
+                return redirect('election_list')
+            except IngestError:
+                # The ballot was not accepted, so the voter can submit it again.
+                messages.error(request, 'Your vote could not be recorded. Please try again in a moment.')
+                logger.exception("The ballot of user %s in election ID %s could not be logged", user.username,
+                                 election_id)
+                response = render(request, 'election_detail.html',
+                                  {'election': election, 'candidates_html': candidates_html}, status=503)
+                response['Retry-After'] = INGEST_RETRY_AFTER
+                return response
+
+            messages.success(request, 'Your vote has been submitted successfully.')
+            logger.info("User %s successfully voted in election ID: %s", user.username, election_id)
+            return redirect('election_list')
+
+    logger.debug("Rendering election detail page for election ID: %s", election_id)
+    return render(request, 'election_detail.html', {'election': election, 'candidates_html': candidates_html})
@@ -0,0 +1,86 @@
+"""
+This file implements the cache behind the ballot page of an election.
+
+The ballot page shows the same election details and the same list of candidates to every voter, and the candidates
+of an election rarely change once it has started. For every election the cache holds the election, the set of its
+candidate IDs and its candidate list rendered from ballot_candidates.html. A GET of the ballot page is served from
+the entry, and a submitted ballot is validated against the cached candidate IDs, so the only query left per request
+is the check whether the user has already voted.
+
+Entries are invalidated by the receivers in signals.py when the election, its candidates or their links to it
+change. Like election_cache.py, the functions only use the basic cache API.
+"""
+
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from .db_routing import primary
+from .election_cache import get_timeout
+from .models import Candidate, Election
+
+
+def ballot_key(election_id):
+    return f'votingapp:ballot:{election_id}'
+
+
+def get_ballot(election_id):
+    """
+    Returns the cached ballot of an election, loading and storing it if needed.
+
+    Parameters:
+    election_id (int): The primary key of the election.
+
+    Returns:
+    tuple: The Election, the frozenset of its candidate IDs and the rendered candidate list, or None if the election
+           does not exist.
+    """
+    key = ballot_key(election_id)
+    entry = cache.get(key)
+    if entry is None:
+        with primary():
+            election = Election.objects.filter(pk=election_id).first()
+            if election is None:
+                return None
+            entry = _ballot_entry(election, list(_candidates_query(election_id)))
+        cache.set(key, entry, get_timeout())
+    return _unpack_entry(entry)
+
+
+async def aget_ballot(election_id):
+    """
+    Async version of get_ballot.
+    """
+    key = ballot_key(election_id)
+    entry = await cache.aget(key)
+    if entry is None:
+        with primary():
+            election = await Election.objects.filter(pk=election_id).afirst()
+            if election is None:
+                return None
+            entry = _ballot_entry(election, [candidate async for candidate in _candidates_query(election_id)])
+        await cache.aset(key, entry, get_timeout())
+    return _unpack_entry(entry)
+
+
+def _candidates_query(election_id):
+    return Candidate.objects.filter(election_candidate__election_id=election_id)
+
+
+def _ballot_entry(election, candidates):
+    return {
+        'election': election,
+        'candidate_ids': frozenset(candidate.id for candidate in candidates),
+        'candidates_html': render_to_string('ballot_candidates.html', {'candidates': candidates}),
+    }
+
+
+def _unpack_entry(entry):
+    return entry['election'], entry['candidate_ids'], mark_safe(entry['candidates_html'])
+
+
+def invalidate_ballots(election_ids):
+    """
+    Drops the cached ballots of the given elections.
+    """
+    cache.delete_many([ballot_key(election_id) for election_id in election_ids])
@@ -0,0 +1,327 @@
+"""
+This file implements casting a ballot in an election.
+
+A ballot is validated against the election's candidates with a single query and then stored in one short
+transaction: the Voted_User slot is claimed with an insert-on-conflict statement, all Vote rows are written with one
+bulk insert and the vote tallies are upserted. The number of database round trips per ballot therefore does not
+depend on how many candidates were selected, and two concurrent submissions by the same user cannot both succeed.
+
+With the BALLOT_INGESTION setting set to 'log', an accepted ballot is instead appended to the write-behind ingestion
+log and stored later, in batches, by store_ballots; see ingest.py.
+
+The selections are stored as one Vote row per selected candidate, or, with the BALLOT_STORAGE setting set to
+'ballots', as a single Ballot row holding the packed candidate IDs. convert_votes and revert_ballots move the existing
+ballots of an election between the two representations.
+"""
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Ballot, Election_Candidate, Vote, Voted_User, pack_candidate_ids, unpack_candidate_ids
+from .signals import ballot_cast
+from .tallies import increment_tallies
+
+
+STORAGES = ('votes', 'ballots')
+
+INGESTION_MODES = ('direct', 'log')
+
+# The number of rows inserted per statement when ballots are stored in batches.
+STORE_BATCH_SIZE = 1000
+
+CONVERSION_BATCH_SIZE = 5000
+
+
+def get_ballot_storage():
+    """
+    Returns how new ballots are stored: 'votes' (one Vote row per selection) or 'ballots' (one Ballot row per ballot).
+    """
+    storage = getattr(settings, 'BALLOT_STORAGE', 'votes')
+    if storage not in STORAGES:
+        raise ValueError(f"BALLOT_STORAGE must be one of {STORAGES}, not {storage!r}")
+    return storage
+
+
+def get_ingestion_mode():
+    """
+    Returns how accepted ballots are stored: 'direct' (in the request's transaction) or 'log' (through the write-behind
+    ingestion log).
+    """
+    mode = getattr(settings, 'BALLOT_INGESTION', 'direct')
+    if mode not in INGESTION_MODES:
+        raise ValueError(f"BALLOT_INGESTION must be one of {INGESTION_MODES}, not {mode!r}")
+    return mode
+
+
+class BallotError(Exception):
+    """
+    Base class for errors raised when a ballot cannot be cast.
+    """
+
+
+class InvalidCandidateError(BallotError):
+    """
+    Raised when a selected candidate does not exist or does not take part in the election.
+    """
+
+
+class AlreadyVotedError(BallotError):
+    """
+    Raised when the user has already voted in the election.
+    """
+
+
+def get_valid_candidate_ids(election, candidate_ids, election_candidate_ids=None):
+    """
+    Checks the selected candidate IDs against the candidates of the election.
+
+    Parameters:
+    election (Election): The election the ballot is cast in.
+    candidate_ids (iterable): The selected candidate IDs, as submitted by the voter.
+    election_candidate_ids (set): The candidate IDs of the election, if they are already known (see ballot_cache.py);
+                                  otherwise the selected IDs are looked up with one query.
+
+    Returns:
+    list: The distinct selected candidate IDs as integers, in submission order.
+
+    Raises:
+    InvalidCandidateError: If any of the IDs is malformed or is not a candidate in the election.
+    """
+    selected = []
+    for candidate_id in candidate_ids:
+        try:
+            candidate_id = int(candidate_id)
+        except (TypeError, ValueError):
+            raise InvalidCandidateError(f"Invalid candidate ID: {candidate_id!r}")
+        if candidate_id not in selected:
+            selected.append(candidate_id)
+
+    if election_candidate_ids is not None:
+        valid = election_candidate_ids
+    else:
+        valid = set(Election_Candidate.objects.filter(election=election, candidate_id__in=selected)
+                    .values_list('candidate_id', flat=True))
+    invalid = [candidate_id for candidate_id in selected if candidate_id not in valid]
+    if invalid:
+        raise InvalidCandidateError(f"Candidates {invalid} do not take part in election {election.id}")
+    return selected
+
+
+def claim_voted_slot(voting_user, election):
+    """
+    Records that the user has voted in the election, unless that is already recorded.
+
+    Relies on the unique constraint on (user, election) of Voted_User, so concurrent claims by the same user cannot
+    both succeed.
+
+    Parameters:
+    voting_user (VotingUser): The voter.
+    election (Election): The election the ballot is cast in.
+
+    Returns:
+    bool: True if the slot was claimed, False if the user had already voted.
+    """
+    table = connection.ops.quote_name(Voted_User._meta.db_table)
+    sql = (f'INSERT INTO {table} (user_id, election_id) VALUES (%s, %s) '
+           f'ON CONFLICT (user_id, election_id) DO NOTHING')
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [voting_user.pk, election.pk])
+        return cursor.rowcount == 1
+
+
+def cast_ballot(voting_user, election, candidate_ids, election_candidate_ids=None):
+    """
+    Casts a ballot of a user in an election.
+
+    Parameters:
+    voting_user (VotingUser): The voter.
+    election (Election): The election the ballot is cast in.
+    candidate_ids (iterable): The selected candidate IDs.
+    election_candidate_ids (set): The candidate IDs of the election, if they are already known.
+
+    Returns:
+    list: The IDs of the candidates that received a vote.
+
+    Raises:
+    InvalidCandidateError: If any of the selected candidates does not take part in the election.
+    AlreadyVotedError: If the user has already voted in the election.
+    """
+    selected = get_valid_candidate_ids(election, candidate_ids, election_candidate_ids)
+    today = timezone.now().date()
+
+    if get_ingestion_mode() == 'log':
+        # Imported here since the ingestion log stores its ballots with store_ballots below.
+        from .ingest import get_log
+        get_log().submit(election.id, voting_user.pk, selected, today)
+        return selected
+
+    with transaction.atomic():
+        if not claim_voted_slot(voting_user, election):
+            raise AlreadyVotedError(f"User {voting_user.pk} has already voted in election {election.id}")
+        if get_ballot_storage() == 'ballots':
+            Ballot.objects.create(election=election, date=today, selections=pack_candidate_ids(selected))
+        else:
+            Vote.objects.bulk_create([
+                Vote(candidate_id=candidate_id, election=election, date=today) for candidate_id in selected
+            ])
+        increment_tallies(election.id, selected)
+        transaction.on_commit(lambda: ballot_cast.send(sender=Vote, election_id=election.id,
+                                                       voting_user_id=voting_user.pk, candidate_ids=selected))
+    return selected
+
+
+def claim_voted_slots(slots):
+    """
+    Records that users have voted in elections, for the (voting user ID, election ID) pairs that are not recorded yet.
+
+    Parameters:
+    slots (list): Distinct (voting user ID, election ID) pairs.
+
+    Returns:
+    set: The pairs that were claimed.
+    """
+    table = connection.ops.quote_name(Voted_User._meta.db_table)
+    claimed = set()
+    with connection.cursor() as cursor:
+        for start in range(0, len(slots), STORE_BATCH_SIZE):
+            batch = slots[start:start + STORE_BATCH_SIZE]
+            cursor.execute(
+                f'INSERT INTO {table} (user_id, election_id) VALUES {", ".join(["(%s, %s)"] * len(batch))} '
+                f'ON CONFLICT (user_id, election_id) DO NOTHING RETURNING user_id, election_id',
+                [value for slot in batch for value in slot])
+            claimed.update(cursor.fetchall())
+    return claimed
+
+
+def store_ballots(ballots):
+    """
+    Stores a batch of accepted ballots in one transaction, as cast_ballot would have stored each of them.
+
+    Storing the same ballots twice stores them once: a ballot is only stored if its voter's Voted_User slot can still
+    be claimed, so later ballots of a voter in an election are dropped.
+
+    Parameters:
+    ballots (list): (election ID, voting user ID, candidate IDs, date) tuples, in the order they were accepted.
+
+    Returns:
+    list: The ballots that were stored.
+    """
+    first = {}
+    for ballot in ballots:
+        first.setdefault((ballot[1], ballot[0]), ballot)
+
+    with transaction.atomic():
+        claimed = claim_voted_slots(list(first))
+        stored = [ballot for slot, ballot in first.items() if slot in claimed]
+        if get_ballot_storage() == 'ballots':
+            Ballot.objects.bulk_create([
+                Ballot(election_id=election_id, date=date, selections=pack_candidate_ids(selected))
+                for election_id, _, selected, date in stored
+            ], batch_size=STORE_BATCH_SIZE)
+        else:
+            Vote.objects.bulk_create([
+                Vote(candidate_id=candidate_id, election_id=election_id, date=date)
+                for election_id, _, selected, date in stored for candidate_id in selected
+            ], batch_size=STORE_BATCH_SIZE)
+
+        selections = {}
+        for election_id, _, selected, _ in stored:
+            selections.setdefault(election_id, []).extend(selected)
+        for election_id, candidate_ids in sorted(selections.items()):
+            increment_tallies(election_id, candidate_ids)
+
+        def announce():
+            for election_id, voting_user_id, selected, _ in stored:
+                ballot_cast.send(sender=Vote, election_id=election_id, voting_user_id=voting_user_id,
+                                 candidate_ids=selected)
+        transaction.on_commit(announce)
+    return stored
+
+
+def group_votes(votes, max_votes):
+    """
+    Groups Vote rows into the ballots they most likely belong to.
+
+    Vote rows do not record which ballot they belong to. Ballots are therefore rebuilt from runs of consecutive Vote
+    IDs with the same date, as written by cast_ballot, cut after max_votes selections or when a candidate repeats.
+    The per-candidate counts are always preserved; rows of concurrent ballots that were interleaved may end up
+    grouped differently than they were cast.
+
+    Parameters:
+    votes (iterable): (id, candidate_id, date) tuples of Vote rows, ordered by ID.
+    max_votes (int): The maximum number of selections per ballot in the election.
+
+    Yields:
+    tuple: The date and the list of selected candidate IDs of a ballot.
+    """
+    current = []
+    current_date = None
+    last_id = None
+    for vote_id, candidate_id, date in votes:
+        if current and (vote_id != last_id + 1 or date != current_date or candidate_id in current
+                        or len(current) >= max_votes):
+            yield current_date, current
+            current = []
+        current.append(candidate_id)
+        current_date = date
+        last_id = vote_id
+    if current:
+        yield current_date, current
+
+
+def convert_votes(election_id, max_votes):
+    """
+    Replaces the Vote rows of an election with Ballot rows, grouped by group_votes.
+
+    Parameters:
+    election_id (int): The primary key of the election.
+    max_votes (int): The maximum number of selections per ballot in the election.
+
+    Returns:
+    int: The number of ballots created.
+    """
+    created = 0
+    batch = []
+    with transaction.atomic():
+        votes = (Vote.objects.filter(election_id=election_id).order_by('id')
+                 .values_list('id', 'candidate_id', 'date').iterator(chunk_size=CONVERSION_BATCH_SIZE))
+        for date, candidate_ids in group_votes(votes, max_votes):
+            batch.append(Ballot(election_id=election_id, date=date,
+                                selections=pack_candidate_ids(candidate_ids)))
+            if len(batch) >= CONVERSION_BATCH_SIZE:
+                Ballot.objects.bulk_create(batch)
+                created += len(batch)
+                batch = []
+        Ballot.objects.bulk_create(batch)
+        created += len(batch)
+        Vote.objects.filter(election_id=election_id).delete()
+    return created
+
+
+def revert_ballots(election_id):
+    """
+    Replaces the Ballot rows of an election with one Vote row per selected candidate.
+
+    Parameters:
+    election_id (int): The primary key of the election.
+
+    Returns:
+    int: The number of Vote rows created.
+    """
+    created = 0
+    batch = []
+    with transaction.atomic():
+        ballots = (Ballot.objects.filter(election_id=election_id).order_by('id')
+                   .values_list('date', 'selections').iterator(chunk_size=CONVERSION_BATCH_SIZE))
+        for date, selections in ballots:
+            batch.extend(Vote(election_id=election_id, candidate_id=candidate_id, date=date)
+                         for candidate_id in unpack_candidate_ids(selections))
+            if len(batch) >= CONVERSION_BATCH_SIZE:
+                Vote.objects.bulk_create(batch)
+                created += len(batch)
+                batch = []
+        Vote.objects.bulk_create(batch)
+        created += len(batch)
+        Ballot.objects.filter(election_id=election_id).delete()
+    return created
@@ -0,0 +1,395 @@
+"""
+This file contains the building blocks of the benchmark management commands.
+
+It seeds a synthetic voting population (groups, voters, ongoing and ended elections with candidates and ballots),
+drives the voting flow with concurrent virtual voters - in-process through Django's test client or over HTTP against
+a running server - and summarizes latencies, throughput and database query counts per view.
+
+It also measures the startup of a web worker: the import time (from `python -X importtime`) and the memory of a fresh
+process that has loaded the WSGI or ASGI application and the URLconf, as a worker has before its first request.
+"""
+
+import http.cookiejar
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User, Group
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .ballots import get_ballot_storage
+from .models import VotingUser, Election, Voted_User, Candidate, Election_Candidate, Vote, Vote_Tally, Ballot, \
+    pack_candidate_ids
+from .tallies import rebuild_tallies
+
+BENCHMARK_PASSWORD = 'benchmark-password'
+
+# Packages that only the report renderers and the recount engine need; a web worker must not import them at startup.
+HEAVY_MODULES = ['xhtml2pdf', 'reportlab', 'PIL', 'html5lib', 'pyhanko', 'numpy']
+
+STARTUP_ENTRIES = {'wsgi': 'votingsite.wsgi', 'asgi': 'votingsite.asgi'}
+
+STARTUP_SCRIPT = """
+import importlib, json, resource, sys, time
+started = time.perf_counter()
+importlib.import_module(sys.argv[1])
+from django.conf import settings
+importlib.import_module(settings.ROOT_URLCONF)
+elapsed = time.perf_counter() - started
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({
+    'seconds': elapsed,
+    'max_rss_bytes': rss if sys.platform == 'darwin' else rss * 1024,
+    'modules': sorted(name for name in sys.modules if '.' not in name),
+}))
+"""
+
+
+def percentile(values, fraction):
+    """
+    Returns the value below which the given fraction of the sorted values lies.
+    """
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+def summarize(latencies, elapsed, statuses, queries=None):
+    """
+    Summarizes the measurements of a series of requests.
+
+    Parameters:
+    latencies (list): The duration of each request in seconds.
+    elapsed (float): The wall-clock duration of the whole series in seconds.
+    statuses (list): The HTTP status code of each request.
+    queries (list): The number of database queries of each request, if known.
+
+    Returns:
+    dict: The request count, throughput, latency percentiles in milliseconds, status counts and query counts.
+    """
+    latencies = sorted(latencies)
+    summary = {
+        'requests': len(latencies),
+        'seconds': elapsed,
+        'throughput': len(latencies) / elapsed if elapsed else 0.0,
+        'mean_ms': statistics.fmean(latencies) * 1000 if latencies else 0.0,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'statuses': {str(status): statuses.count(status) for status in sorted(set(statuses))},
+    }
+    if queries:
+        summary['queries_mean'] = statistics.fmean(queries)
+        summary['queries_max'] = max(queries)
+    return summary
+
+
+def seed_benchmark_data(prefix, voters, groups, elections, candidates, max_votes=2, ballots_per_ended=None):
+    """
+    Creates a synthetic voting population with bulk inserts.
+
+    Every voter belongs to one of the groups and every election is open to all groups. Half of the elections are
+    ongoing, the other half have ended and already hold one ballot per voter (or ballots_per_ended ballots).
+
+    Parameters:
+    prefix (str): A prefix for the names of the created users and groups, used to delete them afterwards.
+    voters (int): The number of voters.
+    groups (int): The number of groups.
+    elections (int): The number of elections.
+    candidates (int): The number of candidates per election.
+    max_votes (int): The number of candidates a voter may select.
+    ballots_per_ended (int): The number of ballots in each ended election, all voters by default.
+
+    Returns:
+    dict: The usernames of the voters, the ongoing elections as (election ID, candidate IDs, max votes) tuples
+          and the IDs of the ended elections.
+    """
+    today = timezone.now().date()
+    with transaction.atomic():
+        group_objects = Group.objects.bulk_create([Group(name=f'{prefix}-group-{i}') for i in range(groups)])
+        password = make_password(BENCHMARK_PASSWORD)
+        users = User.objects.bulk_create([
+            User(username=f'{prefix}-{i}@example.com', email=f'{prefix}-{i}@example.com', password=password)
+            for i in range(voters)
+        ])
+        User.groups.through.objects.bulk_create([
+            User.groups.through(user_id=user.id, group_id=group_objects[i % groups].id) for i, user in enumerate(users)
+        ])
+        voting_users = VotingUser.objects.bulk_create([
+            VotingUser(user=user, email=user.email, nr_pesel=f'{i:011d}') for i, user in enumerate(users)
+        ])
+
+        ongoing = []
+        ended = []
+        for i in range(elections):
+            is_ended = i % 2 == 1
+            election = Election.objects.create(
+                creator=voting_users[0], type=f'{prefix} election {i}', max_votes=max_votes,
+                start_date=today - timezone.timedelta(days=30),
+                end_date=today - timezone.timedelta(days=1) if is_ended else today + timezone.timedelta(days=30))
+            election.allowed_groups.set(group_objects)
+            candidate_objects = Candidate.objects.bulk_create([
+                Candidate(name=f'Candidate {j}', surname=f'{prefix} {i}', description='') for j in range(candidates)
+            ])
+            Election_Candidate.objects.bulk_create([
+                Election_Candidate(election=election, candidate=candidate) for candidate in candidate_objects
+            ])
+            candidate_ids = [candidate.id for candidate in candidate_objects]
+
+            if not is_ended:
+                ongoing.append((election.id, candidate_ids, max_votes))
+                continue
+
+            ballots = voting_users[:ballots_per_ended] if ballots_per_ended is not None else voting_users
+            Voted_User.objects.bulk_create([Voted_User(user=voting_user, election=election)
+                                            for voting_user in ballots], batch_size=5000)
+            if get_ballot_storage() == 'ballots':
+                Ballot.objects.bulk_create([
+                    Ballot(election=election, date=election.end_date,
+                           selections=pack_candidate_ids([candidate_ids[k % candidates]]))
+                    for k in range(len(ballots))
+                ], batch_size=5000)
+            else:
+                Vote.objects.bulk_create([Vote(candidate_id=candidate_ids[k % candidates], election=election,
+                                               date=election.end_date) for k in range(len(ballots))], batch_size=5000)
+            rebuild_tallies(election.id)
+            ended.append(election.id)
+
+    return {'usernames': [user.username for user in users], 'ongoing': ongoing, 'ended': ended}
+
+
+def delete_benchmark_data(prefix):
+    """
+    Deletes everything created by seed_benchmark_data with the given prefix.
+    """
+    with transaction.atomic():
+        elections = Election.objects.filter(type__startswith=f'{prefix} election ')
+        candidate_ids = list(Election_Candidate.objects.filter(election__in=elections)
+                             .values_list('candidate_id', flat=True))
+        Vote_Tally.objects.filter(election__in=elections).delete()
+        Vote.objects.filter(election__in=elections).delete()
+        Ballot.objects.filter(election__in=elections).delete()
+        Voted_User.objects.filter(election__in=elections).delete()
+        Election_Candidate.objects.filter(election__in=elections).delete()
+        Candidate.objects.filter(id__in=candidate_ids).delete()
+        Election.allowed_groups.through.objects.filter(election__in=elections).delete()
+        elections.delete()
+        users = User.objects.filter(username__startswith=f'{prefix}-', username__endswith='@example.com')
+        VotingUser.objects.filter(user__in=users).delete()
+        users.delete()
+        Group.objects.filter(name__startswith=f'{prefix}-group-').delete()
+
+
+def table_sizes(models):
+    """
+    Measures the storage used by the tables of the given models.
+
+    Parameters:
+    models (list): The models to measure.
+
+    Returns:
+    dict: For each table name, the number of rows and the sizes of the table and of its indexes in bytes. The sizes
+          are None if the database cannot report them.
+    """
+    sizes = {}
+    with connection.cursor() as cursor:
+        for model in models:
+            table = model._meta.db_table
+            size = {'rows': model.objects.count(), 'table_bytes': None, 'index_bytes': None}
+            if connection.vendor == 'postgresql':
+                cursor.execute('SELECT pg_relation_size(%s), pg_indexes_size(%s)', [table, table])
+                size['table_bytes'], size['index_bytes'] = cursor.fetchone()
+            elif connection.vendor == 'sqlite':
+                try:
+                    cursor.execute('SELECT SUM(pgsize) FROM dbstat WHERE name = %s', [table])
+                    size['table_bytes'] = cursor.fetchone()[0] or 0
+                    cursor.execute("SELECT SUM(pgsize) FROM dbstat WHERE name IN "
+                                   "(SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = %s)", [table])
+                    size['index_bytes'] = cursor.fetchone()[0] or 0
+                except Exception:
+                    # SQLite was built without the dbstat table.
+                    pass
+            sizes[table] = size
+    return sizes
+
+
+class ClientSession:
+    """
+    A virtual voter sending requests in-process through Django's test client, counting the database queries.
+    """
+
+    def __init__(self):
+        self.client = Client()
+
+    def request(self, method, path, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = getattr(self.client, method)(path, data or {})
+            latency = time.perf_counter() - started
+        return latency, response.status_code, len(queries.captured_queries)
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class HttpSession:
+    """
+    A virtual voter sending requests to a running server over HTTP, with its own cookies and CSRF token.
+    The database queries of the server are not visible, so they are not counted.
+    """
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookies), _NoRedirect)
+
+    def csrf_token(self):
+        for cookie in self.cookies:
+            if cookie.name == 'csrftoken':
+                return cookie.value
+        return ''
+
+    def request(self, method, path, data=None):
+        url = self.base_url + path
+        body = None
+        headers = {}
+        if method == 'post':
+            if not self.csrf_token():
+                # Fetch a page first to receive the CSRF cookie.
+                self.opener.open(url).read()
+            data = dict(data or {}, csrfmiddlewaretoken=self.csrf_token())
+            body = urllib.parse.urlencode(data, doseq=True).encode()
+            headers = {'Referer': url, 'Content-Type': 'application/x-www-form-urlencoded'}
+        started = time.perf_counter()
+        try:
+            with self.opener.open(urllib.request.Request(url, data=body, headers=headers)) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        return time.perf_counter() - started, status, None
+
+
+def run_voting_flow(seeded, session_factory, concurrency):
+    """
+    Lets every seeded voter log in, open the election list, vote in an ongoing election and read an ended election's
+    report, with the given number of voters active at once.
+
+    Parameters:
+    seeded (dict): The data returned by seed_benchmark_data.
+    session_factory (callable): Returns a new ClientSession or HttpSession for a voter.
+    concurrency (int): The number of voters active at once.
+
+    Returns:
+    dict: The summary of each view, keyed by view name, plus the totals under 'all'.
+    """
+    measurements = {}
+    lock = threading.Lock()
+
+    def record(view, measurement):
+        with lock:
+            measurements.setdefault(view, []).append(measurement)
+
+    def voter(index):
+        try:
+            run_voter(index)
+        finally:
+            # Each worker thread has its own database connection in client mode.
+            connection.close()
+
+    def run_voter(index):
+        session = session_factory()
+        username = seeded['usernames'][index]
+        record('login_view', session.request('post', '/', {'username': username, 'password': BENCHMARK_PASSWORD}))
+        record('election_list', session.request('get', '/elections/'))
+        if seeded['ongoing']:
+            election_id, candidate_ids, max_votes = seeded['ongoing'][index % len(seeded['ongoing'])]
+            selected = [candidate_ids[(index + k) % len(candidate_ids)] for k in range(max_votes)]
+            record('election_detail', session.request('post', f'/elections/{election_id}/', {'candidate': selected}))
+        if seeded['ended']:
+            election_id = seeded['ended'][index % len(seeded['ended'])]
+            record('ended_elections_report', session.request('get', f'/elections/{election_id}/report/'))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(voter, range(len(seeded['usernames']))))
+    elapsed = time.perf_counter() - started
+
+    results = {}
+    everything = []
+    for view, values in measurements.items():
+        everything.extend(values)
+        results[view] = summarize([latency for latency, _, _ in values], elapsed,
+                                  [status for _, status, _ in values],
+                                  [count for _, _, count in values if count is not None])
+    results['all'] = summarize([latency for latency, _, _ in everything], elapsed,
+                               [status for _, status, _ in everything],
+                               [count for _, _, count in everything if count is not None])
+    return results
+
+
+def parse_importtime(output):
+    """
+    Parses the report of `python -X importtime`.
+
+    Returns:
+    tuple: The total import time in microseconds and a dictionary mapping top-level packages to the time spent
+           importing their modules, in microseconds.
+    """
+    total = 0
+    packages = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or '[us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        if not name.startswith('  '):
+            total += int(cumulative)
+        package = name.strip().split('.')[0]
+        packages[package] = packages.get(package, 0) + int(own)
+    return total, packages
+
+
+def measure_startup(entry='wsgi', settings_module=None):
+    """
+    Starts a fresh Python process that loads a web entry point and the URLconf, and measures its startup.
+
+    Parameters:
+    entry (str): 'wsgi' or 'asgi'.
+    settings_module (str): The settings of the child process; defaults to DJANGO_SETTINGS_MODULE.
+
+    Returns:
+    dict: The wall-clock seconds of the imports, the total import time and the import time per package in
+          microseconds, the peak RSS in bytes and the HEAVY_MODULES that were imported.
+    """
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module or os.environ.get('DJANGO_SETTINGS_MODULE',
+                                                                                     'votingsite.settings'))
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', STARTUP_SCRIPT, STARTUP_ENTRIES[entry]],
+                               env=env, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                               capture_output=True, text=True)
+    if completed.returncode != 0:
+        errors = [line for line in completed.stderr.splitlines() if not line.startswith('import time:')]
+        raise RuntimeError(f"Loading {STARTUP_ENTRIES[entry]} failed:\n" + '\n'.join(errors))
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    total, packages = parse_importtime(completed.stderr)
+    return {
+        'seconds': result['seconds'],
+        'import_us': total,
+        'packages_us': packages,
+        'max_rss_bytes': result['max_rss_bytes'],
+        'heavy_modules': [name for name in HEAVY_MODULES if name in result['modules']],
+    }
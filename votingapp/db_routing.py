@@ -0,0 +1,117 @@
+"""
+This file routes the reads of read-only pages to the read replicas of the database.
+
+The databases listed in the DATABASE_REPLICAS setting (see votingsite/settings.py) are replicas of 'default'.
+ReplicaRoutingMiddleware picks one of them at random for a GET or HEAD request of a view named in the REPLICA_VIEWS
+setting or of an admin changelist, and ReplicaRouter sends every read of that request to it. All other requests, and
+every write, use 'default'.
+
+A replica lags behind the primary, so a client that has just changed something, for example cast a ballot, would not
+see its own change on a replica. Any request with another method than GET or HEAD therefore sets a cookie that keeps
+the reads of the client on the primary for REPLICA_STICKY_SECONDS seconds.
+
+The caches of the application are filled inside primary(), so that a stale replica cannot put old data back into the
+cache right after a change invalidated it.
+"""
+
+import contextvars
+import random
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.urls import Resolver404, resolve
+
+DEFAULT_STICKY_SECONDS = 15
+
+DEFAULT_REPLICA_VIEWS = ['election_list', 'ended_elections_report']
+
+STICKY_COOKIE = 'votingapp_primary'
+
+READ_METHODS = ('GET', 'HEAD')
+
+_read_alias = contextvars.ContextVar('votingapp_read_alias', default=None)
+
+
+def get_replicas():
+    """
+    Returns the aliases of the replica databases, configurable with the DATABASE_REPLICAS setting.
+    """
+    return list(getattr(settings, 'DATABASE_REPLICAS', []))
+
+
+def get_sticky_seconds():
+    """
+    Returns how long the reads of a client stay on the primary after a write in seconds, configurable with the
+    REPLICA_STICKY_SECONDS setting.
+    """
+    return getattr(settings, 'REPLICA_STICKY_SECONDS', DEFAULT_STICKY_SECONDS)
+
+
+def is_replica_view(view_name):
+    """
+    Tells whether the reads of a view may be served by a replica.
+
+    Parameters:
+    view_name (str): The namespaced name of the URL pattern, e.g. 'election_list' or 'admin:auth_user_changelist'.
+    """
+    if view_name in getattr(settings, 'REPLICA_VIEWS', DEFAULT_REPLICA_VIEWS):
+        return True
+    return view_name.startswith('admin:') and view_name.endswith('_changelist')
+
+
+def choose_read_alias(request):
+    """
+    Returns the alias of the replica the reads of a request are sent to, or None if they go to the primary.
+    """
+    replicas = get_replicas()
+    if not replicas or request.method not in READ_METHODS or STICKY_COOKIE in request.COOKIES:
+        return None
+    try:
+        match = resolve(request.path_info, getattr(request, 'urlconf', None))
+    except Resolver404:
+        return None
+    if not is_replica_view(match.view_name):
+        return None
+    return random.choice(replicas)
+
+
+def get_read_alias():
+    """
+    Returns the alias of the replica chosen for the current request, or None.
+    """
+    return _read_alias.get()
+
+
+@contextmanager
+def use_read_alias(alias):
+    token = _read_alias.set(alias)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+def primary():
+    """
+    Returns a context manager sending the reads made inside it to the primary.
+    """
+    return use_read_alias(None)
+
+
+class ReplicaRouter:
+    """
+    The database router sending the reads of the requests chosen by ReplicaRoutingMiddleware to a replica.
+    """
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas hold the same data as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return False if db in get_replicas() else None
@@ -0,0 +1,204 @@
+"""
+This file implements the cache behind the election list.
+
+The elections visible to a user only depend on the user's groups and on the current date, and change a few times a
+day at most. They are therefore cached per group and date: for every group the cache holds the ongoing and the ended
+elections it is allowed to vote in, as dictionaries mapping election IDs to election names. A user's list is the
+union of the entries of their groups, which also removes the duplicates a user in several groups used to see.
+The elections a user has already voted in are cached separately per user.
+
+Entries are invalidated by the receivers in signals.py when an election or its allowed groups change and when a
+ballot is cast. The entries of a group are not deleted but keyed by a generation of the group, which the receivers
+increment once the change is committed: this drops the entries of every date at once, and an entry loaded before the
+commit and stored after it lands under the old generation, where it is never read. The generations do not expire;
+the entries of old generations do. The functions only use the basic cache API, so they work with the local-memory
+backend as well as with shared backends such as Redis or Memcached. Entries are loaded from the primary database, see
+db_routing.py.
+"""
+
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .db_routing import primary
+from .models import Election, Voted_User
+
+DEFAULT_TIMEOUT = 60 * 60 * 24
+
+
+def get_timeout():
+    """
+    Returns the lifetime of the cache entries in seconds, configurable with the ELECTION_LIST_CACHE_TIMEOUT setting.
+    """
+    return getattr(settings, 'ELECTION_LIST_CACHE_TIMEOUT', DEFAULT_TIMEOUT)
+
+
+def group_key(group_id, generation, date):
+    return f'votingapp:elections:group:{group_id}:{generation}:{date.isoformat()}'
+
+
+def generation_key(group_id):
+    return f'votingapp:elections:generation:{group_id}'
+
+
+def _new_generation():
+    # Not a small counter, so that a generation evicted from the cache is not reused for different data.
+    return time.time_ns()
+
+
+def get_generations(group_ids):
+    """
+    Returns the current generations of the cache entries of the given groups, starting the missing ones.
+
+    Returns:
+    dict: A dictionary mapping group IDs to generations.
+    """
+    keys = {generation_key(group_id): group_id for group_id in group_ids}
+    generations = cache.get_many(list(keys))
+    for key in keys.keys() - generations.keys():
+        cache.add(key, _new_generation(), None)
+        generations[key] = cache.get(key)
+    return {keys[key]: generation for key, generation in generations.items()}
+
+
+async def aget_generations(group_ids):
+    """
+    Async version of get_generations.
+    """
+    keys = {generation_key(group_id): group_id for group_id in group_ids}
+    generations = await cache.aget_many(list(keys))
+    for key in keys.keys() - generations.keys():
+        await cache.aadd(key, _new_generation(), None)
+        generations[key] = await cache.aget(key)
+    return {keys[key]: generation for key, generation in generations.items()}
+
+
+def voted_key(voting_user_id):
+    return f'votingapp:elections:voted:{voting_user_id}'
+
+
+def get_group_elections(group_ids, date):
+    """
+    Returns the ongoing and ended elections of the given groups on the given date.
+
+    Groups missing from the cache are loaded with a single query and stored.
+
+    Parameters:
+    group_ids (iterable): The primary keys of the groups.
+    date (date): The date deciding whether an election is ongoing or ended.
+
+    Returns:
+    tuple: Two dictionaries mapping the IDs of the ongoing and of the ended elections to their names.
+    """
+    # Read before the elections are loaded, so that entries loaded before a change are stored under the generation
+    # that the change ends.
+    generations = get_generations(group_ids)
+    keys = {group_key(group_id, generation, date): group_id for group_id, generation in generations.items()}
+    cached = cache.get_many(list(keys))
+
+    missing = [group_id for key, group_id in keys.items() if key not in cached]
+    if missing:
+        with primary():
+            loaded = _group_entries(missing, _group_elections_query(missing), generations, date)
+        cache.set_many(loaded, get_timeout())
+        cached.update(loaded)
+    return _merge_entries(cached.values())
+
+
+async def aget_group_elections(group_ids, date):
+    """
+    Async version of get_group_elections.
+    """
+    generations = await aget_generations(group_ids)
+    keys = {group_key(group_id, generation, date): group_id for group_id, generation in generations.items()}
+    cached = await cache.aget_many(list(keys))
+
+    missing = [group_id for key, group_id in keys.items() if key not in cached]
+    if missing:
+        with primary():
+            rows = [row async for row in _group_elections_query(missing)]
+        loaded = _group_entries(missing, rows, generations, date)
+        await cache.aset_many(loaded, get_timeout())
+        cached.update(loaded)
+    return _merge_entries(cached.values())
+
+
+def _group_elections_query(group_ids):
+    return (Election.allowed_groups.through.objects.filter(group_id__in=group_ids)
+            .values_list('group_id', 'election_id', 'election__type', 'election__end_date'))
+
+
+def _group_entries(group_ids, rows, generations, date):
+    """
+    Builds the cache entries of the given groups from the rows of _group_elections_query.
+    """
+    entries = {group_id: {'ongoing': {}, 'ended': {}} for group_id in group_ids}
+    for group_id, election_id, election_type, end_date in rows:
+        state = 'ongoing' if end_date >= date else 'ended'
+        entries[group_id][state][election_id] = election_type
+    return {group_key(group_id, generations[group_id], date): entry for group_id, entry in entries.items()}
+
+
+def _merge_entries(entries):
+    ongoing = {}
+    ended = {}
+    for entry in entries:
+        ongoing.update(entry['ongoing'])
+        ended.update(entry['ended'])
+    return ongoing, ended
+
+
+def get_voted_election_ids(voting_user_id):
+    """
+    Returns the IDs of the elections the user has voted in.
+
+    Parameters:
+    voting_user_id (int): The primary key of the VotingUser.
+
+    Returns:
+    set: The IDs of the elections.
+    """
+    key = voted_key(voting_user_id)
+    voted = cache.get(key)
+    if voted is None:
+        with primary():
+            voted = set(_voted_query(voting_user_id))
+        cache.set(key, voted, get_timeout())
+    return voted
+
+
+async def aget_voted_election_ids(voting_user_id):
+    """
+    Async version of get_voted_election_ids.
+    """
+    key = voted_key(voting_user_id)
+    voted = await cache.aget(key)
+    if voted is None:
+        with primary():
+            voted = {election_id async for election_id in _voted_query(voting_user_id)}
+        await cache.aset(key, voted, get_timeout())
+    return voted
+
+
+def _voted_query(voting_user_id):
+    return Voted_User.objects.filter(user_id=voting_user_id).values_list('election_id', flat=True)
+
+
+def invalidate_groups(group_ids):
+    """
+    Drops the cached elections of the given groups, for every date, by starting a new generation of their entries.
+    """
+    for group_id in group_ids:
+        try:
+            cache.incr(generation_key(group_id))
+        except ValueError:
+            # No generation is cached, so the next one is started afresh.
+            pass
+
+
+def invalidate_voted(voting_user_id):
+    """
+    Drops the cached set of elections the user has voted in.
+    """
+    cache.delete(voted_key(voting_user_id))
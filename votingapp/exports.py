@@ -0,0 +1,137 @@
+"""
+This file exports the raw ballots (Vote and Ballot rows) of an election for audits, as CSV or NDJSON, optionally
+gzip-compressed.
+
+The rows are read with a server-side cursor in chunks (QuerySet.iterator) and written out as they arrive, so the
+memory used by an export does not depend on the number of votes. The same generators back the download view and the
+`export_ballots` management command.
+
+Each row is one selected candidate: the vote ID (for Vote rows) or the ballot ID (for Ballot rows, which yield one row
+per selection), the election ID, the candidate ID, the candidate's name and the date of the vote. Ballots are not
+linked to voters, so the export does not reveal who voted for whom.
+
+The ballots of an election compacted with `compact_ballots --purge` are read from its ballot archive (see
+archives.py) instead. The archive keeps neither the IDs nor the dates of the ballots, so those rows leave them empty
+and give the position of the ballot in the archive as `archived_ballot`, which tells the selections of one ballot
+apart.
+"""
+
+import csv
+import io
+import json
+import zlib
+
+from .archives import open_archive
+from .models import Ballot, Vote, Election_Candidate, unpack_candidate_ids
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+FIELDS = ['vote_id', 'ballot_id', 'election_id', 'candidate_id', 'candidate', 'date', 'archived_ballot']
+
+DEFAULT_CHUNK_SIZE = 5000
+
+# The size of the pieces handed to the response or the output file.
+BUFFER_SIZE = 64 * 1024
+
+
+def ballot_rows(election_id, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yields the selections of an election's ballots, the Vote rows first and then the Ballot rows, each in the order
+    they were cast. If the rows of the election were purged after it was archived, the ballots are read from its
+    archive.
+
+    Parameters:
+    election_id (int): The primary key of the election.
+    chunk_size (int): The number of rows fetched from the database at a time.
+
+    Yields:
+    list: The values of the FIELDS of one selection.
+    """
+    # Elections have few candidates, so their names are looked up once instead of being joined to every vote.
+    candidates = {
+        candidate_id: f'{name} {surname}'
+        for candidate_id, name, surname in Election_Candidate.objects.filter(election_id=election_id)
+        .values_list('candidate_id', 'candidate__name', 'candidate__surname')
+    }
+
+    archive = open_archive(election_id)
+    if archive is not None:
+        with archive:
+            if not (Vote.objects.filter(election_id=election_id).exists()
+                    or Ballot.objects.filter(election_id=election_id).exists()):
+                # The names at the time the election was archived.
+                candidates.update((int(candidate_id), name)
+                                  for candidate_id, name in archive.metadata['candidates'].items())
+                for position, candidate_ids in enumerate(archive.ballots(chunk_size), start=1):
+                    for candidate_id in candidate_ids:
+                        yield [None, None, election_id, candidate_id, candidates.get(candidate_id, ''), None,
+                               position]
+                return
+
+    votes = (Vote.objects.filter(election_id=election_id).order_by('id')
+             .values_list('id', 'candidate_id', 'date').iterator(chunk_size=chunk_size))
+    for vote_id, candidate_id, date in votes:
+        yield [vote_id, None, election_id, candidate_id, candidates.get(candidate_id, ''), date.isoformat(), None]
+
+    ballots = (Ballot.objects.filter(election_id=election_id).order_by('id')
+               .values_list('id', 'selections', 'date').iterator(chunk_size=chunk_size))
+    for ballot_id, selections, date in ballots:
+        for candidate_id in unpack_candidate_ids(selections):
+            yield [None, ballot_id, election_id, candidate_id, candidates.get(candidate_id, ''), date.isoformat(),
+                   None]
+
+
+def export_chunks(election_id, export_format='csv', compress=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yields an election's ballot export in pieces of roughly BUFFER_SIZE bytes.
+
+    Parameters:
+    election_id (int): The primary key of the election.
+    export_format (str): 'csv' or 'ndjson'.
+    compress (bool): Whether to gzip-compress the output.
+    chunk_size (int): The number of rows fetched from the database at a time.
+
+    Yields:
+    bytes: The next piece of the export.
+    """
+    if export_format not in FORMATS:
+        raise ValueError(f"Unknown export format: {export_format}")
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if export_format == 'csv' else None
+    if writer:
+        writer.writerow(FIELDS)
+
+    compressor = zlib.compressobj(wbits=31) if compress else None
+
+    def encode(text):
+        data = text.encode('utf-8')
+        return compressor.compress(data) if compressor else data
+
+    for row in ballot_rows(election_id, chunk_size):
+        if writer:
+            writer.writerow(row)
+        else:
+            buffer.write(json.dumps(dict(zip(FIELDS, row))) + '\n')
+        if buffer.tell() >= BUFFER_SIZE:
+            piece = encode(buffer.getvalue())
+            buffer.seek(0)
+            buffer.truncate()
+            if piece:
+                yield piece
+
+    piece = encode(buffer.getvalue())
+    if compressor:
+        piece += compressor.flush()
+    if piece:
+        yield piece
+
+
+def export_filename(election_id, export_format='csv', compress=False):
+    """
+    Returns the file name of an election's ballot export.
+    """
+    return f'election-{election_id}-ballots.{export_format}' + ('.gz' if compress else '')
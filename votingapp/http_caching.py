@@ -0,0 +1,124 @@
+"""
+This file adds HTTP caching to the election report pages.
+
+A report page only changes when its election or the election's tallies change, so it is given an ETag computed from
+those: the details and end state of the election and its per-candidate tally sums, read with one query on the
+Vote_Tally rows, or the checksum of the election's ballot archive (see archives.py) without any query. A browser or
+proxy revalidating a page it already holds gets a 304 response before the report is built. Turnout changes caused by
+voters joining or leaving the election's groups do not change the ETag.
+
+The results of an ended election are final, so its report is sent with a Last-Modified date at the end of the
+election and a Cache-Control header that lets browsers and shared caches (a reverse proxy or CDN) keep it for
+REPORT_FINAL_MAX_AGE seconds without asking again (marked immutable, so browsers do not revalidate it on reload).
+The report of an ongoing election may be kept by shared caches for REPORT_ONGOING_MAX_AGE seconds, and is revalidated
+by browsers on every view.
+"""
+
+import datetime
+import hashlib
+import json
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from .archives import open_archive
+from .reports import REPORT_VERSION
+from .tallies import acount_tallies, count_tallies
+
+DEFAULT_FINAL_MAX_AGE = 24 * 60 * 60
+DEFAULT_ONGOING_MAX_AGE = 10
+
+
+def get_final_max_age():
+    """
+    Returns how long the reports of ended elections may be cached in seconds, configurable with the
+    REPORT_FINAL_MAX_AGE setting.
+    """
+    return getattr(settings, 'REPORT_FINAL_MAX_AGE', DEFAULT_FINAL_MAX_AGE)
+
+
+def get_ongoing_max_age():
+    """
+    Returns how long shared caches may keep the reports of ongoing elections in seconds, configurable with the
+    REPORT_ONGOING_MAX_AGE setting.
+    """
+    return getattr(settings, 'REPORT_ONGOING_MAX_AGE', DEFAULT_ONGOING_MAX_AGE)
+
+
+def is_final(election):
+    """
+    Tells whether an election has ended, so that its results can no longer change.
+    """
+    return election.end_date < timezone.now().date()
+
+
+def _validators(election, tallies):
+    content = {
+        'version': REPORT_VERSION,
+        'election': [election.id, election.type, str(election.start_date), str(election.end_date), election.max_votes],
+        'final': is_final(election),
+        'tallies': tallies,
+    }
+    etag = hashlib.sha256(json.dumps(content, sort_keys=True).encode('utf-8')).hexdigest()[:32]
+    last_modified = None
+    if content['final']:
+        ended = datetime.datetime.combine(election.end_date + datetime.timedelta(days=1), datetime.time())
+        last_modified = int(timezone.make_aware(ended).timestamp())
+    return etag, last_modified
+
+
+def report_validators(election):
+    """
+    Computes the validators of an election's report page.
+
+    Parameters:
+    election (Election): The election the report is about.
+
+    Returns:
+    tuple: The ETag (without quotes) and the Last-Modified timestamp, which is None for ongoing elections.
+    """
+    archive = open_archive(election.id)
+    if archive is not None:
+        with archive:
+            return _validators(election, archive.checksum.hex())
+    return _validators(election, sorted(count_tallies(election.id).items()))
+
+
+async def areport_validators(election):
+    """
+    Async version of report_validators.
+    """
+    archive = open_archive(election.id)
+    if archive is not None:
+        with archive:
+            return _validators(election, archive.checksum.hex())
+    return _validators(election, sorted((await acount_tallies(election.id)).items()))
+
+
+def patch_report_headers(response, election, validators):
+    """
+    Sets the ETag, Last-Modified and Cache-Control headers of a report page response.
+    """
+    etag, last_modified = validators
+    response.headers['ETag'] = quote_etag(etag)
+    if last_modified is not None:
+        response.headers['Last-Modified'] = http_date(last_modified)
+    if is_final(election):
+        patch_cache_control(response, public=True, max_age=get_final_max_age(), immutable=True)
+    else:
+        patch_cache_control(response, public=True, max_age=0, s_maxage=get_ongoing_max_age(), must_revalidate=True)
+    return response
+
+
+def not_modified(request, election, validators):
+    """
+    Returns the 304 (or 412) response to a conditional request for a report page the client already holds, or None
+    if the page has to be sent.
+    """
+    etag, last_modified = validators
+    response = get_conditional_response(request, etag=quote_etag(etag), last_modified=last_modified)
+    if response is not None:
+        patch_report_headers(response, election, validators)
+    return response
@@ -0,0 +1,23 @@
+"""
+This file holds the entry points of the password hashing processes started by voter_import.py.
+
+The worker processes import this module before Django is set up, so it must not import models or anything that
+depends on them at module level.
+"""
+
+from .report_worker import init_worker  # noqa: F401
+
+
+def hash_passwords(passwords):
+    """
+    Hashes a batch of passwords with the configured password hasher.
+
+    Parameters:
+    passwords (list): The plain-text passwords.
+
+    Returns:
+    list: The password hashes, in the same order.
+    """
+    from django.contrib.auth.hashers import make_password
+
+    return [make_password(password) for password in passwords]
@@ -0,0 +1,531 @@
+"""
+This file implements the write-behind ingestion log, an optional way of storing ballots for elections with bursts of
+voters larger than the database can take ballot by ballot.
+
+With the BALLOT_INGESTION setting set to 'log', cast_ballot (see ballots.py) validates a ballot and hands it to
+IngestLog.submit, which appends it to the current segment of the log in INGEST_LOG_DIR and returns once the segment has
+been fsynced. Voters submitting at the same time share one fsync (group commit), so a burst costs a few disk syncs
+instead of one database transaction per ballot. A background flusher then reads the durable records every
+INGEST_FLUSH_INTERVAL seconds and stores them with ballots.store_ballots, up to INGEST_FLUSH_BATCH ballots per
+transaction, and records how far it got in a checkpoint file.
+
+Double voting is rejected before a ballot is appended, from an in-memory index of the voters of each election. The
+index of an election is loaded from its Voted_User rows the first time a ballot is submitted for it, merged with the
+voters of the records that were not flushed yet. Because the index lives in one process, only one process may use a
+log directory at a time: the server must run a single worker process (for example gunicorn --workers 1 --threads 16)
+that opens the log itself. The directory is locked while the log is open, so start_if_enabled fails in any other
+process, and a process forked after the log was opened (gunicorn --preload) refuses to use the log it inherited.
+
+When the log is opened, a torn record at the end of a segment (from a crash in the middle of a write) is truncated and
+the records after the checkpoint are flushed again. Bytes that cannot be read as records, the truncated ones or a
+damaged record in the middle of a segment together with the records after it, are moved aside to a
+`damaged-<segment>-<offset>.log` file in the log directory and reported as errors, so that the later records keep being
+stored and the damaged ones can be inspected. Replaying is idempotent: store_ballots only stores a ballot if the
+Voted_User slot of its voter can still be claimed, so the ballots stored before the crash are not stored twice.
+
+Layout of a record, with all integers little-endian:
+    header:  RECORD: the length of the payload and its CRC-32.
+    payload: JSON with the election ID (e), the voting user ID (u), the selected candidate IDs (c) and the date (d).
+"""
+
+import atexit
+import datetime
+import fcntl
+import json
+import logging
+import os
+import struct
+import threading
+import zlib
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections, connection
+
+from .ballots import AlreadyVotedError, get_ingestion_mode, store_ballots
+from .models import Voted_User
+
+logger = logging.getLogger(__name__)
+
+RECORD = struct.Struct('<II')
+
+DEFAULT_FLUSH_INTERVAL = 0.5
+DEFAULT_FLUSH_BATCH = 5000
+DEFAULT_SEGMENT_BYTES = 64 * 1024 * 1024
+
+CHECKPOINT = 'checkpoint.json'
+LOCK = 'lock'
+
+
+class IngestError(Exception):
+    """
+    Raised when the ingestion log cannot be opened or written.
+    """
+
+
+def get_log_dir():
+    """
+    Returns the directory of the ingestion log, configurable with the INGEST_LOG_DIR setting.
+    """
+    return Path(getattr(settings, 'INGEST_LOG_DIR', Path(settings.BASE_DIR) / 'ingest_log'))
+
+
+def get_flush_interval():
+    """
+    Returns the interval at which the log is flushed to the database in seconds, configurable with the
+    INGEST_FLUSH_INTERVAL setting. With 0 the log is not flushed in the background.
+    """
+    return getattr(settings, 'INGEST_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL)
+
+
+def get_flush_batch():
+    """
+    Returns the largest number of ballots stored per transaction, configurable with the INGEST_FLUSH_BATCH setting.
+    """
+    return max(1, int(getattr(settings, 'INGEST_FLUSH_BATCH', DEFAULT_FLUSH_BATCH)))
+
+
+def get_segment_bytes():
+    """
+    Returns the size after which a new segment is started, configurable with the INGEST_SEGMENT_BYTES setting.
+    """
+    return getattr(settings, 'INGEST_SEGMENT_BYTES', DEFAULT_SEGMENT_BYTES)
+
+
+def segment_path(directory, segment):
+    return Path(directory) / f'segment-{segment:012d}.log'
+
+
+def damaged_path(path, offset):
+    return Path(path).with_name(f'damaged-{Path(path).stem[8:]}-{offset}.log')
+
+
+def list_segments(directory):
+    """
+    Returns the numbers of the segments in a log directory, in ascending order.
+    """
+    return sorted(int(path.name[8:-4]) for path in Path(directory).glob('segment-*.log'))
+
+
+def read_checkpoint(directory):
+    """
+    Returns the position, as a (segment, offset) tuple, up to which the log has been stored in the database.
+    """
+    try:
+        with open(Path(directory) / CHECKPOINT, encoding='utf-8') as checkpoint:
+            position = json.load(checkpoint)
+    except FileNotFoundError:
+        return 1, 0
+    return position['segment'], position['offset']
+
+
+def quarantine(path, start, stop=None):
+    """
+    Copies the bytes of a segment that cannot be read as records to a file next to it, and reports them.
+
+    Parameters:
+    path (Path): The path of the segment.
+    start (int): The offset of the first unreadable byte.
+    stop (int): The offset after the last unreadable byte; the end of the file if not given.
+
+    Returns:
+    Path: The path of the copy.
+    """
+    with open(path, 'rb') as segment:
+        segment.seek(start)
+        data = segment.read() if stop is None else segment.read(max(0, stop - start))
+    target = damaged_path(path, start)
+    with open(target, 'wb') as damaged:
+        damaged.write(data)
+        damaged.flush()
+        os.fsync(damaged.fileno())
+    logger.error("Moved %s unreadable bytes at offset %s of %s to %s; the ballots in them were not stored",
+                 len(data), start, path, target)
+    return target
+
+
+def write_checkpoint(directory, position):
+    path = Path(directory) / CHECKPOINT
+    tmp_path = path.with_suffix('.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as checkpoint:
+        json.dump({'segment': position[0], 'offset': position[1]}, checkpoint)
+        checkpoint.flush()
+        os.fsync(checkpoint.fileno())
+    os.replace(tmp_path, path)
+
+
+def encode_record(election_id, voting_user_id, candidate_ids, date):
+    payload = json.dumps({'e': election_id, 'u': voting_user_id, 'c': list(candidate_ids), 'd': date.isoformat()},
+                         separators=(',', ':')).encode('utf-8')
+    return RECORD.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def read_records(path, offset=0, end=None, limit=None):
+    """
+    Reads the records of a segment.
+
+    Parameters:
+    path (Path): The path of the segment.
+    offset (int): The offset of the first record to read.
+    end (int): The offset to stop reading at; the end of the file if not given.
+    limit (int): The largest number of records to read.
+
+    Returns:
+    tuple: The records as (election ID, voting user ID, candidate IDs, date) tuples, and the offset after the last
+           valid record read. Reading stops at the first torn or corrupt record.
+    """
+    records = []
+    with open(path, 'rb') as segment:
+        segment.seek(offset)
+        data = segment.read() if end is None else segment.read(max(0, end - offset))
+    position = 0
+    while position + RECORD.size <= len(data) and (limit is None or len(records) < limit):
+        length, checksum = RECORD.unpack_from(data, position)
+        payload = data[position + RECORD.size:position + RECORD.size + length]
+        if len(payload) < length or zlib.crc32(payload) != checksum:
+            break
+        record = json.loads(payload)
+        records.append((record['e'], record['u'], record['c'], datetime.date.fromisoformat(record['d'])))
+        position += RECORD.size + length
+    return records, offset + position
+
+
+def log_status(directory=None):
+    """
+    Describes a log directory without opening the log, so it can be used while a server holds it.
+
+    Returns:
+    dict: The checkpoint, the segments with their sizes in bytes, the number of bytes not stored in the database and
+          the names of the files holding unreadable bytes.
+    """
+    directory = Path(directory or get_log_dir())
+    checkpoint = read_checkpoint(directory)
+    segments = {segment: segment_path(directory, segment).stat().st_size for segment in list_segments(directory)}
+    pending = sum(max(0, size - (checkpoint[1] if segment == checkpoint[0] else 0))
+                  for segment, size in segments.items() if segment >= checkpoint[0])
+    damaged = sorted(path.name for path in directory.glob('damaged-*.log'))
+    return {'directory': directory, 'checkpoint': checkpoint, 'segments': segments, 'pending_bytes': pending,
+            'damaged': damaged}
+
+
+class IngestLog:
+    """
+    An open ingestion log.
+
+    submit may be called from any number of threads. Locks are taken in the order _flush_lock, _sync_lock, _lock.
+    """
+
+    def __init__(self, directory, flush_interval=None):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._voters = {}
+        self._recovered = {}
+        self._stopped = threading.Event()
+        self._thread = None
+
+        self._lock_file = open(self.directory / LOCK, 'a+')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock_file.seek(0)
+            holder = self._lock_file.read().strip() or 'unknown'
+            self._lock_file.close()
+            raise IngestError(f"The ingestion log in {self.directory} is in use by another process (PID {holder}).")
+        # Names the holder of the lock in the error of the processes that cannot take it.
+        self._lock_file.truncate(0)
+        self._lock_file.write(f'{self.pid}\n')
+        self._lock_file.flush()
+        try:
+            self._recover()
+        except BaseException:
+            self._lock_file.close()
+            raise
+
+        interval = get_flush_interval() if flush_interval is None else flush_interval
+        if interval:
+            self._thread = threading.Thread(target=self._run, args=(interval,), name='ballot-ingest-flusher',
+                                            daemon=True)
+            self._thread.start()
+
+    def _recover(self):
+        """
+        Truncates torn records, notes the voters of the records not stored yet and opens the last segment.
+        """
+        self._checkpoint = read_checkpoint(self.directory)
+        segments = list_segments(self.directory)
+        for segment in segments:
+            if segment < self._checkpoint[0]:
+                segment_path(self.directory, segment).unlink()
+                continue
+            path = segment_path(self.directory, segment)
+            records, end = read_records(path, self._checkpoint[1] if segment == self._checkpoint[0] else 0)
+            if end < path.stat().st_size:
+                logger.warning("Truncating a torn record at offset %s of %s", end, path)
+                quarantine(path, end)
+                os.truncate(path, end)
+            for election_id, voting_user_id, _, _ in records:
+                self._recovered.setdefault(election_id, set()).add(voting_user_id)
+
+        self._segment = max([self._checkpoint[0]] + segments)
+        self._open_segment()
+        os.fsync(self._fd)
+        self._durable = (self._segment, self._offset)
+
+    def _open_segment(self):
+        self._fd = os.open(segment_path(self.directory, self._segment), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        self._offset = os.fstat(self._fd).st_size
+        self._torn = False
+
+    def _rotate(self):
+        os.fsync(self._fd)
+        os.close(self._fd)
+        self._durable = max(self._durable, (self._segment, self._offset))
+        self._segment += 1
+        self._open_segment()
+
+    def _election_voters(self, election_id):
+        voters = self._voters.get(election_id)
+        if voters is None:
+            voters = set(Voted_User.objects.filter(election_id=election_id).values_list('user_id', flat=True))
+            voters |= self._recovered.pop(election_id, set())
+            self._voters[election_id] = voters
+        return voters
+
+    def submit(self, election_id, voting_user_id, candidate_ids, date):
+        """
+        Appends a ballot to the log and returns once it is durable.
+
+        Parameters:
+        election_id (int): The primary key of the election.
+        voting_user_id (int): The primary key of the voter.
+        candidate_ids (list): The validated candidate IDs.
+        date (date): The date of the ballot.
+
+        Raises:
+        AlreadyVotedError: If the user has already voted in the election, or has a ballot in the log.
+        IngestError: If the log has been closed, or the ballot could not be written whole or made durable.
+        """
+        record = encode_record(election_id, voting_user_id, candidate_ids, date)
+        with self._lock:
+            if self._fd is None:
+                raise IngestError("The ingestion log is closed.")
+            voters = self._election_voters(election_id)
+            if voting_user_id in voters:
+                raise AlreadyVotedError(f"User {voting_user_id} has already voted in election {election_id}")
+            try:
+                if self._torn:
+                    self._repair()
+                if self._offset and self._offset + len(record) > get_segment_bytes():
+                    self._rotate()
+                # Set until the record is known to be whole, since a failed write may still have written part of it.
+                self._torn = True
+                written = os.write(self._fd, record)
+                if written != len(record):
+                    self._repair()
+                    raise IngestError(f"Short write to segment {self._segment} of the ingestion log.")
+                self._torn = False
+            except OSError as e:
+                raise IngestError(f"Cannot write to segment {self._segment} of the ingestion log: {e}") from e
+            self._offset += written
+            # Added before the sync, so that a second ballot of the voter submitted meanwhile is refused.
+            voters.add(voting_user_id)
+            position = (self._segment, self._offset)
+        try:
+            self._sync(position)
+        except IngestError:
+            # The voter was told the ballot failed, so may cast it again. A copy that turns out durable after all is
+            # only stored once, by the Voted_User claim of store_ballots.
+            with self._lock:
+                voters.discard(voting_user_id)
+            raise
+
+    def _repair(self):
+        """
+        Removes the bytes of a record that was not written whole from the end of the segment, so that the next record
+        follows the last whole one instead of a torn record that the flush would stop at. If the segment cannot be
+        truncated, the next records go to a new segment and the torn bytes are moved aside when the flush reaches them.
+        """
+        try:
+            os.ftruncate(self._fd, self._offset)
+        except OSError:
+            logger.exception("Cannot truncate a torn record at offset %s of segment %s", self._offset, self._segment)
+            self._rotate()
+        self._torn = False
+
+    def _sync(self, position):
+        """
+        Waits until the log is durable up to a position. One caller fsyncs everything written so far while the others
+        wait for it, so concurrent submissions share the fsync.
+
+        Raises:
+        IngestError: If the segment cannot be synced.
+        """
+        with self._sync_lock:
+            if self._durable >= position:
+                return
+            try:
+                with self._lock:
+                    target = (self._segment, self._offset)
+                    # A duplicate, since the segment may be rotated and closed during the fsync.
+                    fd = os.dup(self._fd)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            except OSError as e:
+                raise IngestError(f"Cannot sync segment {target[0]} of the ingestion log: {e}") from e
+            with self._lock:
+                self._durable = max(self._durable, target)
+
+    def flush(self):
+        """
+        Stores the durable records after the checkpoint in the database, in batches of INGEST_FLUSH_BATCH ballots.
+
+        Returns:
+        int: The number of ballots stored; replayed ballots that were already stored are not counted.
+        """
+        stored = 0
+        with self._flush_lock:
+            while True:
+                durable = self._durable
+                segment, offset = self._checkpoint
+                if (segment, offset) >= durable:
+                    break
+                path = segment_path(self.directory, segment)
+                end = durable[1] if segment == durable[0] else None
+                records, reached = read_records(path, offset, end, get_flush_batch())
+                if records:
+                    stored += len(store_ballots(records))
+                    self._checkpoint = (segment, reached)
+                elif reached < (end if end is not None else path.stat().st_size):
+                    # A damaged record before the durable end, which no later flush could read either. The durable
+                    # positions are record boundaries, so the records written after them can still be read.
+                    quarantine(path, reached, end)
+                    self._checkpoint = (segment, end) if end is not None else (segment + 1, 0)
+                elif segment < durable[0]:
+                    # The segment was read to its end, and every record after it is in the next one.
+                    self._checkpoint = (segment + 1, 0)
+                else:
+                    break
+                write_checkpoint(self.directory, self._checkpoint)
+                if self._checkpoint[0] > segment:
+                    path.unlink()
+        return stored
+
+    def _run(self, interval):
+        while not self._stopped.wait(interval):
+            try:
+                self.flush()
+            except Exception:
+                # The records stay in the log and are stored by a later flush.
+                logger.exception("Flushing the ingestion log in %s failed", self.directory)
+            finally:
+                close_old_connections()
+        connection.close()
+
+    def forget(self):
+        """
+        Closes the descriptors of a log inherited from the parent process, which keeps the log open, without storing
+        records or releasing the lock.
+        """
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        self._lock_file.close()
+
+    def close(self):
+        """
+        Stops the flusher, stores the remaining records and releases the log directory.
+        """
+        if self._fd is None:
+            return
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        try:
+            self.flush()
+        finally:
+            with self._lock:
+                os.close(self._fd)
+                self._fd = None
+            self._lock_file.close()
+
+
+_log = None
+_log_lock = threading.Lock()
+
+# The PID of the process the log was opened by, if this process was forked from it while the log was open.
+_inherited_from = None
+
+
+def _after_fork():
+    """
+    Drops the log inherited by a forked process. Its flusher thread, its voter index and the lock of its directory
+    belong to the parent, so the child must not append to it or store its records.
+    """
+    global _log, _log_lock, _inherited_from
+    # The lock may have been held by another thread of the parent when it forked.
+    _log_lock = threading.Lock()
+    if _log is not None:
+        _inherited_from = _log.pid
+        _log.forget()
+        _log = None
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def get_log():
+    """
+    Returns the ingestion log of this process, opening it in INGEST_LOG_DIR if needed.
+
+    Raises:
+    IngestError: If the log cannot be opened, or this process was forked from the process holding it.
+    """
+    global _log
+    with _log_lock:
+        if _inherited_from is not None:
+            raise IngestError(f"The ingestion log was opened by process {_inherited_from} before process "
+                              f"{os.getpid()} was forked from it; only the process that opens the log may use it.")
+        if _log is None or _log.directory != get_log_dir():
+            if _log is not None:
+                _log.close()
+            _log = IngestLog(get_log_dir())
+        return _log
+
+
+def close_log():
+    """
+    Closes the ingestion log of this process, if it is open.
+    """
+    global _log
+    with _log_lock:
+        if _log is not None:
+            _log.close()
+            _log = None
+
+
+def start_if_enabled():
+    """
+    Opens the ingestion log when the BALLOT_INGESTION setting is 'log', so that the ballots left in it by a previous
+    run are stored before the first request. Called by the WSGI and ASGI entry points.
+
+    Raises:
+    ImproperlyConfigured: If another process holds the log, so that a server started with several workers fails at
+                          startup instead of on the first ballot.
+    """
+    if get_ingestion_mode() != 'log':
+        return
+    try:
+        get_log()
+    except IngestError as e:
+        raise ImproperlyConfigured(f"{e} BALLOT_INGESTION 'log' needs the server to run in a single worker process "
+                                   f"that is not forked after loading the application (no gunicorn --preload).") from e
+
+
+atexit.register(close_log)
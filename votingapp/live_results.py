@@ -0,0 +1,274 @@
+"""
+This file streams the live results of elections to their observers as Server-Sent Events.
+
+Every committed ballot marks its election as changed (see the ballot_cast receiver in signals.py). A broadcaster task,
+running on the event loop of the ASGI server, wakes up every LIVE_RESULTS_INTERVAL seconds and, for each watched
+election that changed, reads its tallies once and sends the same encoded event to every subscriber. The cost of an
+update therefore depends on the number of elections being watched, not on the number of observers, and no client
+ever makes the server poll the database.
+
+Each event carries the full results and the change since the previous event, so a client that missed events (a slow
+client whose queue overflowed, or one that reconnected) is back in sync with the next one. The changes are marked in
+the process that stored the ballot; with several server processes, each one also re-reads the watched elections every
+LIVE_RESULTS_REFRESH seconds to pick up the ballots cast elsewhere.
+
+A stream ends with the election: at the end of its last day the stream sends the final results and an `end` event,
+after which the browser stops listening, and the streams of ended elections are refused with a 204 response, which
+also stops the browsers that reconnect.
+
+Under WSGI a response cannot stay open without holding a worker thread, so the stream sends the current results and
+asks the browser to reconnect after LIVE_RESULTS_REFRESH seconds instead.
+"""
+
+import asyncio
+import datetime
+import json
+import threading
+import time
+from collections import Counter
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Election_Candidate
+from .tallies import count_tallies
+
+DEFAULT_INTERVAL = 1.0
+DEFAULT_REFRESH = 10.0
+
+# The number of seconds after which an idle stream gets a comment, so that proxies do not close it.
+HEARTBEAT = 15.0
+
+# The number of events kept for a subscriber that does not read them; older ones are dropped.
+QUEUE_SIZE = 8
+
+KEEPALIVE = b': keepalive\n\n'
+
+
+def get_interval():
+    """
+    Returns the interval at which changes are sent in seconds, configurable with the LIVE_RESULTS_INTERVAL setting.
+    """
+    return getattr(settings, 'LIVE_RESULTS_INTERVAL', DEFAULT_INTERVAL)
+
+
+def get_refresh():
+    """
+    Returns the interval at which watched elections are re-read in seconds, configurable with the
+    LIVE_RESULTS_REFRESH setting.
+    """
+    return getattr(settings, 'LIVE_RESULTS_REFRESH', DEFAULT_REFRESH)
+
+
+def encode_event(event, data, event_id=None, retry=None):
+    """
+    Encodes a Server-Sent Event.
+
+    Parameters:
+    event (str): The event type.
+    data (dict): The data of the event, sent as JSON.
+    event_id (int): The ID of the event, if any.
+    retry (float): The number of seconds the browser should wait before reconnecting, if the stream ends.
+    """
+    lines = []
+    if retry is not None:
+        lines.append(f'retry: {int(retry * 1000)}')
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event}')
+    lines.append(f'data: {json.dumps(data, separators=(",", ":"))}')
+    return ('\n'.join(lines) + '\n\n').encode('utf-8')
+
+
+def closing_time(election):
+    """
+    Returns the moment an election ends: the start of the day after its end date, when http_caching.is_final starts
+    telling that it has ended.
+    """
+    return datetime.datetime.combine(election.end_date + datetime.timedelta(days=1), datetime.time(),
+                                     tzinfo=datetime.timezone.utc)
+
+
+def load_results(election_id, names=None):
+    """
+    Reads the results of an election from its tallies.
+
+    Parameters:
+    election_id (int): The primary key of the election.
+    names (dict): The names of the candidates by primary key, if they are already known.
+
+    Returns:
+    tuple: The names of the candidates by primary key, and the votes per candidate name.
+    """
+    if names is None:
+        names = {
+            candidate_id: f'{name} {surname}'
+            for candidate_id, name, surname in Election_Candidate.objects.filter(election_id=election_id)
+            .values_list('candidate_id', 'candidate__name', 'candidate__surname')
+        }
+    votes = Counter()
+    for candidate_id, count in count_tallies(election_id).items():
+        votes[names.get(candidate_id, str(candidate_id))] += count
+    return names, dict(votes)
+
+
+def results_event(election_id, retry=None):
+    """
+    Encodes an event with the current results of an election, in the form sent by the stream.
+    """
+    channel = _Channel(election_id)
+    channel.publish(*load_results(election_id))
+    if retry is not None:
+        channel.message = f'retry: {int(retry * 1000)}\n'.encode('utf-8') + channel.message
+    return channel.message
+
+
+class _Channel:
+    """
+    The subscribers of one election and the last results sent to them.
+    """
+
+    def __init__(self, election_id):
+        self.election_id = election_id
+        self.subscribers = set()
+        self.names = None
+        self.votes = None
+        self.event_id = 0
+        self.message = None
+        self.refreshed = 0.0
+        self.sent = 0.0
+
+    def publish(self, names, votes):
+        """
+        Stores new results and returns the event announcing them, or None if they did not change.
+        """
+        if votes == self.votes:
+            return None
+        previous = self.votes or {}
+        self.names = names
+        self.votes = votes
+        self.event_id += 1
+        self.message = encode_event('results', {
+            'election_id': self.election_id,
+            'total_votes': sum(votes.values()),
+            'candidate_votes': votes,
+            'delta': {name: votes.get(name, 0) - previous.get(name, 0) for name in sorted(set(votes) | set(previous))
+                      if votes.get(name, 0) != previous.get(name, 0)},
+        }, event_id=self.event_id)
+        return self.message
+
+
+class LiveResultsHub:
+    """
+    The in-process publisher of live results.
+
+    mark_changed may be called from any thread; the other methods run on the event loop of the server.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._changed = set()
+        self._watched = set()
+        self._channels = {}
+        self._task = None
+
+    def mark_changed(self, election_id):
+        """
+        Notes that the results of an election changed, if anyone is watching it.
+        """
+        with self._lock:
+            if election_id in self._watched:
+                self._changed.add(election_id)
+
+    async def subscribe(self, election_id):
+        """
+        Registers a subscriber to the results of an election.
+
+        Returns:
+        asyncio.Queue: The queue the encoded events for the subscriber are put in, starting with the current results.
+        """
+        results = None
+        channel = self._channels.get(election_id)
+        if channel is None or channel.message is None:
+            results = await sync_to_async(load_results)(election_id)
+
+        # Nothing is awaited from here on, so the channel cannot be dropped by unsubscribe before the queue is added.
+        channel = self._channels.get(election_id)
+        if channel is None:
+            channel = self._channels[election_id] = _Channel(election_id)
+            with self._lock:
+                self._watched.add(election_id)
+        if channel.message is None:
+            channel.publish(*results)
+            channel.refreshed = time.monotonic()
+
+        queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        queue.put_nowait(channel.message)
+        channel.subscribers.add(queue)
+        channel.sent = time.monotonic()
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._task = loop.create_task(self._broadcast())
+        return queue
+
+    def unsubscribe(self, election_id, queue):
+        channel = self._channels.get(election_id)
+        if channel is None:
+            return
+        channel.subscribers.discard(queue)
+        if not channel.subscribers:
+            del self._channels[election_id]
+            with self._lock:
+                self._watched.discard(election_id)
+                self._changed.discard(election_id)
+
+    @staticmethod
+    def _send(channel, message):
+        for queue in channel.subscribers:
+            if queue.full():
+                # Every event holds the full results, so a slow subscriber only needs the latest ones.
+                queue.get_nowait()
+            queue.put_nowait(message)
+        channel.sent = time.monotonic()
+
+    async def _broadcast(self):
+        while self._channels:
+            await asyncio.sleep(get_interval())
+            with self._lock:
+                changed, self._changed = self._changed, set()
+            now = time.monotonic()
+            for election_id, channel in list(self._channels.items()):
+                if election_id in changed or now - channel.refreshed >= get_refresh():
+                    names, votes = await sync_to_async(load_results)(election_id, channel.names)
+                    channel.refreshed = now
+                    message = channel.publish(names, votes)
+                    if message is not None:
+                        self._send(channel, message)
+                        continue
+                if now - channel.sent >= HEARTBEAT:
+                    self._send(channel, KEEPALIVE)
+
+
+hub = LiveResultsHub()
+
+
+async def stream_results(election):
+    """
+    Yields the encoded events of the live results of an election until the client disconnects or the election ends,
+    and then the final results and an `end` event.
+    """
+    queue = await hub.subscribe(election.id)
+    try:
+        while True:
+            remaining = (closing_time(election) - timezone.now()).total_seconds()
+            if remaining <= 0:
+                break
+            try:
+                yield await asyncio.wait_for(queue.get(), timeout=remaining)
+            except asyncio.TimeoutError:
+                break
+    finally:
+        hub.unsubscribe(election.id, queue)
+    yield await sync_to_async(results_event)(election.id)
+    yield encode_event('end', {'election_id': election.id})
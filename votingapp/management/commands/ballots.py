@@ -0,0 +1,38 @@
+"""
+This file defines the `ballots` management command, which moves the stored ballots of elections between the two
+ballot storages: one Vote row per selected candidate, or one Ballot row per ballot with packed selections.
+
+Switch the BALLOT_STORAGE setting first, so that no new ballots are written in the old representation, then convert
+the existing ones. The tallies are not affected, since the number of votes per candidate does not change.
+
+Examples:
+    python manage.py ballots convert
+    python manage.py ballots revert --election 3
+"""
+
+from django.core.management.base import BaseCommand
+
+from votingapp.ballots import convert_votes, revert_ballots
+from votingapp.models import Election
+
+
+class Command(BaseCommand):
+    help = "Packs the Vote rows of elections into Ballot rows (convert) or unpacks them again (revert)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['convert', 'revert'])
+        parser.add_argument('--election', type=int, action='append', dest='elections',
+                            help="Primary key of an election to process. May be repeated; defaults to all elections.")
+
+    def handle(self, *args, **options):
+        elections = Election.objects.order_by('id')
+        if options['elections']:
+            elections = elections.filter(id__in=options['elections'])
+
+        for election_id, max_votes in elections.values_list('id', 'max_votes'):
+            if options['action'] == 'convert':
+                created = convert_votes(election_id, max_votes)
+                self.stdout.write(f"Election {election_id}: packed the votes into {created} ballots.")
+            else:
+                created = revert_ballots(election_id)
+                self.stdout.write(f"Election {election_id}: unpacked the ballots into {created} votes.")
@@ -0,0 +1,118 @@
+"""
+This file defines the `bench_handlers` management command, which compares the throughput of the WSGI path (sync
+views on a thread pool) and the ASGI path (async views on an event loop) for the same page.
+
+Each path runs in its own process, because the views are chosen by the ASYNC_VIEWS setting when the URLconf is
+loaded. The requests go through Django's in-process test client handlers, so the figures measure the request
+handling and database work, not a network stack.
+
+Examples:
+    python manage.py bench_handlers --username voter@example.com
+    python manage.py bench_handlers --username voter@example.com --path /elections/3/report/ --concurrency 100
+"""
+
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, Client
+
+from votingapp.benchmarking import summarize
+
+
+class Command(BaseCommand):
+    help = "Compares the throughput of the WSGI (sync views) and ASGI (async views) request paths."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', required=True, help="Username of an existing voter to send requests as.")
+        parser.add_argument('--path', default='/elections/', help="The page to request (default: /elections/).")
+        parser.add_argument('--requests', type=int, default=500, help="Number of requests per path (default: 500).")
+        parser.add_argument('--concurrency', type=int, default=20,
+                            help="Number of requests in flight at once (default: 20).")
+        parser.add_argument('--mode', choices=['both', 'wsgi', 'asgi'], default='both',
+                            help="Which path to measure; 'both' runs each one in a separate process.")
+        parser.add_argument('--json', action='store_true', help="Print the results as JSON.")
+
+    def handle(self, *args, **options):
+        if options['mode'] == 'both':
+            results = {mode: self.run_child(mode, options) for mode in ('wsgi', 'asgi')}
+        else:
+            results = {options['mode']: self.run(options['mode'], options)}
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        for mode, result in results.items():
+            self.stdout.write(
+                f"{mode.upper()}: {result['throughput']:.1f} req/s, mean {result['mean_ms']:.1f} ms, "
+                f"p50 {result['p50_ms']:.1f} ms, p95 {result['p95_ms']:.1f} ms, p99 {result['p99_ms']:.1f} ms, "
+                f"statuses {result['statuses']}")
+
+    def run_child(self, mode, options):
+        """
+        Measures one path in a child process with ASYNC_VIEWS set accordingly.
+        """
+        env = dict(os.environ, VOTINGAPP_ASYNC_VIEWS='1' if mode == 'asgi' else '0',
+                   DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'votingsite.settings'))
+        command = [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'bench_handlers', '--mode', mode,
+                   '--username', options['username'], '--path', options['path'],
+                   '--requests', str(options['requests']), '--concurrency', str(options['concurrency']), '--json']
+        completed = subprocess.run(command, env=env, capture_output=True, text=True)
+        if completed.returncode != 0:
+            raise CommandError(f"The {mode} benchmark failed:\n{completed.stderr}")
+        return json.loads(completed.stdout)[mode]
+
+    def run(self, mode, options):
+        if (mode == 'asgi') != settings.ASYNC_VIEWS:
+            raise CommandError(f"Measuring the {mode} path requires VOTINGAPP_ASYNC_VIEWS="
+                               f"{'1' if mode == 'asgi' else '0'}; use --mode both to have it set.")
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"No user named {options['username']!r}.")
+
+        login_client = Client()
+        login_client.force_login(user)
+        cookies = login_client.cookies
+
+        if mode == 'wsgi':
+            return self.run_wsgi(cookies, options)
+        return asyncio.run(self.run_asgi(cookies, options))
+
+    def run_wsgi(self, cookies, options):
+        def fetch(_):
+            client = Client()
+            client.cookies = cookies
+            started = time.perf_counter()
+            response = client.get(options['path'])
+            return time.perf_counter() - started, response.status_code
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            results = list(executor.map(fetch, range(options['requests'])))
+        elapsed = time.perf_counter() - started
+        return summarize([latency for latency, _ in results], elapsed, [status for _, status in results])
+
+    async def run_asgi(self, cookies, options):
+        semaphore = asyncio.Semaphore(options['concurrency'])
+
+        async def fetch():
+            async with semaphore:
+                client = AsyncClient()
+                client.cookies = cookies
+                started = time.perf_counter()
+                response = await client.get(options['path'])
+                return time.perf_counter() - started, response.status_code
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(fetch() for _ in range(options['requests'])))
+        elapsed = time.perf_counter() - started
+        return summarize([latency for latency, _ in results], elapsed, [status for _, status in results])
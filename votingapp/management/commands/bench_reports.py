@@ -0,0 +1,91 @@
+"""
+This file defines the `bench_reports` management command, which measures the CPU time each report backend spends on
+one PDF report.
+
+Each backend first renders one report, which includes importing and setting up its PDF engine and is reported as the
+cold time. Then the same report is rendered --repeat times, and the CPU time of those renders is reported per report.
+The report is that of an existing election, or a synthetic one with --candidates candidates. See
+votingapp/renderers.py for the backends.
+
+Examples:
+    python manage.py bench_reports
+    python manage.py bench_reports --candidates 50 --repeat 100
+    python manage.py bench_reports --election 3 --renderer canvas --json
+"""
+
+import datetime
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from votingapp.models import Election
+from votingapp.renderers import RENDERERS, get_renderer
+from votingapp.reports import REPORT_TEMPLATE, build_report_context
+
+
+class Command(BaseCommand):
+    help = "Measures the CPU time per PDF report of each report backend."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--renderer', action='append', dest='renderers',
+                            help="Name or dotted path of a backend to measure. May be repeated; defaults to all "
+                                 "built-in backends.")
+        parser.add_argument('--election', type=int, help="Primary key of the election to report on.")
+        parser.add_argument('--candidates', type=int, default=10,
+                            help="Number of candidates of the synthetic report (default: 10).")
+        parser.add_argument('--repeat', type=int, default=30, help="Number of reports rendered per backend "
+                                                                   "(default: 30).")
+        parser.add_argument('--json', action='store_true', help="Print the results as JSON.")
+
+    def handle(self, *args, **options):
+        if options['election'] is not None:
+            try:
+                context = build_report_context(Election.objects.get(pk=options['election']))
+            except Election.DoesNotExist:
+                raise CommandError(f"No election with ID {options['election']}.")
+        else:
+            context = self.synthetic_context(options['candidates'])
+
+        results = {}
+        for name in options['renderers'] or list(RENDERERS):
+            renderer = get_renderer(name)
+            started = time.process_time()
+            renderer.render(REPORT_TEMPLATE, context)
+            cold = time.process_time() - started
+
+            cpu_times = []
+            for _ in range(max(1, options['repeat'])):
+                started = time.process_time()
+                document = renderer.render(REPORT_TEMPLATE, context)
+                cpu_times.append(time.process_time() - started)
+            results[name] = {
+                'cold_ms': cold * 1000,
+                'mean_ms': statistics.mean(cpu_times) * 1000,
+                'median_ms': statistics.median(cpu_times) * 1000,
+                'reports_per_cpu_second': len(cpu_times) / sum(cpu_times) if sum(cpu_times) else None,
+                'bytes': len(document),
+            }
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for name, result in results.items():
+            self.stdout.write(f"{name}: {result['median_ms']:.2f} ms CPU per report (mean {result['mean_ms']:.2f} ms, "
+                              f"first {result['cold_ms']:.0f} ms), {result['bytes']} bytes")
+
+    @staticmethod
+    def synthetic_context(candidates):
+        today = timezone.now().date()
+        election = Election(id=0, type='Benchmark election', max_votes=2, start_date=today - datetime.timedelta(days=7),
+                            end_date=today - datetime.timedelta(days=1))
+        candidate_votes = {f'Candidate {i} Surname {i}': 1000 + 37 * i for i in range(candidates)}
+        return {
+            'election': election,
+            'total_votes': sum(candidate_votes.values()),
+            'candidate_votes': candidate_votes,
+            'voting_percentage': 61.5,
+            'date': today.strftime('%Y-%m-%d'),
+        }
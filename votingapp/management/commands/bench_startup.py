@@ -0,0 +1,75 @@
+"""
+This file defines the `bench_startup` management command, which measures how long a web worker takes to import the
+application and how much memory it holds before serving its first request.
+
+Every run starts a fresh Python process with `-X importtime` that loads votingsite.wsgi or votingsite.asgi and the
+URLconf, and the median of the runs is reported together with the packages that took the longest to import. The
+command fails if the workers import any of the packages only needed to render reports or recount ballots (see
+benchmarking.HEAVY_MODULES), or exceed the given budgets, so it can guard the startup cost in CI.
+
+Examples:
+    python manage.py bench_startup
+    python manage.py bench_startup --entry asgi --repeat 10 --max-import-ms 600 --max-rss-mb 80
+"""
+
+import json
+import statistics
+
+from django.core.management.base import BaseCommand, CommandError
+
+from votingapp.benchmarking import STARTUP_ENTRIES, measure_startup
+
+
+class Command(BaseCommand):
+    help = "Measures the import time and memory of a fresh web worker, failing on heavy imports or exceeded budgets."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--entry', choices=['both'] + sorted(STARTUP_ENTRIES), default='both',
+                            help="The entry point to load (default: both).")
+        parser.add_argument('--repeat', type=int, default=5, help="Number of processes started per entry point "
+                                                                  "(default: 5).")
+        parser.add_argument('--top', type=int, default=8, help="Number of slowest packages listed (default: 8).")
+        parser.add_argument('--max-import-ms', type=float, help="Fail if the median import time exceeds this.")
+        parser.add_argument('--max-rss-mb', type=float, help="Fail if the median peak RSS exceeds this.")
+        parser.add_argument('--json', action='store_true', help="Print the results as JSON.")
+
+    def handle(self, *args, **options):
+        entries = sorted(STARTUP_ENTRIES) if options['entry'] == 'both' else [options['entry']]
+        results = {}
+        for entry in entries:
+            try:
+                runs = [measure_startup(entry) for _ in range(max(1, options['repeat']))]
+            except RuntimeError as e:
+                raise CommandError(str(e))
+            packages = {package: statistics.median(run['packages_us'].get(package, 0) for run in runs)
+                        for package in runs[0]['packages_us']}
+            results[entry] = {
+                'import_ms': statistics.median(run['import_us'] for run in runs) / 1000,
+                'seconds': statistics.median(run['seconds'] for run in runs),
+                'max_rss_mb': statistics.median(run['max_rss_bytes'] for run in runs) / (1024 * 1024),
+                'slowest_packages_ms': {package: us / 1000 for package, us in
+                                        sorted(packages.items(), key=lambda item: -item[1])[:options['top']]},
+                'heavy_modules': sorted({name for run in runs for name in run['heavy_modules']}),
+            }
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            for entry, result in results.items():
+                self.stdout.write(f"{STARTUP_ENTRIES[entry]}: imports {result['import_ms']:.0f} ms, "
+                                  f"peak RSS {result['max_rss_mb']:.1f} MB")
+                for package, ms in result['slowest_packages_ms'].items():
+                    self.stdout.write(f"    {package}: {ms:.1f} ms")
+
+        failures = []
+        for entry, result in results.items():
+            if result['heavy_modules']:
+                failures.append(f"{STARTUP_ENTRIES[entry]} imports {', '.join(result['heavy_modules'])}.")
+            if options['max_import_ms'] is not None and result['import_ms'] > options['max_import_ms']:
+                failures.append(f"{STARTUP_ENTRIES[entry]} imports in {result['import_ms']:.0f} ms, over the budget "
+                                f"of {options['max_import_ms']:.0f} ms.")
+            if options['max_rss_mb'] is not None and result['max_rss_mb'] > options['max_rss_mb']:
+                failures.append(f"{STARTUP_ENTRIES[entry]} peaks at {result['max_rss_mb']:.1f} MB, over the budget "
+                                f"of {options['max_rss_mb']:.1f} MB.")
+        if failures:
+            raise CommandError('\n'.join(failures))
@@ -0,0 +1,133 @@
+"""
+This file defines the `benchmark` management command, which load-tests the voting flow.
+
+It seeds a synthetic population of voters, groups, elections and candidates, lets every voter log in, open the
+election list, vote and read a report with a number of voters active at once, and reports the latency percentiles,
+throughput and database queries of each view. The results can be written as JSON to compare runs.
+
+By default everything runs in-process through the test client against a throwaway test database. With --url the
+requests go over HTTP to a running server instead; the data is then seeded into the configured database (as the
+server has to see it) and deleted afterwards unless --keep is given.
+
+The report ends with the rows and sizes of the Vote and Ballot tables, which together with the election_detail
+figures compare the two ballot storages (--ballot-storage votes|ballots).
+
+Examples:
+    python manage.py benchmark --voters 500 --concurrency 20 --output before.json
+    python manage.py benchmark --voters 500 --ballot-storage ballots --output ballots.json
+    python manage.py benchmark --url http://127.0.0.1:8000 --voters 200
+"""
+
+import datetime
+import json
+import platform
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.conf import settings
+from django.test import override_settings
+from django.test.utils import setup_databases, teardown_databases
+
+from votingapp.ballots import STORAGES
+from votingapp.benchmarking import ClientSession, HttpSession, delete_benchmark_data, run_voting_flow, \
+    seed_benchmark_data, table_sizes
+from votingapp.models import Ballot, Vote
+
+VIEWS = ['login_view', 'election_list', 'election_detail', 'ended_elections_report', 'all']
+
+
+class Command(BaseCommand):
+    help = "Seeds synthetic voting data and measures the latency, throughput and queries of the voting flow."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--voters', type=int, default=200, help="Number of voters (default: 200).")
+        parser.add_argument('--groups', type=int, default=5, help="Number of groups (default: 5).")
+        parser.add_argument('--elections', type=int, default=6,
+                            help="Number of elections, half of them ongoing and half ended (default: 6).")
+        parser.add_argument('--candidates', type=int, default=10,
+                            help="Number of candidates per election (default: 10).")
+        parser.add_argument('--max-votes', type=int, default=2,
+                            help="Number of candidates each voter selects (default: 2).")
+        parser.add_argument('--concurrency', type=int, default=10,
+                            help="Number of voters active at once (default: 10).")
+        parser.add_argument('--ballot-storage', choices=STORAGES,
+                            help="How ballots are stored during an in-process run; defaults to the BALLOT_STORAGE "
+                                 "setting. An HTTP run uses the setting of the server.")
+        parser.add_argument('--url', help="Base URL of a running server to send the requests to over HTTP.")
+        parser.add_argument('--prefix', default='bench', help="Prefix of the seeded user and group names.")
+        parser.add_argument('--keep', action='store_true', help="Keep the data seeded for an HTTP run.")
+        parser.add_argument('--output', help="Write the results as JSON to this file.")
+
+    def handle(self, *args, **options):
+        if options['url']:
+            results = self.run_http(options)
+        else:
+            with override_settings(BALLOT_STORAGE=options['ballot_storage'] or settings.BALLOT_STORAGE):
+                results = self.run_client(options)
+
+        report = {
+            'started': self.started.isoformat(),
+            'mode': 'http' if options['url'] else 'client',
+            'options': {key: options[key] for key in ('voters', 'groups', 'elections', 'candidates', 'max_votes',
+                                                      'concurrency', 'ballot_storage', 'url')},
+            'environment': {'python': platform.python_version(), 'django': django.get_version(),
+                            'database': connection.vendor},
+            'views': results,
+            'storage': self.storage,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+            self.stdout.write(f"Results written to {options['output']}.")
+        self.print_table(results)
+        for table, size in self.storage.items():
+            self.stdout.write(f"{table}: {size['rows']} rows, table {size['table_bytes']} bytes, "
+                              f"indexes {size['index_bytes']} bytes")
+
+    def seed(self, options):
+        self.started = datetime.datetime.now(datetime.timezone.utc)
+        self.stdout.write(f"Seeding {options['voters']} voters and {options['elections']} elections...")
+        return seed_benchmark_data(options['prefix'], options['voters'], options['groups'], options['elections'],
+                                   options['candidates'], options['max_votes'])
+
+    def run_client(self, options):
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            seeded = self.seed(options)
+            if connection.vendor == 'sqlite' and options['concurrency'] > 1:
+                # The in-memory SQLite test database locks whole tables, so concurrent voters would fail.
+                self.stderr.write("SQLite does not support concurrent writers; running with --concurrency 1.")
+                options['concurrency'] = 1
+            # Pages are rendered without a collectstatic run, so the manifest storage cannot be used.
+            with override_settings(STORAGES={
+                'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+                'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+            }):
+                results = run_voting_flow(seeded, ClientSession, options['concurrency'])
+            self.storage = table_sizes([Vote, Ballot])
+            return results
+        finally:
+            teardown_databases(old_config, verbosity=0)
+
+    def run_http(self, options):
+        seeded = self.seed(options)
+        try:
+            results = run_voting_flow(seeded, lambda: HttpSession(options['url']), options['concurrency'])
+            self.storage = table_sizes([Vote, Ballot])
+            return results
+        finally:
+            if not options['keep']:
+                delete_benchmark_data(options['prefix'])
+
+    def print_table(self, results):
+        self.stdout.write(f"{'view':<24}{'requests':>9}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+                          f"{'queries':>9}  statuses")
+        for view in VIEWS:
+            if view not in results:
+                continue
+            result = results[view]
+            queries = f"{result['queries_mean']:.1f}" if 'queries_mean' in result else '-'
+            self.stdout.write(f"{view:<24}{result['requests']:>9}{result['throughput']:>9.1f}"
+                              f"{result['p50_ms']:>9.1f}{result['p95_ms']:>9.1f}{result['p99_ms']:>9.1f}"
+                              f"{queries:>9}  {result['statuses']}")
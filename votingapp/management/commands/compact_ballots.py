@@ -0,0 +1,77 @@
+"""
+This file defines the `compact_ballots` management command, which compacts the ballots of ended elections into ballot
+archives.
+
+Elections that already have an archive are skipped unless they are named with --election. With --purge, the Vote and
+Ballot rows of an election are deleted once its archive is written; the archive is then the only copy of the ballots,
+so back up BALLOT_ARCHIVE_DIR. See votingapp/archives.py for the file format.
+
+Examples:
+    python manage.py compact_ballots
+    python manage.py compact_ballots --election 3 --purge
+    python manage.py compact_ballots --verify
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from votingapp.archives import ArchiveError, archive_path, compact_election, open_archive
+from votingapp.models import Election
+
+
+class Command(BaseCommand):
+    help = "Writes the ballots of ended elections to memory-mappable archive files, optionally purging the rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--election', type=int, action='append', dest='elections',
+                            help="Primary key of an election to compact. May be repeated; defaults to all ended "
+                                 "elections without an archive.")
+        parser.add_argument('--purge', action='store_true',
+                            help="Delete the Vote and Ballot rows of the compacted elections.")
+        parser.add_argument('--verify', action='store_true',
+                            help="Only check the archives of the elections against their checksums and snapshots.")
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            self.verify(options['elections'])
+            return
+
+        elections = Election.objects.order_by('id')
+        if options['elections']:
+            elections = elections.filter(id__in=options['elections'])
+        else:
+            elections = elections.filter(end_date__lt=timezone.now().date())
+
+        for election in elections:
+            if not options['elections'] and archive_path(election.id).exists():
+                continue
+            try:
+                result = compact_election(election, purge=options['purge'])
+            except ArchiveError as e:
+                raise CommandError(str(e))
+            self.stdout.write(f"Election {election.id}: archived {result['ballots']} ballots in {result['bytes']} "
+                              f"bytes to {result['path']}" + (f", purged {result['purged']} rows." if options['purge']
+                                                              else "."))
+
+    def verify(self, election_ids):
+        election_ids = election_ids or Election.objects.order_by('id').values_list('id', flat=True)
+        failed = 0
+        for election_id in election_ids:
+            try:
+                archive = open_archive(election_id)
+            except ArchiveError as e:
+                failed += 1
+                self.stdout.write(self.style.ERROR(f"Election {election_id}: {e}"))
+                continue
+            if archive is None:
+                continue
+            with archive:
+                valid = archive.verify() and archive.count_ballots() == {
+                    candidate_id: votes for candidate_id, votes in archive.tallies.items() if votes}
+            if valid:
+                self.stdout.write(self.style.SUCCESS(f"Election {election_id}: the archive is intact."))
+            else:
+                failed += 1
+                self.stdout.write(self.style.ERROR(f"Election {election_id}: the archive is corrupt."))
+        if failed:
+            raise CommandError(f"{failed} archive(s) are corrupt.")
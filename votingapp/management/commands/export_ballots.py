@@ -0,0 +1,49 @@
+"""
+This file defines the `export_ballots` management command, which writes the raw ballots of an election to a file.
+
+The ballots are streamed from the database, so exporting an election of any size uses little memory. The output is
+gzip-compressed when the file name ends in .gz or --gzip is given. See votingapp/exports.py for the columns.
+
+Examples:
+    python manage.py export_ballots 3 --output election-3.csv.gz
+    python manage.py export_ballots 3 --format ndjson > election-3.ndjson
+"""
+
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from votingapp.exports import DEFAULT_CHUNK_SIZE, FORMATS, export_chunks
+from votingapp.models import Election
+
+
+class Command(BaseCommand):
+    help = "Exports the raw ballots of an election as CSV or NDJSON for audits."
+
+    def add_arguments(self, parser):
+        parser.add_argument('election', type=int, help="Primary key of the election.")
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv', dest='export_format',
+                            help="Output format (default: csv).")
+        parser.add_argument('--output', default='-', help="Output file; '-' (default) writes to standard output.")
+        parser.add_argument('--gzip', action='store_true', help="Compress the output; implied by a .gz file name.")
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                            help=f"Number of rows fetched from the database at a time (default: {DEFAULT_CHUNK_SIZE}).")
+
+    def handle(self, *args, **options):
+        if not Election.objects.filter(pk=options['election']).exists():
+            raise CommandError(f"No election with ID {options['election']}.")
+
+        compress = options['gzip'] or options['output'].endswith('.gz')
+        chunks = export_chunks(options['election'], options['export_format'], compress, options['chunk_size'])
+        if options['output'] == '-':
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+            return
+
+        size = 0
+        with open(options['output'], 'wb') as output:
+            for chunk in chunks:
+                output.write(chunk)
+                size += len(chunk)
+        self.stderr.write(f"Wrote {size} bytes to {options['output']}.")
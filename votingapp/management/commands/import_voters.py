@@ -0,0 +1,48 @@
+"""
+This file defines the `import_voters` management command, which imports a roster of voters from a CSV or NDJSON file.
+
+See votingapp/voter_import.py for the roster format. An interrupted import continues where it stopped when the
+command is run again with the same file.
+
+Examples:
+    python manage.py import_voters roster.csv
+    python manage.py import_voters roster.ndjson --group students --workers 8 --chunk-size 2000
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from votingapp.voter_import import DEFAULT_CHUNK_SIZE, RosterError, VoterImporter
+
+
+class Command(BaseCommand):
+    help = "Imports voters in bulk from a CSV or NDJSON roster, hashing passwords on a process pool."
+
+    def add_arguments(self, parser):
+        parser.add_argument('roster', help="Path of the roster file.")
+        parser.add_argument('--format', choices=['csv', 'ndjson'], dest='roster_format',
+                            help="Format of the roster; detected from the file extension by default.")
+        parser.add_argument('--group', action='append', dest='groups', default=[],
+                            help="Name of a group every imported voter is added to. May be repeated.")
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                            help=f"Number of voters written per transaction (default: {DEFAULT_CHUNK_SIZE}).")
+        parser.add_argument('--workers', type=int,
+                            help="Number of password hashing processes; 0 hashes in this process. "
+                                 "Defaults to the number of CPUs.")
+        parser.add_argument('--restart', action='store_true',
+                            help="Ignore the progress of an earlier, interrupted import and start from the top.")
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be at least 1.")
+
+        importer = VoterImporter(options['roster'], roster_format=options['roster_format'],
+                                 chunk_size=options['chunk_size'], workers=options['workers'],
+                                 groups=options['groups'], restart=options['restart'], report=self.stdout.write)
+        try:
+            result = importer.run()
+        except (OSError, RosterError) as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {result['imported']} voters; skipped {result['skipped']} existing and {result['invalid']} "
+            f"invalid records."))
@@ -0,0 +1,48 @@
+"""
+This file defines the `ingest_log` management command, which inspects the write-behind ballot ingestion log or stores
+the ballots left in it.
+
+`status` only reads the log directory, so it can be used while a server holds the log. `flush` opens the log, which
+truncates a torn record and fails if a server holds it, and stores the ballots after the checkpoint in the database.
+See votingapp/ingest.py.
+
+Examples:
+    python manage.py ingest_log status
+    python manage.py ingest_log flush --dir /var/lib/votingapp/ingest_log
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from votingapp.ingest import IngestError, IngestLog, get_log_dir, log_status
+
+
+class Command(BaseCommand):
+    help = "Shows the state of the ballot ingestion log, or stores the ballots left in it."
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['status', 'flush'])
+        parser.add_argument('--dir', help="The log directory (default: the INGEST_LOG_DIR setting).")
+
+    def handle(self, *args, **options):
+        directory = options['dir'] or get_log_dir()
+        if options['action'] == 'status':
+            status = log_status(directory)
+            segment, offset = status['checkpoint']
+            self.stdout.write(f"Log directory: {status['directory']}")
+            self.stdout.write(f"Checkpoint: segment {segment}, offset {offset}")
+            for number, size in status['segments'].items():
+                self.stdout.write(f"Segment {number}: {size} bytes")
+            self.stdout.write(f"Not stored yet: {status['pending_bytes']} bytes")
+            for name in status['damaged']:
+                self.stdout.write(f"Unreadable bytes moved aside: {name}")
+            return
+
+        try:
+            log = IngestLog(directory, flush_interval=0)
+        except IngestError as e:
+            raise CommandError(str(e))
+        try:
+            stored = log.flush()
+        finally:
+            log.close()
+        self.stdout.write(f"Stored {stored} ballots from {directory}.")
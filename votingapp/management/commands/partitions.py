@@ -0,0 +1,90 @@
+"""
+This file defines the `partitions` management command, which manages the partitioning of the ballot tables by
+election on PostgreSQL.
+
+Actions:
+    status:  Lists the partitions with their estimated rows and sizes.
+    enable:  Partitions the Vote, Voted_User and Ballot tables. Locks and copies the tables; run it while the site is
+             down.
+    disable: Converts the partitioned tables back into plain tables.
+    create:  Creates the missing partitions of elections.
+    archive: Detaches the partitions of ended elections and moves them to the VOTE_ARCHIVE_SCHEMA schema.
+    restore: Attaches the archived partitions of elections again.
+
+See votingapp/partitions.py for details.
+
+Examples:
+    python manage.py partitions enable
+    python manage.py partitions archive --ended-before 2024-01-01
+    python manage.py partitions restore --election 3
+"""
+
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from votingapp import partitions
+from votingapp.models import Election
+
+
+class Command(BaseCommand):
+    help = "Manages the partitioning of the ballot tables by election on PostgreSQL."
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['status', 'enable', 'disable', 'create', 'archive', 'restore'])
+        parser.add_argument('--election', type=int, action='append', dest='elections',
+                            help="Primary key of an election to process. May be repeated; defaults to all elections, "
+                                 "or all ended elections when archiving.")
+        parser.add_argument('--ended-before', type=datetime.date.fromisoformat,
+                            help="Only archive the elections that ended before this date (YYYY-MM-DD).")
+
+    def handle(self, *args, **options):
+        if not partitions.supports_partitioning():
+            raise CommandError("Partitioning is only supported on PostgreSQL.")
+
+        action = options['action']
+        if action == 'status':
+            self.show_status()
+            return
+        if action == 'enable':
+            election_ids = list(Election.objects.values_list('id', flat=True))
+            for table in partitions.TABLES:
+                if not partitions.is_partitioned(table):
+                    partitions.partition_table(table, election_ids)
+                    self.stdout.write(f"Partitioned {table} into {len(election_ids)} elections.")
+            return
+        if action == 'disable':
+            for table in partitions.partitioned_tables():
+                partitions.unpartition_table(table)
+                self.stdout.write(f"Converted {table} into a plain table.")
+            return
+
+        elections = Election.objects.order_by('id')
+        if options['elections']:
+            elections = elections.filter(id__in=options['elections'])
+        if action == 'archive':
+            # Voting must be over, since archived partitions no longer accept ballots.
+            ended_before = options['ended_before'] or timezone.now().date()
+            elections = elections.filter(end_date__lt=min(ended_before, timezone.now().date()))
+
+        for election_id in elections.values_list('id', flat=True):
+            if action == 'create':
+                names = partitions.create_partitions(election_id)
+            elif action == 'archive':
+                names = partitions.archive_partitions(election_id)
+            else:
+                names = partitions.restore_partitions(election_id)
+            if names:
+                self.stdout.write(f"Election {election_id}: {action}d {', '.join(names)}.")
+
+    def show_status(self):
+        status = partitions.partition_status()
+        if not status:
+            self.stdout.write("No table is partitioned.")
+            return
+        self.stdout.write(f"{'partition':40} {'election':>8} {'rows':>12} {'bytes':>14}  location")
+        for table, name, election_id, archived, rows, size in status:
+            location = partitions.get_archive_schema() if archived else 'attached'
+            self.stdout.write(f"{name:40} {election_id if election_id is not None else '-':>8} {rows:>12} "
+                              f"{size:>14}  {location}")
@@ -0,0 +1,81 @@
+"""
+This file defines the `recount` management command, which recounts elections from their raw ballots and compares the
+result with the stored results.
+
+The ballots are read from the archive of an election if it has one, otherwise from the database, or from the file
+given with --file. See votingapp/recount.py for details. The command fails if any count differs from the tallies.
+
+Examples:
+    python manage.py recount
+    python manage.py recount --election 3 --source db --workers 8
+    python manage.py recount --election 3 --file election-3-ballots.csv.gz --json
+"""
+
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from votingapp.models import Election
+from votingapp.recount import DEFAULT_SHARD_ROWS, SOURCES, RecountError, recount_election
+
+
+class Command(BaseCommand):
+    help = "Recounts elections from their ballots with NumPy and compares the counts with the stored results."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--election', type=int, action='append', dest='elections',
+                            help="Primary key of an election to recount. May be repeated; defaults to all ended "
+                                 "elections.")
+        parser.add_argument('--source', choices=SOURCES,
+                            help="Where to read the ballots from; defaults to the archive of an election if it has "
+                                 "one, else the database. Implied to be 'file' by --file.")
+        parser.add_argument('--file', help="Ballot archive (.vba) or audit export (.csv, .ndjson, optionally .gz) "
+                                           "to count. Needs a single --election.")
+        parser.add_argument('--workers', type=int,
+                            help="Number of counting processes; 0 counts in this process. Defaults to the number "
+                                 "of CPUs.")
+        parser.add_argument('--shard-rows', type=int, default=DEFAULT_SHARD_ROWS,
+                            help=f"Number of database rows counted per process task (default: {DEFAULT_SHARD_ROWS}).")
+        parser.add_argument('--json', action='store_true', help="Print the recounts as JSON.")
+
+    def handle(self, *args, **options):
+        if options['file'] and len(options['elections'] or []) != 1:
+            raise CommandError("--file needs exactly one --election.")
+        source = 'file' if options['file'] else options['source']
+
+        elections = Election.objects.order_by('id')
+        if options['elections']:
+            elections = elections.filter(id__in=options['elections'])
+        else:
+            elections = elections.filter(end_date__lt=timezone.now().date())
+
+        recounts = []
+        for election in elections:
+            try:
+                recounts.append(recount_election(election, source=source, path=options['file'],
+                                                 workers=options['workers'], shard_rows=options['shard_rows']))
+            except (OSError, RecountError) as e:
+                raise CommandError(f"Election {election.id}: {e}")
+
+        if options['json']:
+            self.stdout.write(json.dumps(recounts, indent=2))
+        else:
+            for recount in recounts:
+                self.print_recount(recount)
+
+        mismatched = [recount['election_id'] for recount in recounts if recount['differences']]
+        if mismatched:
+            raise CommandError(f"The recounts of elections {', '.join(map(str, mismatched))} differ from the stored "
+                               f"results.")
+
+    def print_recount(self, recount):
+        self.stdout.write(f"Election {recount['election_id']} ({recount['source']}, {recount['seconds']:.2f} s): "
+                          f"{recount['total_votes']} votes, turnout {recount['turnout']:.1f}% "
+                          f"({recount['voted_users']} of {recount['eligible_voters']} voters)")
+        for candidate_id, votes in sorted(recount['counts'].items()):
+            self.stdout.write(f"  candidate {candidate_id}: {votes}")
+        for candidate_id, (stored, counted) in recount['differences'].items():
+            self.stdout.write(self.style.ERROR(f"  candidate {candidate_id}: stored {stored}, counted {counted}"))
+        if not recount['differences']:
+            self.stdout.write(self.style.SUCCESS("  The recount matches the stored results."))
@@ -0,0 +1,59 @@
+"""
+This file defines the `tallies` management command, which rebuilds or verifies the vote tallies from the raw ballots.
+
+The ballots of elections compacted by `compact_ballots` are counted from their archives.
+
+Examples:
+    python manage.py tallies verify
+    python manage.py tallies rebuild --election 3 --election 7
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from votingapp.archives import open_archive
+from votingapp.models import Election
+from votingapp.tallies import rebuild_tallies, verify_tallies
+
+
+class Command(BaseCommand):
+    help = "Rebuilds or verifies the per-candidate vote tallies from the raw Vote and Ballot rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['rebuild', 'verify'])
+        parser.add_argument('--election', type=int, action='append', dest='elections',
+                            help="Primary key of an election to process. May be repeated; defaults to all elections.")
+
+    def handle(self, *args, **options):
+        election_ids = options['elections'] or list(Election.objects.order_by('id').values_list('id', flat=True))
+
+        mismatched = 0
+        for election_id in election_ids:
+            counted = self.count_archive(election_id)
+            if options['action'] == 'rebuild':
+                counts = rebuild_tallies(election_id, counted)
+                self.stdout.write(f"Election {election_id}: rebuilt tallies for {len(counts)} candidates.")
+                continue
+
+            mismatches = verify_tallies(election_id, counted)
+            if not mismatches:
+                self.stdout.write(self.style.SUCCESS(f"Election {election_id}: tallies match the votes."))
+                continue
+
+            mismatched += 1
+            for candidate_id, (tallied, counted) in sorted(mismatches.items()):
+                self.stdout.write(self.style.ERROR(
+                    f"Election {election_id}, candidate {candidate_id}: tallied {tallied}, counted {counted}."))
+
+        if mismatched:
+            raise CommandError(f"Tallies of {mismatched} election(s) do not match the votes. "
+                               f"Run 'manage.py tallies rebuild' to fix them.")
+
+    def count_archive(self, election_id):
+        """
+        Counts the ballots of an archived election, or returns None if the election has no archive.
+        """
+        archive = open_archive(election_id)
+        if archive is None:
+            return None
+        with archive:
+            return archive.count_ballots()
@@ -0,0 +1,42 @@
+"""
+This file defines the `warm_reports` management command, which renders the PDF reports of recently ended elections
+ahead of time so that the first downloads are served from the report cache.
+
+Examples:
+    python manage.py warm_reports
+    python manage.py warm_reports --days 30
+"""
+
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from votingapp.models import Election
+from votingapp.reports import REPORT_TEMPLATE, ReportRenderError, build_report_context, get_report_pdf
+
+
+class Command(BaseCommand):
+    help = "Renders and caches the PDF reports of recently ended elections."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7,
+                            help="Warm the reports of elections that ended within this many days (default: 7).")
+
+    def handle(self, *args, **options):
+        today = timezone.now().date()
+        elections = Election.objects.filter(end_date__lt=today,
+                                            end_date__gte=today - datetime.timedelta(days=options['days']))
+
+        failed = 0
+        for election in elections.order_by('-end_date'):
+            try:
+                path = get_report_pdf(REPORT_TEMPLATE, build_report_context(election))
+            except ReportRenderError as e:
+                failed += 1
+                self.stderr.write(self.style.ERROR(f"Election {election.id}: rendering failed: {e}"))
+                continue
+            self.stdout.write(f"Election {election.id}: {path.name}")
+
+        if failed:
+            self.stderr.write(self.style.WARNING(f"{failed} report(s) could not be rendered."))
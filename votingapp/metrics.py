@@ -0,0 +1,282 @@
+"""
+This file collects per-request metrics of the voting application and exposes them in the Prometheus text format.
+
+RequestMetricsMiddleware (votingapp/middleware.py) measures for every request the number of database queries, the time
+spent in the database, the time spent rendering templates and the total latency. The figures are sent back to the
+client in a Server-Timing header and added to per-view histograms, which the metrics view serves at /metrics.
+
+Database queries are timed by an execute wrapper installed on every database connection when it is opened, and
+templates by wrapping the render method of the Django template backend. Both add their time to the RequestTimings of
+the current request, found through a context variable, so the measurements also follow async views into the threads
+their ORM calls run in. Outside a request they do nothing but a context variable lookup.
+
+The histograms are kept in memory, per process. When running several worker processes, each one is scraped as a
+separate target (or the figures of one worker are a sample of the whole).
+"""
+
+import bisect
+import contextvars
+import hmac
+import threading
+import time
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DEFAULT_QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_current = contextvars.ContextVar('votingapp_request_timings', default=None)
+
+
+class RequestTimings:
+    """
+    The measurements of a single request.
+    """
+
+    __slots__ = ('started', 'queries', 'db_seconds', 'template_seconds')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.template_seconds = 0.0
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+def start_request():
+    """
+    Starts measuring a request in the current context.
+
+    Returns:
+    tuple: The RequestTimings of the request and the token to pass to finish_request.
+    """
+    timings = RequestTimings()
+    return timings, _current.set(timings)
+
+
+def finish_request(token):
+    """
+    Stops measuring the request started with the given token.
+    """
+    _current.reset(token)
+
+
+def _time_query(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.queries += 1
+        timings.db_seconds += time.perf_counter() - started
+
+
+def _install_query_timer(sender, connection, **kwargs):
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+_instrumented = False
+_instrument_lock = threading.Lock()
+
+
+def instrument():
+    """
+    Installs the database and template timers. Safe to call more than once.
+    """
+    global _instrumented
+    with _instrument_lock:
+        if _instrumented:
+            return
+        connection_created.connect(_install_query_timer, dispatch_uid='votingapp.metrics')
+
+        # Connections opened before this point did not get the timer.
+        from django.db import connections
+        for connection in connections.all(initialized_only=True):
+            _install_query_timer(None, connection)
+
+        # Only templates rendered directly by views go through the backend; {% include %} and {% extends %} render
+        # inside them, so nested templates are not counted twice.
+        from django.template.backends.django import Template
+        render = Template.render
+
+        def timed_render(self, context=None, request=None):
+            timings = _current.get()
+            if timings is None:
+                return render(self, context, request)
+            started = time.perf_counter()
+            try:
+                return render(self, context, request)
+            finally:
+                timings.template_seconds += time.perf_counter() - started
+
+        Template.render = timed_render
+        _instrumented = True
+
+
+class Histogram:
+    """
+    A Prometheus histogram with one series per label value.
+
+    Parameters:
+    name (str): The metric name.
+    documentation (str): The help text of the metric.
+    label (str): The name of the label distinguishing the series.
+    buckets (tuple): The upper bounds of the buckets, in ascending order.
+    """
+
+    def __init__(self, name, documentation, label, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                # One counter per bucket plus one for +Inf, then the sum.
+                series = self._series[label_value] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def collect(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            snapshot = {label_value: list(series) for label_value, series in self._series.items()}
+        for label_value in sorted(snapshot):
+            series = snapshot[label_value]
+            label = f'{self.label}="{_escape(label_value)}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label}}} {series[-1]}')
+            lines.append(f'{self.name}_count{{{label}}} {cumulative}')
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+
+class Counter:
+    """
+    A Prometheus counter with one series per combination of label values.
+    """
+
+    def __init__(self, name, documentation, labels):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values):
+        with self._lock:
+            self._series[label_values] = self._series.get(label_values, 0) + 1
+
+    def collect(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            snapshot = dict(self._series)
+        for label_values in sorted(snapshot):
+            labels = ','.join(f'{label}="{_escape(value)}"' for label, value in zip(self.labels, label_values))
+            lines.append(f'{self.name}{{{labels}}} {snapshot[label_values]}')
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REQUESTS = Counter('votingapp_requests_total', 'Requests handled, by view, method and status code.',
+                   ('view', 'method', 'status'))
+REQUEST_DURATION = Histogram('votingapp_request_duration_seconds', 'Total request latency.', 'view',
+                             DEFAULT_LATENCY_BUCKETS)
+DB_QUERIES = Histogram('votingapp_db_queries', 'Database queries per request.', 'view', DEFAULT_QUERY_BUCKETS)
+DB_DURATION = Histogram('votingapp_db_duration_seconds', 'Time spent in database queries per request.', 'view',
+                        DEFAULT_LATENCY_BUCKETS)
+TEMPLATE_DURATION = Histogram('votingapp_template_duration_seconds', 'Time spent rendering templates per request.',
+                              'view', DEFAULT_LATENCY_BUCKETS)
+
+METRICS = (REQUESTS, REQUEST_DURATION, DB_QUERIES, DB_DURATION, TEMPLATE_DURATION)
+
+
+def record_request(view, method, status, timings, elapsed):
+    """
+    Adds the measurements of a finished request to the metrics.
+
+    Parameters:
+    view (str): The name of the view that handled the request.
+    method (str): The HTTP method of the request.
+    status (int): The status code of the response.
+    timings (RequestTimings): The measurements of the request.
+    elapsed (float): The total latency of the request in seconds.
+    """
+    REQUESTS.inc(view, method, str(status))
+    REQUEST_DURATION.observe(view, elapsed)
+    DB_QUERIES.observe(view, timings.queries)
+    DB_DURATION.observe(view, timings.db_seconds)
+    TEMPLATE_DURATION.observe(view, timings.template_seconds)
+
+
+def server_timing(timings, elapsed):
+    """
+    Returns the value of the Server-Timing header describing a request, with durations in milliseconds.
+    """
+    return (f'db;dur={timings.db_seconds * 1000:.1f};desc="{timings.queries} queries", '
+            f'tpl;dur={timings.template_seconds * 1000:.1f}, '
+            f'total;dur={elapsed * 1000:.1f}')
+
+
+def render_metrics():
+    """
+    Returns all metrics in the Prometheus text exposition format.
+    """
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.collect())
+    return '\n'.join(lines) + '\n'
+
+
+def reset_metrics():
+    """
+    Clears all collected metrics.
+    """
+    for metric in METRICS:
+        metric.reset()
+
+
+def metrics_view(request):
+    """
+    Serves the collected metrics to Prometheus.
+
+    If the METRICS_TOKEN setting is set, the scraper has to send it as a bearer token. Otherwise only requests from
+    the addresses in the METRICS_ALLOWED_IPS setting are served, and none by default: behind a reverse proxy on the
+    same host every client comes from a loopback address, so only list addresses that reach the server directly.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token:
+        authorization = request.headers.get('Authorization', '')
+        allowed = hmac.compare_digest(authorization.encode(), f'Bearer {token}'.encode())
+    else:
+        allowed = request.META.get('REMOTE_ADDR') in getattr(settings, 'METRICS_ALLOWED_IPS', [])
+    if not allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), content_type=CONTENT_TYPE)
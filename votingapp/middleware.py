@@ -0,0 +1,100 @@
+"""
+This file defines the middleware of the voting application.
+"""
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from . import db_routing, metrics
+
+KNOWN_METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+
+class RequestMetricsMiddleware:
+    """
+    Measures the database queries, database time, template rendering time and total latency of each request,
+    reports them in a Server-Timing header and records them in the metrics served at /metrics (see
+    votingapp/metrics.py).
+
+    Place it first in MIDDLEWARE so that the latency includes the other middleware. The Server-Timing header can be
+    disabled with the METRICS_SERVER_TIMING setting.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.server_timing = getattr(settings, 'METRICS_SERVER_TIMING', True)
+        metrics.instrument()
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings, token = metrics.start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.finish_request(token)
+        self.finish(request, response, timings)
+        return response
+
+    async def __acall__(self, request):
+        timings, token = metrics.start_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.finish_request(token)
+        self.finish(request, response, timings)
+        return response
+
+    def finish(self, request, response, timings):
+        elapsed = timings.elapsed()
+        match = request.resolver_match
+        # Unmatched paths share one label, so that scanners cannot create a series per URL.
+        view = match.view_name if match is not None else '<unresolved>'
+        method = request.method if request.method in KNOWN_METHODS else 'OTHER'
+        if view != 'metrics':
+            metrics.record_request(view, method, response.status_code, timings, elapsed)
+        if self.server_timing:
+            response.headers['Server-Timing'] = metrics.server_timing(timings, elapsed)
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Sends the reads of read-only pages to a read replica, and keeps the reads of a client on the primary for a while
+    after it changed something (see votingapp/db_routing.py).
+
+    Place it before SessionMiddleware and AuthenticationMiddleware so that their reads are routed as well. Does
+    nothing unless the DATABASE_REPLICAS setting lists replicas.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with db_routing.use_read_alias(db_routing.choose_read_alias(request)):
+            response = self.get_response(request)
+        self.stick(request, response)
+        return response
+
+    async def __acall__(self, request):
+        with db_routing.use_read_alias(db_routing.choose_read_alias(request)):
+            response = await self.get_response(request)
+        self.stick(request, response)
+        return response
+
+    @staticmethod
+    def stick(request, response):
+        if request.method not in db_routing.READ_METHODS and db_routing.get_replicas():
+            response.set_cookie(db_routing.STICKY_COOKIE, '1', max_age=db_routing.get_sticky_seconds(), httponly=True,
+                                samesite='Lax')
@@ -0,0 +1,29 @@
+"""
+This file holds the custom operations used by the migrations of the voting application.
+
+Migrations import them by path, so an operation must keep its name and behaviour once a migration uses it.
+"""
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations
+
+
+class AddIndexConcurrentlyOnPostgres(AddIndexConcurrently):
+    """
+    Builds the index with CREATE INDEX CONCURRENTLY on PostgreSQL, so that the votes keep being written while it is
+    built, and with a plain CREATE INDEX on other databases.
+
+    Like AddIndexConcurrently, it can only be used in migrations with atomic = False.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+        else:
+            migrations.AddIndex.database_forwards(self, app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+        else:
+            migrations.AddIndex.database_backwards(self, app_label, schema_editor, from_state, to_state)
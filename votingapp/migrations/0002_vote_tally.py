@@ -0,0 +1,40 @@
+# Generated by Django 5.0.3 on 2026-10-18 18:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def populate_tallies(apps, schema_editor):
+    Vote = apps.get_model('votingapp', 'Vote')
+    Vote_Tally = apps.get_model('votingapp', 'Vote_Tally')
+    rows = Vote.objects.values('election_id', 'candidate_id').annotate(votes=Count('id')).order_by()
+    Vote_Tally.objects.bulk_create([
+        Vote_Tally(election_id=row['election_id'], candidate_id=row['candidate_id'], shard=0, count=row['votes'])
+        for row in rows
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('votingapp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Vote_Tally',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('shard', models.PositiveSmallIntegerField(default=0)),
+                ('count', models.BigIntegerField(default=0)),
+                ('candidate', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, to='votingapp.candidate')),
+                ('election', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, to='votingapp.election')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='vote_tally',
+            constraint=models.UniqueConstraint(fields=('election', 'candidate', 'shard'), name='unique_vote_tally_shard'),
+        ),
+        migrations.RunPython(populate_tallies, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.0.3 on 2026-10-18 18:47
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_voted_users(apps, schema_editor):
+    Voted_User = apps.get_model('votingapp', 'Voted_User')
+    duplicates = (Voted_User.objects.values('user_id', 'election_id')
+                  .annotate(rows=Count('id'), first_id=Min('id')).filter(rows__gt=1).order_by())
+    for row in duplicates:
+        (Voted_User.objects.filter(user_id=row['user_id'], election_id=row['election_id'])
+         .exclude(id=row['first_id']).delete())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('votingapp', '0002_vote_tally'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_voted_users, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='voted_user',
+            constraint=models.UniqueConstraint(fields=('user', 'election'), name='unique_voted_user_election'),
+        ),
+    ]
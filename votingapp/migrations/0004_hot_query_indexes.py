@@ -0,0 +1,37 @@
+# Generated by Django 5.0.3 on 2026-10-18 18:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from votingapp.migration_operations import AddIndexConcurrentlyOnPostgres
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('votingapp', '0003_voted_user_unique'),
+    ]
+
+    operations = [
+        AddIndexConcurrentlyOnPostgres(
+            model_name='election',
+            index=models.Index(fields=['end_date'], include=('type',), name='election_end_date_idx'),
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name='election_candidate',
+            index=models.Index(fields=['election', 'candidate'], name='election_candidate_idx'),
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name='vote',
+            index=models.Index(fields=['election', 'candidate'], name='vote_election_candidate_idx'),
+        ),
+        # Dropped only once vote_election_candidate_idx, which also serves the lookups by election, exists.
+        migrations.AlterField(
+            model_name='vote',
+            name='election',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.DO_NOTHING,
+                                    to='votingapp.election'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.3 on 2026-10-18 19:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('votingapp', '0004_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='votinguser',
+            name='nr_pesel',
+            field=models.CharField(db_index=True, max_length=11),
+        ),
+    ]
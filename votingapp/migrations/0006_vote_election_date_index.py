@@ -0,0 +1,21 @@
+# Generated by Django 5.0.3 on 2026-10-18 19:13
+
+from django.db import migrations, models
+
+from votingapp.migration_operations import AddIndexConcurrentlyOnPostgres
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('votingapp', '0005_voting_user_pesel_index'),
+    ]
+
+    operations = [
+        AddIndexConcurrentlyOnPostgres(
+            model_name='vote',
+            index=models.Index(fields=['election', 'date'], name='vote_election_date_idx'),
+        ),
+    ]
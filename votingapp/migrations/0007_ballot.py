@@ -0,0 +1,51 @@
+# Generated by Django 5.0.3 on 2026-10-18 19:19
+
+import struct
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+BATCH_SIZE = 5000
+
+
+def revert_ballots(apps, schema_editor):
+    # Unpacks the stored ballots into one Vote row per selected candidate before the Ballot table is dropped. The
+    # selections hold one little-endian 32-bit candidate ID each.
+    Vote = apps.get_model('votingapp', 'Vote')
+    Ballot = apps.get_model('votingapp', 'Ballot')
+    db_alias = schema_editor.connection.alias
+    batch = []
+    ballots = (Ballot.objects.using(db_alias).order_by('id').values_list('election_id', 'date', 'selections')
+               .iterator(chunk_size=BATCH_SIZE))
+    for election_id, date, selections in ballots:
+        selections = bytes(selections)
+        batch.extend(Vote(election_id=election_id, candidate_id=candidate_id, date=date)
+                     for candidate_id in struct.unpack(f'<{len(selections) // 4}i', selections))
+        if len(batch) >= BATCH_SIZE:
+            Vote.objects.using(db_alias).bulk_create(batch)
+            batch = []
+    Vote.objects.using(db_alias).bulk_create(batch)
+    Ballot.objects.using(db_alias).all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('votingapp', '0006_vote_election_date_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Ballot',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('date', models.DateField()),
+                ('selections', models.BinaryField()),
+                ('election', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING,
+                                               to='votingapp.election')),
+            ],
+        ),
+        # The existing votes are packed into ballots by the `ballots convert` management command, after the
+        # BALLOT_STORAGE setting is switched to 'ballots'.
+        migrations.RunPython(migrations.RunPython.noop, revert_ballots),
+    ]
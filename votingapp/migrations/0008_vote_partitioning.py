@@ -0,0 +1,29 @@
+# Generated by Django 5.0.3 on 2026-10-18 21:02
+
+from django.db import migrations
+
+PARTITIONED_TABLES = ['votingapp_vote', 'votingapp_voted_user', 'votingapp_ballot']
+
+
+def check_unpartitioned(apps, schema_editor):
+    # The tables are partitioned by the `partitions enable` management command, which copies all of their rows, so
+    # the earlier migrations can only be unapplied once `partitions disable` has converted them back.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT partrelid::regclass::text FROM pg_partitioned_table')
+        partitioned = sorted({row[0] for row in cursor.fetchall()} & set(PARTITIONED_TABLES))
+    if partitioned:
+        raise RuntimeError(f"The tables {', '.join(partitioned)} are partitioned; run `manage.py partitions disable` "
+                           f"before unapplying this migration.")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('votingapp', '0007_ballot'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, check_unpartitioned),
+    ]
@@ -2,6 +2,9 @@
 This file defines the models for the voting application.
 """
 
+import sys
+from array import array
+
 from django.contrib.auth.models import User, Group
 from django.db import models
 
@@ -12,7 +15,7 @@ class VotingUser(models.Model):
     """
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     email = models.CharField(max_length=100, unique=True)
-    nr_pesel = models.CharField(max_length=11)
+    nr_pesel = models.CharField(max_length=11, db_index=True)
 
     def __str__(self):
         return self.user.username
@@ -30,6 +33,12 @@ class Election(models.Model):
     end_date = models.DateField()
     allowed_groups = models.ManyToManyField(Group, blank=True)
 
+    class Meta:
+        indexes = [
+            # Covers the end_date range filters of the election list, which only needs the id and type columns.
+            models.Index(fields=['end_date'], include=['type'], name='election_end_date_idx'),
+        ]
+
     def __str__(self):
         return self.type
 
@@ -42,6 +51,11 @@ class Voted_User(models.Model):
     user = models.ForeignKey(VotingUser, on_delete=models.DO_NOTHING)
     election = models.ForeignKey(Election, on_delete=models.DO_NOTHING)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'election'], name='unique_voted_user_election'),
+        ]
+
     def __str__(self):
         return f"{self.user} voted in {self.election}"
 
@@ -67,6 +81,12 @@ class Election_Candidate(models.Model):
     election = models.ForeignKey(Election, on_delete=models.DO_NOTHING)
     candidate = models.ForeignKey(Candidate, on_delete=models.DO_NOTHING)
 
+    class Meta:
+        indexes = [
+            # Lets ballot validation and the candidate list of an election be answered from the index alone.
+            models.Index(fields=['election', 'candidate'], name='election_candidate_idx'),
+        ]
+
     def __str__(self):
         return f"{self.candidate} is a candidate in {self.election}"
 
@@ -77,5 +97,77 @@ class Vote(models.Model):
     """
     id = models.AutoField(primary_key=True)
     candidate = models.ForeignKey(Candidate, on_delete=models.DO_NOTHING)
+    # Indexed together with the candidate below, which also serves lookups by election alone.
+    election = models.ForeignKey(Election, on_delete=models.DO_NOTHING, db_index=False)
+    date = models.DateField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['election', 'candidate'], name='vote_election_candidate_idx'),
+            # Filtering the admin list by election and date.
+            models.Index(fields=['election', 'date'], name='vote_election_date_idx'),
+        ]
+
+
+def pack_candidate_ids(candidate_ids):
+    """
+    Packs candidate IDs into bytes holding one little-endian 32-bit integer per ID, in ascending order.
+    """
+    packed = array('i', sorted(candidate_ids))
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def unpack_candidate_ids(data):
+    """
+    Unpacks candidate IDs packed by pack_candidate_ids.
+    """
+    unpacked = array('i')
+    unpacked.frombytes(data)
+    if sys.byteorder == 'big':
+        unpacked.byteswap()
+    return unpacked.tolist()
+
+
+class Ballot(models.Model):
+    """
+    Represents a ballot cast in an election, with all of its selected candidates in a single row.
+
+    Used instead of one Vote row per selected candidate when the BALLOT_STORAGE setting is 'ballots'. The candidate
+    IDs are packed into `selections` by pack_candidate_ids, so a ballot costs one row and one index entry however many
+    candidates were selected.
+    """
+    id = models.AutoField(primary_key=True)
     election = models.ForeignKey(Election, on_delete=models.DO_NOTHING)
     date = models.DateField()
+    selections = models.BinaryField()
+
+    @property
+    def candidate_ids(self):
+        return unpack_candidate_ids(self.selections)
+
+    def __str__(self):
+        return f"Ballot {self.id} in {self.election}"
+
+
+class Vote_Tally(models.Model):
+    """
+    Represents one shard of the running vote count of a candidate in an election.
+
+    Votes are spread over several shard rows per candidate so that concurrent ballots do not all wait on the same row;
+    the candidate's result is the sum of its shards.
+    """
+    id = models.AutoField(primary_key=True)
+    election = models.ForeignKey(Election, on_delete=models.DO_NOTHING)
+    candidate = models.ForeignKey(Candidate, on_delete=models.DO_NOTHING)
+    shard = models.PositiveSmallIntegerField(default=0)
+    count = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['election', 'candidate', 'shard'], name='unique_vote_tally_shard'),
+        ]
+
+    def __str__(self):
+        return f"{self.candidate} has {self.count} votes in {self.election} (shard {self.shard})"
@@ -0,0 +1,78 @@
+"""
+This file defines the paginator used for the admin pages of the tables that grow with every vote.
+
+Counting the rows of a table with tens of millions of rows takes seconds on PostgreSQL, and the Django paginator
+counts them on every page load. EstimatedCountPaginator asks the query planner for an estimate instead, and only
+counts exactly when the estimate is small enough for an exact count to be cheap.
+"""
+
+import json
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+DEFAULT_EXACT_COUNT_LIMIT = 100000
+
+
+def get_exact_count_limit():
+    """
+    Returns the number of rows up to which they are counted exactly, configurable with the EXACT_COUNT_LIMIT setting.
+    """
+    return getattr(settings, 'EXACT_COUNT_LIMIT', DEFAULT_EXACT_COUNT_LIMIT)
+
+
+def estimate_count(queryset):
+    """
+    Estimates the number of rows of a queryset from the statistics of the database.
+
+    An unfiltered queryset is estimated from the row count PostgreSQL keeps for the table, or for its partitions if it
+    is partitioned (see partitions.py), and a filtered one from the plan of the query.
+
+    Parameters:
+    queryset (QuerySet): The queryset to estimate.
+
+    Returns:
+    int: The estimated number of rows, or None if the database cannot estimate it.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+
+    if not queryset.query.where:
+        # The estimate is -1 for tables that have never been analyzed, and for partitioned tables, whose rows are
+        # counted in their partitions.
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT CASE WHEN c.relkind = 'p' THEN (
+                    SELECT SUM(p.reltuples) FILTER (WHERE p.reltuples >= 0)
+                    FROM pg_inherits i JOIN pg_class p ON p.oid = i.inhrelid
+                    WHERE i.inhparent = c.oid
+                ) WHEN c.reltuples >= 0 THEN c.reltuples END
+                FROM pg_class c
+                WHERE c.oid = %s::regclass
+            """, [connection.ops.quote_name(queryset.model._meta.db_table)])
+            row = cursor.fetchone()
+        return int(row[0]) if row and row[0] is not None else None
+
+    plan = json.loads(queryset.order_by().explain(format='json'))
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    A paginator using an estimated count for large results.
+
+    The `estimated` attribute tells whether the count is an estimate.
+    """
+
+    estimated = False
+
+    @cached_property
+    def count(self):
+        estimate = estimate_count(self.object_list)
+        if estimate is None or estimate < get_exact_count_limit():
+            return super().count
+        self.estimated = True
+        return estimate
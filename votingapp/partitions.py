@@ -0,0 +1,312 @@
+"""
+This file partitions the tables that grow with every ballot (Vote, Voted_User and Ballot) by election on PostgreSQL.
+
+Every query on these tables filters by election, so each election gets a list partition of its own, named
+`<table>_e<election ID>`, and a default partition `<table>_default` catches the rows of elections that have none.
+The partitions of an election are created when the election is created (see signals.py), so the rows of the
+elections being voted in live in small tables with small indexes, and vacuuming them does not touch the rows of
+earlier elections.
+
+The rows of an ended election can be removed from the tables cheaply by archiving its partitions: they are detached and
+moved to the schema named by the VOTE_ARCHIVE_SCHEMA setting, from where they can be dumped with `pg_dump --schema`,
+dropped, or attached again with restore_partitions. The vote tallies are not partitioned, so the results of archived
+elections remain available; their ballots are not, so recounts and audit exports need the partitions to be restored
+first.
+
+PostgreSQL requires the primary key of a partitioned table to include the partition key, so the primary keys of the
+partitioned tables are (id, election_id). Django still treats `id` as the primary key, and the IDs stay unique since
+they are drawn from one sequence. Partitioning is switched on and off with the `partitions` management command. Other
+databases are left untouched.
+"""
+
+import re
+
+from django.conf import settings
+from django.db import connection, transaction
+
+PARTITION_COLUMN = 'election_id'
+
+TABLES = ['votingapp_vote', 'votingapp_voted_user', 'votingapp_ballot']
+
+DEFAULT_ARCHIVE_SCHEMA = 'votingapp_archive'
+
+
+def get_archive_schema():
+    """
+    Returns the schema archived partitions are moved to, configurable with the VOTE_ARCHIVE_SCHEMA setting.
+    """
+    return getattr(settings, 'VOTE_ARCHIVE_SCHEMA', DEFAULT_ARCHIVE_SCHEMA)
+
+
+def supports_partitioning():
+    return connection.vendor == 'postgresql'
+
+
+def partition_name(table, election_id):
+    return f'{table}_e{election_id}'
+
+
+def default_partition_name(table):
+    return f'{table}_default'
+
+
+def quote(name):
+    return connection.ops.quote_name(name)
+
+
+def is_partitioned(table):
+    """
+    Tells whether a table is partitioned.
+    """
+    if not supports_partitioning():
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))',
+                       [table])
+        return cursor.fetchone()[0]
+
+
+def partitioned_tables():
+    """
+    Returns the names of the tables of TABLES that are partitioned.
+    """
+    if not supports_partitioning():
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT partrelid::regclass::text FROM pg_partitioned_table')
+        partitioned = {row[0] for row in cursor.fetchall()}
+    return [table for table in TABLES if table in partitioned]
+
+
+def run_deferred_checks():
+    """
+    Runs the deferred foreign key checks of the current transaction, since PostgreSQL does not alter a table with
+    pending checks.
+    """
+    connection.check_constraints()
+
+
+def _table_exists(cursor, name, schema=None):
+    cursor.execute('SELECT to_regclass(%s) IS NOT NULL', [f'{quote(schema)}.{quote(name)}' if schema else quote(name)])
+    return cursor.fetchone()[0]
+
+
+def _rebuild_table(table, partitioned, election_ids=()):
+    """
+    Replaces a table by a partitioned or a plain copy of itself, with the same rows, indexes and constraints.
+
+    The indexes and constraints are read from the catalog, so indexes added by later migrations are carried over.
+    """
+    old = f'{table}_rebuilt'
+    with transaction.atomic(), connection.cursor() as cursor:
+        run_deferred_checks()
+        cursor.execute(f'LOCK TABLE {quote(table)} IN ACCESS EXCLUSIVE MODE')
+        cursor.execute("""
+            SELECT i.indexrelid::regclass::text, pg_get_indexdef(i.indexrelid)
+            FROM pg_index i
+            WHERE i.indrelid = %s::regclass
+              AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conrelid = i.indrelid AND c.conindid = i.indexrelid)
+        """, [table])
+        indexes = cursor.fetchall()
+        # Not-null constraints are copied with the columns.
+        cursor.execute("""
+            SELECT conname, contype, pg_get_constraintdef(oid)
+            FROM pg_constraint
+            WHERE conrelid = %s::regclass AND contype IN ('p', 'u', 'f', 'c', 'x')
+        """, [table])
+        constraints = cursor.fetchall()
+
+        # Free the names of the indexes and constraints for the new table.
+        for name, _ in indexes:
+            cursor.execute(f'DROP INDEX {name}')
+        for name, _, _ in constraints:
+            cursor.execute(f'ALTER TABLE {quote(table)} DROP CONSTRAINT {quote(name)}')
+        cursor.execute(f'ALTER TABLE {quote(table)} RENAME TO {quote(old)}')
+
+        partition_by = f' PARTITION BY LIST ({PARTITION_COLUMN})' if partitioned else ''
+        cursor.execute(f'CREATE TABLE {quote(table)} (LIKE {quote(old)}){partition_by}')
+        if partitioned:
+            cursor.execute(f'CREATE TABLE {quote(default_partition_name(table))} PARTITION OF {quote(table)} DEFAULT')
+            for election_id in election_ids:
+                cursor.execute(f'CREATE TABLE {quote(partition_name(table, election_id))} PARTITION OF {quote(table)} '
+                               f'FOR VALUES IN (%s)', [election_id])
+        cursor.execute(f'INSERT INTO {quote(table)} SELECT * FROM {quote(old)}')
+        # Drops the identity sequence or the partitions of the old table with it.
+        cursor.execute(f'DROP TABLE {quote(old)}')
+
+        for name, contype, definition in constraints:
+            if contype == 'p':
+                definition = f'PRIMARY KEY (id, {PARTITION_COLUMN})' if partitioned else 'PRIMARY KEY (id)'
+            cursor.execute(f'ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(name)} {definition}')
+        for _, definition in indexes:
+            # The indexes of a partitioned table are defined ON ONLY the parent table.
+            cursor.execute(definition.replace(' ON ONLY ', ' ON ', 1))
+
+        # Identity columns cannot be used on partitioned tables before PostgreSQL 17, so their IDs are drawn from a
+        # sequence owned by the column.
+        if partitioned:
+            sequence = f'{table}_id_seq'
+            cursor.execute(f'CREATE SEQUENCE {quote(sequence)} OWNED BY {quote(table)}.id')
+            cursor.execute(f'ALTER TABLE {quote(table)} ALTER COLUMN id SET DEFAULT nextval(%s::regclass)',
+                           [sequence])
+        else:
+            cursor.execute(f'ALTER TABLE {quote(table)} ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY')
+        cursor.execute(f"SELECT setval(pg_get_serial_sequence(%s, 'id'), COALESCE(MAX(id), 0) + 1, false) "
+                       f"FROM {quote(table)}", [table])
+
+
+def partition_table(table, election_ids):
+    """
+    Converts a table into a table partitioned by election.
+
+    The table is locked and its rows are copied while it is converted, so this should run while the site is down.
+
+    Parameters:
+    table (str): The name of the table.
+    election_ids (iterable): The primary keys of the elections to create partitions for.
+    """
+    _rebuild_table(table, partitioned=True, election_ids=election_ids)
+
+
+def unpartition_table(table):
+    """
+    Converts a table partitioned by election back into a plain table.
+
+    The rows of archived partitions are not copied; restore them first.
+    """
+    _rebuild_table(table, partitioned=False)
+
+
+def create_partitions(election_id):
+    """
+    Creates the partitions of an election in the partitioned tables that do not have them yet.
+
+    Rows of the election that were stored in the default partition are moved to the new partition. The partition is
+    attached to its table rather than created in it, which does not block concurrent writes to other partitions.
+
+    Returns:
+    list: The names of the created partitions.
+    """
+    created = []
+    for table in partitioned_tables():
+        name = partition_name(table, election_id)
+        with transaction.atomic(), connection.cursor() as cursor:
+            if _table_exists(cursor, name) or _table_exists(cursor, name, get_archive_schema()):
+                continue
+            run_deferred_checks()
+            cursor.execute(f'CREATE TABLE {quote(name)} (LIKE {quote(table)})')
+            cursor.execute(f'WITH moved AS (DELETE FROM {quote(default_partition_name(table))} '
+                           f'WHERE {PARTITION_COLUMN} = %s RETURNING *) '
+                           f'INSERT INTO {quote(name)} SELECT * FROM moved', [election_id])
+            cursor.execute(f'ALTER TABLE {quote(table)} ATTACH PARTITION {quote(name)} FOR VALUES IN (%s)',
+                           [election_id])
+        created.append(name)
+    return created
+
+
+def truncate_partition(table, election_id):
+    """
+    Empties the attached partition of an election in a table.
+
+    Returns:
+    int: The number of deleted rows, or None if the table has no partition for the election.
+    """
+    if table not in partitioned_tables():
+        return None
+    name = partition_name(table, election_id)
+    with connection.cursor() as cursor:
+        if not _table_exists(cursor, name):
+            return None
+        run_deferred_checks()
+        cursor.execute(f'SELECT COUNT(*) FROM {quote(name)}')
+        rows = cursor.fetchone()[0]
+        cursor.execute(f'TRUNCATE {quote(name)}')
+    return rows
+
+
+def drop_partitions(election_id):
+    """
+    Drops the attached partitions of an election.
+    """
+    tables = partitioned_tables()
+    if tables:
+        run_deferred_checks()
+    with connection.cursor() as cursor:
+        for table in tables:
+            cursor.execute(f'DROP TABLE IF EXISTS {quote(partition_name(table, election_id))}')
+
+
+def archive_partitions(election_id):
+    """
+    Detaches the partitions of an election and moves them to the archive schema.
+
+    The ballots and the voted users of the election are no longer visible to the application afterwards, so only the
+    partitions of ended elections should be archived. Each table is locked briefly while its partition is detached:
+    PostgreSQL cannot detach a partition concurrently from a table with a default partition.
+
+    Parameters:
+    election_id (int): The primary key of the election.
+
+    Returns:
+    list: The names of the archived partitions.
+    """
+    archived = []
+    schema = get_archive_schema()
+    with connection.cursor() as cursor:
+        cursor.execute(f'CREATE SCHEMA IF NOT EXISTS {quote(schema)}')
+        run_deferred_checks()
+        for table in partitioned_tables():
+            name = partition_name(table, election_id)
+            if not _table_exists(cursor, name):
+                continue
+            cursor.execute(f'ALTER TABLE {quote(table)} DETACH PARTITION {quote(name)}')
+            cursor.execute(f'ALTER TABLE {quote(name)} SET SCHEMA {quote(schema)}')
+            archived.append(name)
+    return archived
+
+
+def restore_partitions(election_id):
+    """
+    Moves the archived partitions of an election back and attaches them to their tables.
+
+    Returns:
+    list: The names of the restored partitions.
+    """
+    restored = []
+    schema = get_archive_schema()
+    for table in partitioned_tables():
+        name = partition_name(table, election_id)
+        with transaction.atomic(), connection.cursor() as cursor:
+            if not _table_exists(cursor, name, schema):
+                continue
+            run_deferred_checks()
+            cursor.execute('SELECT current_schema()')
+            cursor.execute(f'ALTER TABLE {quote(schema)}.{quote(name)} SET SCHEMA {quote(cursor.fetchone()[0])}')
+            cursor.execute(f'ALTER TABLE {quote(table)} ATTACH PARTITION {quote(name)} FOR VALUES IN (%s)',
+                           [election_id])
+        restored.append(name)
+    return restored
+
+
+def partition_status():
+    """
+    Lists the partitions of the partitioned tables, attached and archived.
+
+    Returns:
+    list: A (table, partition, election ID, archived, estimated rows, bytes) tuple per partition. The election ID is
+          None for the default partitions.
+    """
+    status = []
+    with connection.cursor() as cursor:
+        for table in partitioned_tables():
+            cursor.execute("""
+                SELECT c.relname, n.nspname <> current_schema(), c.reltuples, pg_total_relation_size(c.oid)
+                FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE c.relkind = 'r' AND c.relname ~ %s AND n.nspname IN (current_schema(), %s)
+                ORDER BY c.relname
+            """, ['^' + re.escape(table) + r'_(e\d+|default)$', get_archive_schema()])
+            for name, archived, rows, size in cursor.fetchall():
+                suffix = name[len(table) + 1:]
+                election_id = int(suffix[1:]) if suffix != 'default' else None
+                status.append((table, name, election_id, archived, max(int(rows), 0), size))
+    return status
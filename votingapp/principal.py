@@ -0,0 +1,117 @@
+"""
+This file caches the authenticated principal: the User, its VotingUser and the IDs of its groups.
+
+Without it, every authenticated request loads the user from auth_user, and the voter views then load the VotingUser
+and the group IDs, before doing any work of their own. CachedModelBackend keeps the three together in the cache under
+one key per user. The user is loaded with its VotingUser through select_related, so `user.votinguser` is answered
+from the cached instance, and the group IDs are stored on the instance and read with get_group_ids.
+
+Django still verifies the session hash of every request against the cached user, so a session is only accepted while
+it matches the cached password hash. The receivers in signals.py drop a user's entry when the user logs in or out, and
+when the user, its VotingUser or its group memberships change.
+"""
+
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import User
+from django.core.cache import cache
+
+from .db_routing import primary
+from .models import VotingUser
+
+DEFAULT_TIMEOUT = 5 * 60
+
+GROUP_IDS_ATTRIBUTE = 'cached_group_ids'
+
+
+def get_timeout():
+    """
+    Returns the lifetime of the cached principals in seconds, configurable with the PRINCIPAL_CACHE_TIMEOUT setting.
+    """
+    return getattr(settings, 'PRINCIPAL_CACHE_TIMEOUT', DEFAULT_TIMEOUT)
+
+
+def principal_key(user_id):
+    return f'votingapp:principal:{user_id}'
+
+
+def invalidate_principals(user_ids):
+    """
+    Drops the cached principals of the given users.
+    """
+    cache.delete_many([principal_key(user_id) for user_id in user_ids])
+
+
+def load_principal(user_id):
+    """
+    Loads a user with its VotingUser and group IDs from the database.
+
+    Returns:
+    User: The user, or None if there is no user with the given ID.
+    """
+    try:
+        user = User._default_manager.select_related('votinguser').get(pk=user_id)
+    except User.DoesNotExist:
+        return None
+    setattr(user, GROUP_IDS_ATTRIBUTE, list(user.groups.values_list('id', flat=True)))
+    return user
+
+
+def get_principal(user_id):
+    """
+    Returns a user with its VotingUser and group IDs, from the cache if possible.
+
+    Returns:
+    User: The user, or None if there is no user with the given ID.
+    """
+    key = principal_key(user_id)
+    user = cache.get(key)
+    if user is None:
+        with primary():
+            user = load_principal(user_id)
+        if user is not None:
+            cache.set(key, user, get_timeout())
+    return user
+
+
+def get_group_ids(user):
+    """
+    Returns the IDs of the groups of a user, without a query if the user was loaded by CachedModelBackend.
+    """
+    group_ids = getattr(user, GROUP_IDS_ATTRIBUTE, None)
+    if group_ids is None:
+        group_ids = list(user.groups.values_list('id', flat=True))
+    return group_ids
+
+
+async def aget_group_ids(user):
+    """
+    Async version of get_group_ids.
+    """
+    group_ids = getattr(user, GROUP_IDS_ATTRIBUTE, None)
+    if group_ids is None:
+        group_ids = [group_id async for group_id in user.groups.values_list('id', flat=True)]
+    return group_ids
+
+
+async def aget_voting_user(user):
+    """
+    Returns the VotingUser of a user, or None if the user is not a voter. Does not query the database if the user
+    was loaded by CachedModelBackend.
+    """
+    if User.votinguser.is_cached(user):
+        return getattr(user, 'votinguser', None)
+    try:
+        return await VotingUser.objects.aget(user_id=user.id)
+    except VotingUser.DoesNotExist:
+        return None
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    The model authentication backend, loading the user of a session from the principal cache.
+    """
+
+    def get_user(self, user_id):
+        user = get_principal(user_id)
+        return user if user is not None and self.user_can_authenticate(user) else None
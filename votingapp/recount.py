@@ -0,0 +1,228 @@
+"""
+This file recounts elections from their raw ballots with NumPy.
+
+The candidate IDs of the ballots are loaded as integer arrays and counted with numpy.bincount, which takes a fraction
+of a second per ten million selections. The ballots are read from one of three sources:
+    archive: The ballot archive of the election (see archives.py), mapped into memory.
+    db:      The Vote and Ballot rows of the election, fetched in chunks.
+    file:    A ballot archive, or an audit export of the election (see exports.py), CSV or NDJSON, optionally
+             gzip-compressed.
+
+Large elections are split into shards, counted on a pool of worker processes (see recount_worker.py), and the partial
+counts are added up. A recount reports the per-candidate totals, the turnout and the differences from the stored
+results, that is the vote tallies of the election.
+"""
+
+import csv
+import gzip
+import io
+import json
+import multiprocessing
+import os
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.db.models import Count, Max, Min
+
+from .archives import BallotArchive, archive_path
+from .models import Ballot, Vote, Voted_User
+from .recount_worker import bincount, count_archive_slice, count_row_range, init_worker, merge_counts
+from .tallies import count_tallies
+
+SOURCES = ('archive', 'db', 'file')
+
+# The number of candidate IDs of an archive counted per shard.
+DEFAULT_SHARD_SIZE = 8 * 1024 * 1024
+
+# The number of database rows counted per shard, and fetched at a time.
+DEFAULT_SHARD_ROWS = 1000000
+DB_CHUNK_SIZE = 20000
+
+# The number of rows of an export parsed before they are counted.
+EXPORT_CHUNK_SIZE = 1000000
+
+
+class RecountError(Exception):
+    """
+    Raised when the ballots of an election cannot be recounted from the requested source.
+    """
+
+
+def _run_shards(function, shards, workers, initializer=None):
+    """
+    Calls a function with the arguments of every shard, on a pool of worker processes if there is more than one shard
+    and workers > 1, and returns the results.
+    """
+    if workers <= 1 or len(shards) <= 1:
+        return [function(*shard) for shard in shards]
+    # Spawned rather than forked, so the workers do not inherit the database connection of this process.
+    with ProcessPoolExecutor(max_workers=min(workers, len(shards)), mp_context=multiprocessing.get_context('spawn'),
+                             initializer=initializer) as executor:
+        return list(executor.map(function, *zip(*shards)))
+
+
+def count_archive(archive, workers, shard_size=DEFAULT_SHARD_SIZE):
+    """
+    Counts the ballots of a ballot archive.
+
+    Parameters:
+    archive (BallotArchive): The open archive.
+    workers (int): The number of worker processes.
+    shard_size (int): The number of candidate IDs counted per shard.
+
+    Returns:
+    ndarray: The counts, indexed by candidate ID.
+    """
+    length = archive.width * archive.ballot_count
+    shards = [
+        (str(archive.path), archive.columns_offset + 4 * start, min(shard_size, length - start))
+        for start in range(0, length, shard_size)
+    ]
+    return merge_counts(_run_shards(count_archive_slice, shards, workers))
+
+
+def count_rows(election_id, workers, shard_rows=DEFAULT_SHARD_ROWS):
+    """
+    Counts the Vote and Ballot rows of an election, in shards of consecutive row IDs.
+
+    Parameters:
+    election_id (int): The primary key of the election.
+    workers (int): The number of worker processes.
+    shard_rows (int): The approximate number of rows counted per shard.
+
+    Returns:
+    ndarray: The counts, indexed by candidate ID.
+    """
+    shards = []
+    for model_name, model in (('vote', Vote), ('ballot', Ballot)):
+        bounds = model.objects.filter(election_id=election_id).aggregate(first=Min('id'), last=Max('id'),
+                                                                         rows=Count('id'))
+        if not bounds['rows']:
+            continue
+        shard_count = -(-bounds['rows'] // shard_rows)
+        step = -(-(bounds['last'] - bounds['first'] + 1) // shard_count)
+        for first_id in range(bounds['first'], bounds['last'] + 1, step):
+            shards.append((model_name, election_id, first_id, min(first_id + step - 1, bounds['last']),
+                           DB_CHUNK_SIZE))
+    return merge_counts(_run_shards(count_row_range, shards, workers, initializer=init_worker))
+
+
+def count_export(path, election_id):
+    """
+    Counts the ballots of an audit export.
+
+    Parameters:
+    path (Path): The path of the export, ending in .csv or .ndjson, optionally followed by .gz.
+    election_id (int): The primary key of the election the export must belong to.
+
+    Returns:
+    ndarray: The counts, indexed by candidate ID.
+
+    Raises:
+    RecountError: If the format of the file is unknown, or it holds ballots of another election.
+    """
+    suffixes = path.suffixes[-2:] if path.suffix == '.gz' else path.suffixes[-1:]
+    export_format = suffixes[0].lstrip('.') if suffixes else ''
+    if export_format not in ('csv', 'ndjson'):
+        raise RecountError(f"Cannot tell the format of {path}; expected a .csv or .ndjson file.")
+
+    opener = gzip.open if path.suffix == '.gz' else open
+    counts = []
+    candidate_ids = array('i')
+    with opener(path, 'rb') as raw:
+        lines = io.TextIOWrapper(raw, encoding='utf-8', newline='')
+        if export_format == 'csv':
+            rows = csv.DictReader(lines)
+        else:
+            rows = (json.loads(line) for line in lines if line.strip())
+        for row in rows:
+            if int(row['election_id']) != election_id:
+                raise RecountError(f"{path} holds ballots of election {row['election_id']}, not {election_id}.")
+            candidate_ids.append(int(row['candidate_id']))
+            if len(candidate_ids) >= EXPORT_CHUNK_SIZE:
+                counts.append(bincount(np.frombuffer(candidate_ids, dtype=np.int32)))
+                candidate_ids = array('i')
+    counts.append(bincount(np.frombuffer(candidate_ids, dtype=np.int32)))
+    return merge_counts(counts)
+
+
+def recount_election(election, source=None, path=None, workers=None, shard_size=DEFAULT_SHARD_SIZE,
+                     shard_rows=DEFAULT_SHARD_ROWS):
+    """
+    Recounts the ballots of an election and compares the result with its tallies.
+
+    Parameters:
+    election (Election): The election to recount.
+    source (str): 'archive', 'db' or 'file'; defaults to the archive of the election if it has one, else the database.
+    path (Path): The ballot archive or export to count, for the 'file' source.
+    workers (int): The number of worker processes; 0 or 1 counts in this process. Defaults to the number of CPUs.
+    shard_size (int): The number of archived candidate IDs counted per shard.
+    shard_rows (int): The approximate number of database rows counted per shard.
+
+    Returns:
+    dict: The recount, with the keys
+        - election_id (int), source (str) and seconds (float): What was counted, from where, and how long it took.
+        - counts (dict): The votes per candidate primary key.
+        - total_votes (int): The number of selections counted.
+        - ballots (int): The number of archived ballots, or None for the other sources.
+        - voted_users (int), eligible_voters (int) and turnout (float): The turnout, in percent of eligible voters.
+        - differences (dict): The candidates whose stored result differs, mapped to (stored, counted) pairs.
+
+    Raises:
+    RecountError: If the source does not exist or does not hold the ballots of the election.
+    """
+    started = time.perf_counter()
+    workers = (os.cpu_count() or 1) if workers is None else workers
+    if source is None:
+        source = 'archive' if archive_path(election.id).exists() else 'db'
+    if source == 'archive':
+        path = archive_path(election.id)
+    elif source == 'file' and path is None:
+        raise RecountError("The 'file' source needs the path of a ballot archive or export.")
+    if path is not None:
+        path = Path(path)
+        if not path.exists():
+            raise RecountError(f"{path} does not exist.")
+
+    ballots = None
+    archived_turnout = None
+    if path is not None and path.suffix == '.vba':
+        with BallotArchive(path) as archive:
+            if archive.election_id != election.id:
+                raise RecountError(f"{path} is the archive of election {archive.election_id}, not {election.id}.")
+            counts = count_archive(archive, workers, shard_size)
+            ballots = archive.ballot_count
+            archived_turnout = (archive.metadata['voted_users'], archive.metadata['eligible_voters'])
+    elif path is not None:
+        counts = count_export(path, election.id)
+    else:
+        counts = count_rows(election.id, workers, shard_rows)
+
+    if archived_turnout is not None:
+        voted_users, eligible_voters = archived_turnout
+    else:
+        voted_users = Voted_User.objects.filter(election_id=election.id).count()
+        eligible_voters = User.objects.filter(groups__in=election.allowed_groups.all()).distinct().count()
+
+    counted = {int(candidate_id): int(counts[candidate_id]) for candidate_id in np.flatnonzero(counts)}
+    stored = count_tallies(election.id)
+    return {
+        'election_id': election.id,
+        'source': source,
+        'counts': counted,
+        'total_votes': sum(counted.values()),
+        'ballots': ballots,
+        'voted_users': voted_users,
+        'eligible_voters': eligible_voters,
+        'turnout': voted_users / eligible_voters * 100 if eligible_voters else 0,
+        'differences': {
+            candidate_id: (stored.get(candidate_id, 0), counted.get(candidate_id, 0))
+            for candidate_id in sorted(set(stored) | set(counted))
+            if stored.get(candidate_id, 0) != counted.get(candidate_id, 0)
+        },
+        'seconds': time.perf_counter() - started,
+    }
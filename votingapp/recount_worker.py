@@ -0,0 +1,79 @@
+"""
+This file holds the entry points of the recount processes started by recount.py.
+
+The worker processes import this module before Django is set up, so it must not import models or anything that
+depends on them at module level. Counting archive slices does not need Django at all; counting rows of the database
+does, and those pools are started with init_worker.
+"""
+
+from itertools import islice
+
+import numpy as np
+
+from .report_worker import init_worker  # noqa: F401
+
+
+def bincount(candidate_ids):
+    """
+    Counts the occurrences of every candidate ID in an integer array, ignoring the empty slots (0).
+
+    Returns:
+    ndarray: The counts, indexed by candidate ID.
+    """
+    counts = np.bincount(candidate_ids)
+    if len(counts):
+        counts[0] = 0
+    return counts
+
+
+def count_archive_slice(path, offset, length):
+    """
+    Counts a slice of the ballot columns of a ballot archive.
+
+    Parameters:
+    path (str): The path of the archive.
+    offset (int): The byte offset of the slice in the file.
+    length (int): The number of 32-bit candidate IDs in the slice.
+    """
+    return bincount(np.memmap(path, dtype='<i4', mode='r', offset=offset, shape=(length,)))
+
+
+def count_row_range(model_name, election_id, first_id, last_id, chunk_size):
+    """
+    Counts the Vote or Ballot rows of an election whose IDs lie in a range.
+
+    Parameters:
+    model_name (str): 'vote' or 'ballot'.
+    election_id (int): The primary key of the election.
+    first_id (int): The lowest row ID of the range.
+    last_id (int): The highest row ID of the range.
+    chunk_size (int): The number of rows fetched from the database and counted at a time.
+    """
+    from .models import Ballot, Vote
+
+    if model_name == 'vote':
+        rows = (Vote.objects.filter(election_id=election_id, id__range=(first_id, last_id))
+                .values_list('candidate_id', flat=True).iterator(chunk_size=chunk_size))
+    else:
+        rows = (Ballot.objects.filter(election_id=election_id, id__range=(first_id, last_id))
+                .values_list('selections', flat=True).iterator(chunk_size=chunk_size))
+
+    counts = []
+    while chunk := list(islice(rows, chunk_size)):
+        if model_name == 'vote':
+            candidate_ids = np.fromiter(chunk, dtype=np.int64, count=len(chunk))
+        else:
+            # The packed selections of the ballots, concatenated, form one array of candidate IDs.
+            candidate_ids = np.frombuffer(b''.join(map(bytes, chunk)), dtype='<i4')
+        counts.append(bincount(candidate_ids))
+    return merge_counts(counts)
+
+
+def merge_counts(counts):
+    """
+    Adds up count arrays of different lengths.
+    """
+    merged = np.zeros(max((len(partial) for partial in counts), default=0), dtype=np.int64)
+    for partial in counts:
+        merged[:len(partial)] += partial
+    return merged
@@ -0,0 +1,216 @@
+"""
+This file holds the backends that turn a report context (see reports.build_report_context) into a PDF document.
+
+The backend is chosen with the REPORT_RENDERER setting, either by the name of a built-in backend or by the dotted path
+of a ReportRenderer subclass:
+    'pisa':   Renders the report template to HTML and has xhtml2pdf lay the HTML and CSS out. Any template can be
+              used, at the cost of parsing the HTML and CSS of every report again.
+    'canvas': Draws the content of election_report_template.html straight onto a reportlab canvas. The fonts and the
+              layout are set up once per process, so a report only costs the drawing of its own text.
+
+Like the PDF engines themselves, the backends are only imported by the processes that render reports.
+"""
+
+import io
+
+from django.conf import settings
+from django.template.loader import get_template
+from django.utils.formats import date_format
+from django.utils.module_loading import import_string
+
+RENDERERS = {
+    'pisa': 'votingapp.renderers.PisaRenderer',
+    'canvas': 'votingapp.renderers.CanvasRenderer',
+}
+
+DEFAULT_RENDERER = 'pisa'
+
+_renderers = {}
+
+
+class ReportRenderError(Exception):
+    """
+    Raised when a PDF report cannot be rendered.
+    """
+
+
+def get_renderer_name():
+    """
+    Returns the name or dotted path of the report backend, configurable with the REPORT_RENDERER setting.
+    """
+    return getattr(settings, 'REPORT_RENDERER', DEFAULT_RENDERER)
+
+
+def get_renderer(name=None):
+    """
+    Returns the instance of a report backend, creating it on first use.
+
+    Parameters:
+    name (str): The name or dotted path of the backend; defaults to the REPORT_RENDERER setting.
+
+    Raises:
+    ImproperlyConfigured: If the dotted path cannot be imported.
+    """
+    name = name or get_renderer_name()
+    renderer = _renderers.get(name)
+    if renderer is None:
+        renderer = _renderers[name] = import_string(RENDERERS.get(name, name))()
+    return renderer
+
+
+class ReportRenderer:
+    """
+    The interface of the report backends.
+    """
+
+    def preload(self):
+        """
+        Imports and sets up everything the backend needs, so that the first report does not pay for it.
+        """
+
+    def render(self, template_path, context):
+        """
+        Renders a report.
+
+        Parameters:
+        template_path (str): The path to the HTML template of the report.
+        context (dict): The report context, as returned by reports.build_report_context.
+
+        Returns:
+        bytes: The PDF document.
+
+        Raises:
+        ReportRenderError: If the report cannot be rendered.
+        """
+        raise NotImplementedError
+
+
+class PisaRenderer(ReportRenderer):
+    """
+    Renders the report template to HTML and converts it with xhtml2pdf.
+    """
+
+    def preload(self):
+        from xhtml2pdf import pisa  # noqa: F401
+
+    def render(self, template_path, context):
+        from xhtml2pdf import pisa
+
+        html = get_template(template_path).render(context).encode('utf-8')
+        result = io.BytesIO()
+        pisa_status = pisa.CreatePDF(html, dest=result, encoding='utf-8')
+        if pisa_status.err:
+            raise ReportRenderError(str(pisa_status.err))
+        return result.getvalue()
+
+
+class CanvasRenderer(ReportRenderer):
+    """
+    Draws the report straight onto a reportlab canvas, in the layout of election_report_template.html: a centered
+    title, the election details, a table of the candidates' votes and the generation date. The template is not read.
+    """
+
+    FONT = 'Helvetica'
+    BOLD_FONT = 'Helvetica-Bold'
+    FONT_SIZE = 11
+    MARGIN = 56
+    ROW_HEIGHT = 22
+    CELL_PADDING = 6
+
+    def __init__(self):
+        self._layout = None
+
+    def preload(self):
+        self.layout()
+
+    def layout(self):
+        """
+        Returns the positions and fonts shared by every report, computing them on first use.
+        """
+        if self._layout is None:
+            from reportlab.lib.pagesizes import A4
+            from reportlab.pdfbase.pdfmetrics import getFont
+
+            for font in (self.FONT, self.BOLD_FONT):
+                # Loads the font metrics once, instead of on the first string measured in each report.
+                getFont(font)
+            width, height = A4
+            table_width = width - 2 * self.MARGIN
+            self._layout = {
+                'page_size': A4,
+                'width': width,
+                'height': height,
+                'left': self.MARGIN,
+                'right': width - self.MARGIN,
+                'top': height - self.MARGIN,
+                'bottom': self.MARGIN,
+                'votes_x': self.MARGIN + table_width * 0.75,
+                'name_width': table_width * 0.75 - 2 * self.CELL_PADDING,
+            }
+        return self._layout
+
+    def render(self, template_path, context):
+        from reportlab.lib.utils import simpleSplit
+        from reportlab.pdfgen.canvas import Canvas
+
+        layout = self.layout()
+        election = context['election']
+        output = io.BytesIO()
+        canvas = Canvas(output, pagesize=layout['page_size'], pageCompression=1, invariant=1)
+        canvas.setTitle(f'{election.type} Report')
+
+        y = layout['top'] - 24
+        canvas.setFont(self.BOLD_FONT, 22)
+        canvas.drawCentredString(layout['width'] / 2, y, f'{election.type} - Report')
+        y -= 56
+
+        for label, value in (('Start Date:', date_format(election.start_date)),
+                             ('End Date:', date_format(election.end_date)),
+                             ('Total Votes:', context['total_votes']),
+                             ('Voting Turnout:', f"{context['voting_percentage']}%")):
+            canvas.setFont(self.BOLD_FONT, self.FONT_SIZE)
+            canvas.drawString(layout['left'], y, label)
+            canvas.setFont(self.FONT, self.FONT_SIZE)
+            canvas.drawString(layout['left'] + 96, y, str(value))
+            y -= 20
+
+        y -= 16
+        canvas.setFont(self.BOLD_FONT, 16)
+        canvas.drawString(layout['left'], y, 'Candidate Votes')
+        y -= 12
+
+        y = self._draw_row(canvas, layout, y, ['Candidate'], 'Votes', header=True)
+        for name, votes in context['candidate_votes'].items():
+            lines = simpleSplit(name, self.FONT, self.FONT_SIZE, layout['name_width']) or ['']
+            if y - self.ROW_HEIGHT * len(lines) < layout['bottom'] + 40:
+                canvas.showPage()
+                y = self._draw_row(canvas, layout, layout['top'], ['Candidate'], 'Votes', header=True)
+            y = self._draw_row(canvas, layout, y, lines, str(votes))
+
+        canvas.setFont(self.FONT, self.FONT_SIZE)
+        canvas.drawCentredString(layout['width'] / 2, max(y - 50, layout['bottom']), f"Generated on: {context['date']}")
+        canvas.save()
+        return output.getvalue()
+
+    def _draw_row(self, canvas, layout, y, lines, votes, header=False):
+        """
+        Draws a row of the votes table with its top edge at y, and returns the y of its bottom edge.
+        """
+        height = self.ROW_HEIGHT + (len(lines) - 1) * (self.FONT_SIZE + 3)
+        bottom = y - height
+        canvas.setStrokeColorRGB(0.867, 0.867, 0.867)
+        if header:
+            canvas.setFillColorRGB(0.949, 0.949, 0.949)
+            canvas.rect(layout['left'], bottom, layout['right'] - layout['left'], height, stroke=1, fill=1)
+            canvas.setFillColorRGB(0, 0, 0)
+        else:
+            canvas.rect(layout['left'], bottom, layout['right'] - layout['left'], height, stroke=1, fill=0)
+        canvas.line(layout['votes_x'], bottom, layout['votes_x'], y)
+
+        canvas.setFont(self.BOLD_FONT if header else self.FONT, self.FONT_SIZE)
+        text_y = y - self.CELL_PADDING - self.FONT_SIZE + 2
+        for line in lines:
+            canvas.drawString(layout['left'] + self.CELL_PADDING, text_y, line)
+            text_y -= self.FONT_SIZE + 3
+        canvas.drawString(layout['votes_x'] + self.CELL_PADDING, y - self.CELL_PADDING - self.FONT_SIZE + 2, votes)
+        return bottom
@@ -0,0 +1,132 @@
+"""
+This file runs the rendering of PDF reports on a pool of worker processes.
+
+Rendering a report is CPU-bound; doing it in the request thread lets a wave of downloads occupy every web worker.
+Instead, a request for a report that is not in the report cache submits a job to a bounded process pool and gets an
+immediate answer pointing to the job, which the client polls until the PDF is ready.
+
+A job is identified by the election ID and the fingerprint of the report content (see reports.py), so identical
+concurrent requests are coalesced into a single render. The rendered file lands in the shared report cache, which
+lets any web process answer for a job once it is done, not only the one that submitted it.
+
+Settings:
+    REPORT_WORKERS: The number of rendering processes. 0 renders in the request thread, which is handy for
+                    development and tests.
+    REPORT_QUEUE_DEPTH: The maximum number of jobs waiting or running in one web process. Further requests are
+                        refused until the queue drains.
+"""
+
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+
+from .report_worker import init_renderer, render_job
+from .reports import cached_report_path, report_fingerprint
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 2
+DEFAULT_QUEUE_DEPTH = 32
+
+_lock = threading.RLock()
+_executor = None
+_jobs = {}
+
+
+class ReportQueueFull(Exception):
+    """
+    Raised when a report job cannot be accepted because too many jobs are waiting.
+    """
+
+
+def get_workers():
+    return getattr(settings, 'REPORT_WORKERS', DEFAULT_WORKERS)
+
+
+def get_queue_depth():
+    return getattr(settings, 'REPORT_QUEUE_DEPTH', DEFAULT_QUEUE_DEPTH)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        # Worker processes are spawned rather than forked, so they do not inherit the database connections and
+        # threads of the web process.
+        _executor = ProcessPoolExecutor(max_workers=get_workers(), mp_context=multiprocessing.get_context('spawn'),
+                                        initializer=init_renderer)
+    return _executor
+
+
+def job_id(template_path, context):
+    """
+    Returns the ID of the job rendering the report for the given context.
+    """
+    return report_fingerprint(template_path, context)
+
+
+def submit(template_path, context):
+    """
+    Starts rendering a report, or returns the job already rendering the same report.
+
+    Parameters:
+    template_path (str): The path to the HTML template.
+    context (dict): The report context, as returned by reports.build_report_context.
+
+    Returns:
+    Future: The job; its result is the path of the rendered PDF.
+
+    Raises:
+    ReportQueueFull: If REPORT_QUEUE_DEPTH jobs are already waiting or running.
+    """
+    fingerprint = job_id(template_path, context)
+    path = cached_report_path(context['election'].id, fingerprint)
+    key = (context['election'].id, fingerprint)
+
+    with _lock:
+        job = _jobs.get(key)
+        if job is not None:
+            if job.done():
+                # A failed job is reported once, then the next request retries the rendering.
+                del _jobs[key]
+            return job
+
+        if get_workers() <= 0:
+            job = Future()
+            try:
+                job.set_result(render_job(template_path, context, path))
+            except Exception as e:
+                job.set_exception(e)
+            return job
+
+        pending = sum(1 for pending_job in _jobs.values() if not pending_job.done())
+        if pending >= get_queue_depth():
+            raise ReportQueueFull(f"{pending} report jobs are already queued")
+
+        job = _get_executor().submit(render_job, template_path, context, path)
+        _jobs[key] = job
+        job.add_done_callback(lambda finished: _forget(key, finished))
+        logger.debug("Queued report job %s for election ID: %s", fingerprint, key[0])
+        return job
+
+
+def _forget(key, job):
+    """
+    Drops a successful job from the registry, its PDF is in the report cache from now on. Failed jobs are kept until
+    a request has seen the failure.
+    """
+    global _executor
+    if job.cancelled() or job.exception() is None:
+        with _lock:
+            if _jobs.get(key) is job:
+                del _jobs[key]
+        return
+
+    logger.error("Report job %s for election ID %s failed: %s", key[1], key[0], job.exception())
+    if isinstance(job.exception(), BrokenProcessPool):
+        # A worker died; start a fresh pool for the next jobs.
+        with _lock:
+            _executor = None
@@ -0,0 +1,42 @@
+"""
+This file holds the entry points of the report rendering processes started by report_jobs.py.
+
+The worker processes import this module before Django is set up, so it must not import models or anything that
+depends on them at module level.
+"""
+
+
+def init_worker():
+    """
+    Sets up Django in a freshly started worker process.
+    """
+    import django
+    django.setup()
+
+
+def init_renderer():
+    """
+    Sets up Django in a freshly started report worker and loads the report backend with its PDF engine, which the web
+    processes never import, so that the first report rendered by the worker does not pay for it.
+    """
+    init_worker()
+    from .renderers import get_renderer
+    get_renderer().preload()
+
+
+def render_job(template_path, context, path):
+    """
+    Renders a report and stores it in the report cache.
+
+    Parameters:
+    template_path (str): The path to the HTML template.
+    context (dict): The report context, as returned by reports.build_report_context.
+    path (Path): The path of the report in the report cache.
+
+    Returns:
+    Path: The path of the stored report.
+    """
+    from .reports import render_pdf, store_report
+
+    store_report(path, render_pdf(template_path, context))
+    return path
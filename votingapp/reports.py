@@ -0,0 +1,252 @@
+"""
+This file builds the election reports and keeps the generated PDF files.
+
+Rendering a PDF report is expensive while its content only changes when the results of the election change.
+Generated PDFs are therefore stored in REPORT_CACHE_DIR under a name made of the election ID and a fingerprint of
+the report content (results, turnout and election details). A changed result yields a new fingerprint, so stale files
+are never served; they simply age out. The directory is kept below REPORT_CACHE_MAX_BYTES by removing the least
+recently served files.
+
+The PDF documents are rendered by the backend chosen with the REPORT_RENDERER setting, see renderers.py. The backend
+is part of the fingerprint, so switching it does not serve the files of the other backend.
+
+The reports of elections compacted into ballot archives (see archives.py) are built from the snapshot stored in the
+archive.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+from .archives import open_archive
+from .models import Voted_User
+from .renderers import ReportRenderError, get_renderer, get_renderer_name  # noqa: F401
+from .tallies import aget_election_results, get_election_results
+
+logger = logging.getLogger(__name__)
+
+REPORT_TEMPLATE = 'election_report_template.html'
+
+# Bump when the layout of the PDF report changes, so that files rendered with the old layout are not served anymore.
+REPORT_VERSION = 1
+
+DEFAULT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+
+def build_report_context(election):
+    """
+    Collects the data shown in the report of an election.
+
+    Parameters:
+    election (Election): The election to report on.
+
+    Returns:
+    dict: The template context, with the election, total_votes, candidate_votes, voting_percentage and date.
+    """
+    archive = open_archive(election.id)
+    if archive is not None:
+        return _archived_report_context(election, archive)
+    total_votes, candidate_votes = get_election_results(election)
+    eligible_voters_count = _eligible_voters(election).count()
+    voted_users_count = Voted_User.objects.filter(election=election).count()
+    return _report_context(election, total_votes, candidate_votes, eligible_voters_count, voted_users_count)
+
+
+async def abuild_report_context(election):
+    """
+    Async version of build_report_context.
+    """
+    archive = open_archive(election.id)
+    if archive is not None:
+        return _archived_report_context(election, archive)
+    total_votes, candidate_votes = await aget_election_results(election)
+    eligible_voters_count = await _eligible_voters(election).acount()
+    voted_users_count = await Voted_User.objects.filter(election=election).acount()
+    return _report_context(election, total_votes, candidate_votes, eligible_voters_count, voted_users_count)
+
+
+def _archived_report_context(election, archive):
+    with archive:
+        total_votes, candidate_votes = archive.results()
+        return _report_context(election, total_votes, candidate_votes, archive.metadata['eligible_voters'],
+                               archive.metadata['voted_users'])
+
+
+def _eligible_voters(election):
+    return User.objects.filter(groups__in=election.allowed_groups.all()).distinct()
+
+
+def _report_context(election, total_votes, candidate_votes, eligible_voters_count, voted_users_count):
+    if eligible_voters_count == 0:
+        voting_percentage = 0
+    else:
+        voting_percentage = (voted_users_count / eligible_voters_count) * 100
+
+    return {
+        'election': election,
+        'total_votes': total_votes,
+        'candidate_votes': candidate_votes,
+        'voting_percentage': voting_percentage,
+        'date': timezone.now().strftime('%Y-%m-%d')
+    }
+
+
+def report_fingerprint(template_path, context):
+    """
+    Computes a fingerprint of everything that determines the content of a report, except its generation date.
+
+    Parameters:
+    template_path (str): The path to the HTML template.
+    context (dict): The report context, as returned by build_report_context.
+
+    Returns:
+    str: A hexadecimal digest.
+    """
+    election = context['election']
+    content = {
+        'version': REPORT_VERSION,
+        'template': template_path,
+        'renderer': get_renderer_name(),
+        'election': [election.id, election.type, str(election.start_date), str(election.end_date)],
+        'total_votes': context['total_votes'],
+        'candidate_votes': sorted(context['candidate_votes'].items()),
+        'voting_percentage': context['voting_percentage'],
+    }
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def render_pdf(template_path, context):
+    """
+    Renders a report template to a PDF document with the backend chosen by the REPORT_RENDERER setting (see
+    renderers.py).
+
+    Parameters:
+    template_path (str): The path to the HTML template.
+    context (dict): The context to be put in the document.
+
+    Returns:
+    bytes: The PDF document.
+
+    Raises:
+    ReportRenderError: If the backend cannot render the report.
+    """
+    return get_renderer().render(template_path, context)
+
+
+def get_cache_dir():
+    """
+    Returns the directory holding the generated reports, configurable with the REPORT_CACHE_DIR setting.
+    """
+    return Path(getattr(settings, 'REPORT_CACHE_DIR', Path(settings.BASE_DIR) / 'report_cache'))
+
+
+def get_cache_max_bytes():
+    """
+    Returns the size limit of the report directory, configurable with the REPORT_CACHE_MAX_BYTES setting.
+    """
+    return getattr(settings, 'REPORT_CACHE_MAX_BYTES', DEFAULT_CACHE_MAX_BYTES)
+
+
+def cached_report_path(election_id, fingerprint):
+    return get_cache_dir() / f'election_{election_id}_{fingerprint}.pdf'
+
+
+def store_report(path, data):
+    """
+    Writes a report to the cache directory atomically, then evicts old reports if the directory grew too large.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    evict_reports(get_cache_max_bytes(), keep=path)
+
+
+def evict_reports(max_bytes, keep=None):
+    """
+    Removes the least recently served reports until the cache directory holds at most max_bytes.
+
+    Parameters:
+    max_bytes (int): The size limit in bytes.
+    keep (Path): A report that must not be removed, such as the one that is about to be served.
+
+    Returns:
+    int: The number of removed reports.
+    """
+    entries = []
+    for path in get_cache_dir().glob('election_*.pdf'):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in sorted(entries, key=lambda entry: entry[0]):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+    if removed:
+        logger.debug("Evicted %d cached reports.", removed)
+    return removed
+
+
+def find_cached_report(template_path, context):
+    """
+    Returns the path of the cached PDF report for the given context, or None if it has not been rendered yet.
+
+    Parameters:
+    template_path (str): The path to the HTML template.
+    context (dict): The report context, as returned by build_report_context.
+
+    Returns:
+    Path: The path of the PDF file, or None.
+    """
+    path = cached_report_path(context['election'].id, report_fingerprint(template_path, context))
+    try:
+        # The modification time records when the report was last served, which drives the eviction order.
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    return path
+
+
+def get_report_pdf(template_path, context):
+    """
+    Returns the path of the PDF report for the given context, rendering and storing it if it is not cached yet.
+
+    Parameters:
+    template_path (str): The path to the HTML template.
+    context (dict): The report context, as returned by build_report_context.
+
+    Returns:
+    Path: The path of the PDF file.
+
+    Raises:
+    ReportRenderError: If the report has to be rendered and rendering fails.
+    """
+    path = find_cached_report(template_path, context)
+    if path is None:
+        path = cached_report_path(context['election'].id, report_fingerprint(template_path, context))
+        store_report(path, render_pdf(template_path, context))
+    return path
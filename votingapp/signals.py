@@ -0,0 +1,188 @@
+"""
+This file defines the signals of the voting application and the receivers that keep its caches up to date.
+
+Signals:
+    ballot_cast: Sent after the transaction storing a ballot has been committed, with the arguments `election_id`,
+                 `voting_user_id` and `candidate_ids`.
+
+On PostgreSQL, the partitions of an election's ballots are created with the election and dropped with it, see
+partitions.py.
+
+Committed ballots are announced to the observers of the live results (see live_results.py).
+
+The cached ballot of an election (see ballot_cache.py) is dropped when the election, its candidates or their links to
+it change.
+
+The cached principals (see principal.py) are dropped when a user logs in or out, and when the user, its VotingUser
+or its groups change.
+
+Cache entries are dropped only once the transaction that changed the data commits, so that a concurrent request
+cannot put the old data back into the cache.
+"""
+
+from django.contrib.auth.models import User, Group
+from django.contrib.auth.signals import user_logged_in, user_logged_out
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import Signal, receiver
+
+from . import ballot_cache, election_cache, live_results, partitions, principal
+from .models import Candidate, Election, Election_Candidate, VotingUser
+
+ballot_cast = Signal()
+
+
+def invalidate_groups_on_commit(group_ids):
+    group_ids = list(group_ids)
+    if group_ids:
+        transaction.on_commit(lambda: election_cache.invalidate_groups(group_ids))
+
+
+@receiver(post_save, sender=Election)
+@receiver(pre_delete, sender=Election)
+def election_changed(sender, instance, **kwargs):
+    """
+    Drops the cached election lists of the groups allowed to vote in a saved or deleted election.
+    """
+    invalidate_groups_on_commit(instance.allowed_groups.values_list('id', flat=True))
+
+
+def invalidate_ballots_on_commit(election_ids):
+    election_ids = list(election_ids)
+    if election_ids:
+        transaction.on_commit(lambda: ballot_cache.invalidate_ballots(election_ids))
+
+
+@receiver(post_save, sender=Election)
+@receiver(post_delete, sender=Election)
+def election_ballot_changed(sender, instance, **kwargs):
+    """
+    Drops the cached ballot of a saved or deleted election.
+    """
+    invalidate_ballots_on_commit([instance.pk])
+
+
+@receiver(post_save, sender=Election_Candidate)
+@receiver(post_delete, sender=Election_Candidate)
+def election_candidate_changed(sender, instance, **kwargs):
+    """
+    Drops the cached ballot of the election a candidate was added to or removed from.
+    """
+    invalidate_ballots_on_commit([instance.election_id])
+
+
+@receiver(post_save, sender=Candidate)
+@receiver(pre_delete, sender=Candidate)
+def candidate_changed(sender, instance, **kwargs):
+    """
+    Drops the cached ballots of the elections of a saved or deleted candidate.
+    """
+    invalidate_ballots_on_commit(Election_Candidate.objects.filter(candidate=instance)
+                                 .values_list('election_id', flat=True).distinct())
+
+
+@receiver(post_save, sender=Election)
+def election_created(sender, instance, created, **kwargs):
+    """
+    Creates the partitions of a new election in the partitioned ballot tables.
+    """
+    if created:
+        partitions.create_partitions(instance.pk)
+
+
+@receiver(post_delete, sender=Election)
+def election_deleted(sender, instance, **kwargs):
+    """
+    Drops the partitions of a deleted election.
+    """
+    partitions.drop_partitions(instance.pk)
+
+
+@receiver(m2m_changed, sender=Election.allowed_groups.through)
+def election_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Drops the cached election lists of the groups added to or removed from the allowed groups of an election.
+    """
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if reverse:
+        # The groups of an election were changed from the group side, `instance` is the group.
+        invalidate_groups_on_commit([instance.pk])
+    elif action == 'pre_clear':
+        invalidate_groups_on_commit(instance.allowed_groups.values_list('id', flat=True))
+    else:
+        invalidate_groups_on_commit(pk_set)
+
+
+@receiver(ballot_cast)
+def voted(sender, voting_user_id, **kwargs):
+    """
+    Drops the cached set of elections the voter has voted in.
+    """
+    election_cache.invalidate_voted(voting_user_id)
+
+
+@receiver(ballot_cast)
+def results_changed(sender, election_id, **kwargs):
+    """
+    Marks the live results of the election as changed, see live_results.py.
+    """
+    live_results.hub.mark_changed(election_id)
+
+
+def invalidate_principals_on_commit(user_ids):
+    user_ids = list(user_ids)
+    if user_ids:
+        transaction.on_commit(lambda: principal.invalidate_principals(user_ids))
+
+
+@receiver(user_logged_in)
+@receiver(user_logged_out)
+def session_changed(sender, user, **kwargs):
+    """
+    Drops the cached principal of a user logging in or out.
+    """
+    if user is not None:
+        principal.invalidate_principals([user.pk])
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    """
+    Drops the cached principal of a saved or deleted user.
+    """
+    invalidate_principals_on_commit([instance.pk])
+
+
+@receiver(post_save, sender=VotingUser)
+@receiver(post_delete, sender=VotingUser)
+def voting_user_changed(sender, instance, **kwargs):
+    """
+    Drops the cached principal of the user of a saved or deleted VotingUser.
+    """
+    invalidate_principals_on_commit([instance.user_id])
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Drops the cached principals of the users added to or removed from a group.
+    """
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        # The groups of a user were changed, `instance` is the user.
+        invalidate_principals_on_commit([instance.pk])
+    elif action == 'pre_clear':
+        invalidate_principals_on_commit(instance.user_set.values_list('id', flat=True))
+    else:
+        invalidate_principals_on_commit(pk_set)
+
+
+@receiver(pre_delete, sender=Group)
+def group_deleted(sender, instance, **kwargs):
+    """
+    Drops the cached principals of the members of a deleted group.
+    """
+    invalidate_principals_on_commit(instance.user_set.values_list('id', flat=True))
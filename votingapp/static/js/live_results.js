@@ -0,0 +1,21 @@
+// Keeps the results of an open election up to date from its live results stream (see votingapp/live_results.py).
+let summary = document.querySelector('[data-live-results]');
+if (summary && window.EventSource) {
+    let source = new EventSource(summary.dataset.liveResults);
+    source.addEventListener('results', function(event) {
+        let results = JSON.parse(event.data);
+        document.getElementById('totalVotes').textContent = results.total_votes;
+
+        let candidateVotes = document.getElementById('candidateVotes');
+        candidateVotes.replaceChildren();
+        for (let [name, votes] of Object.entries(results.candidate_votes)) {
+            let item = document.createElement('li');
+            item.textContent = name + ': ' + votes;
+            candidateVotes.append(item, document.createElement('br'));
+        }
+    });
+    // Sent after the final results once the election has ended.
+    source.addEventListener('end', function() {
+        source.close();
+    });
+}
@@ -0,0 +1,198 @@
+"""
+This file maintains the per-candidate vote tallies of the voting application.
+
+Each cast ballot increments the Vote_Tally rows of the selected candidates in the same transaction that stores the
+ballot, so reports read a handful of counters per candidate instead of scanning every Vote of the election.
+The counters are sharded: a ballot picks one of VOTE_TALLY_SHARDS rows per candidate at random, which keeps
+concurrent voters from queueing on a single hot row.
+
+The raw ballots (the Vote rows, or the Ballot rows with the 'ballots' storage) stay the source of truth; the functions
+below can rebuild or verify the tallies from them.
+"""
+
+import random
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+
+from .models import Ballot, Vote, Vote_Tally, unpack_candidate_ids
+
+DEFAULT_TALLY_SHARDS = 8
+
+
+def get_shard_count():
+    """
+    Returns the number of counter rows kept per candidate, configurable with the VOTE_TALLY_SHARDS setting.
+    """
+    return max(1, int(getattr(settings, 'VOTE_TALLY_SHARDS', DEFAULT_TALLY_SHARDS)))
+
+
+def increment_tallies(election_id, candidate_ids):
+    """
+    Adds one vote for each of the given candidates to the election tallies.
+
+    All counters are upserted with a single statement. Must be called inside the transaction that creates the
+    corresponding Vote or Ballot rows so that the tallies and the votes are committed (or rolled back) together.
+
+    Parameters:
+    election_id (int): The primary key of the election the votes were cast in.
+    candidate_ids (iterable): The primary keys of the selected candidates.
+    """
+    counts = Counter(int(candidate_id) for candidate_id in candidate_ids)
+    if not counts:
+        return
+
+    shard = random.randrange(get_shard_count())
+    table = connection.ops.quote_name(Vote_Tally._meta.db_table)
+    rows = []
+    params = []
+    # Rows are sorted by candidate so that concurrent ballots always lock the counters in the same order.
+    for candidate_id in sorted(counts):
+        rows.append('(%s, %s, %s, %s)')
+        params.extend([election_id, candidate_id, shard, counts[candidate_id]])
+
+    sql = (
+        f'INSERT INTO {table} (election_id, candidate_id, shard, count) VALUES {", ".join(rows)} '
+        f'ON CONFLICT (election_id, candidate_id, shard) DO UPDATE SET count = {table}.count + EXCLUDED.count'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def get_election_results(election):
+    """
+    Reads the results of an election from its tallies.
+
+    Parameters:
+    election (Election): The election to read the results of.
+
+    Returns:
+    tuple:
+        - total_votes (int): The total number of votes cast in the election.
+        - candidate_votes (dict): A dictionary mapping candidate names to their vote counts.
+    """
+    return _collect_results(_results_query(election))
+
+
+async def aget_election_results(election):
+    """
+    Async version of get_election_results.
+    """
+    return _collect_results([row async for row in _results_query(election)])
+
+
+def _results_query(election):
+    return (Vote_Tally.objects.filter(election=election)
+            .values('candidate_id', 'candidate__name', 'candidate__surname')
+            .annotate(votes=Sum('count'))
+            .order_by('candidate_id'))
+
+
+def _collect_results(rows):
+    total_votes = 0
+    candidate_votes = {}
+    for row in rows:
+        if not row['votes']:
+            continue
+        candidate_full_name = f"{row['candidate__name']} {row['candidate__surname']}"
+        candidate_votes[candidate_full_name] = candidate_votes.get(candidate_full_name, 0) + row['votes']
+        total_votes += row['votes']
+    return total_votes, candidate_votes
+
+
+def count_votes(election_id):
+    """
+    Counts the votes of an election per candidate straight from its Vote and Ballot rows.
+
+    Parameters:
+    election_id (int): The primary key of the election.
+
+    Returns:
+    dict: A dictionary mapping candidate primary keys to their vote counts.
+    """
+    rows = Vote.objects.filter(election_id=election_id).values('candidate_id').annotate(votes=Count('id'))
+    counts = Counter({row['candidate_id']: row['votes'] for row in rows.order_by()})
+    ballots = Ballot.objects.filter(election_id=election_id).values_list('selections', flat=True)
+    for selections in ballots.iterator(chunk_size=5000):
+        counts.update(unpack_candidate_ids(selections))
+    return dict(counts)
+
+
+def count_tallies(election_id):
+    """
+    Sums the tally shards of an election per candidate.
+
+    Parameters:
+    election_id (int): The primary key of the election.
+
+    Returns:
+    dict: A dictionary mapping candidate primary keys to their tallied vote counts.
+    """
+    return _collect_tallies(_tallies_query(election_id))
+
+
+async def acount_tallies(election_id):
+    """
+    Async version of count_tallies.
+    """
+    return _collect_tallies([row async for row in _tallies_query(election_id)])
+
+
+def _tallies_query(election_id):
+    return Vote_Tally.objects.filter(election_id=election_id).values('candidate_id').annotate(votes=Sum('count')) \
+        .order_by()
+
+
+def _collect_tallies(rows):
+    return {row['candidate_id']: row['votes'] for row in rows if row['votes']}
+
+
+def rebuild_tallies(election_id, counts=None):
+    """
+    Replaces the tallies of an election with counts recomputed from its ballots.
+
+    The election's tally rows are locked for the duration of the rebuild, so it should not race with ballots that
+    are being cast at the same time.
+
+    Parameters:
+    election_id (int): The primary key of the election.
+    counts (dict): The counts to store, e.g. counted from a ballot archive; defaults to the result of count_votes.
+
+    Returns:
+    dict: The recomputed counts, mapping candidate primary keys to vote counts.
+    """
+    with transaction.atomic():
+        list(Vote_Tally.objects.select_for_update().filter(election_id=election_id).values_list('id', flat=True))
+        if counts is None:
+            counts = count_votes(election_id)
+        Vote_Tally.objects.filter(election_id=election_id).delete()
+        Vote_Tally.objects.bulk_create([
+            Vote_Tally(election_id=election_id, candidate_id=candidate_id, shard=0, count=votes)
+            for candidate_id, votes in counts.items()
+        ])
+    return counts
+
+
+def verify_tallies(election_id, counted=None):
+    """
+    Compares the tallies of an election with the counts of its ballots.
+
+    Parameters:
+    election_id (int): The primary key of the election.
+    counted (dict): The counts to compare with, e.g. counted from a ballot archive; defaults to the result of
+                    count_votes.
+
+    Returns:
+    dict: A dictionary mapping the primary keys of mismatching candidates to (tallied, counted) pairs.
+          An empty dictionary means the tallies are correct.
+    """
+    tallied = count_tallies(election_id)
+    if counted is None:
+        counted = count_votes(election_id)
+    return {
+        candidate_id: (tallied.get(candidate_id, 0), counted.get(candidate_id, 0))
+        for candidate_id in set(tallied) | set(counted)
+        if tallied.get(candidate_id, 0) != counted.get(candidate_id, 0)
+    }
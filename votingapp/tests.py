@@ -1,3 +1,1349 @@
-from django.test import TestCase
+"""
+This file contains the tests of the voting application.
+"""
 
-# Create your tests here.
+import asyncio
+import concurrent.futures
+import datetime
+import gzip
+import io
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from asgiref.sync import async_to_sync, sync_to_async
+
+from django.contrib.auth.models import User, Group, Permission
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from votingsite.logging_handlers import DebugSamplingFilter, QueuedRotatingFileHandler
+
+from . import (archives, async_views, db_routing, election_cache, ingest, live_results, metrics, partitions, principal,
+               report_jobs, reports, views)
+from .ballots import AlreadyVotedError, cast_ballot, convert_votes, revert_ballots
+from .benchmarking import measure_startup
+from .exports import export_chunks
+from .middleware import ReplicaRoutingMiddleware
+from .models import VotingUser, Election, Candidate, Election_Candidate, Vote, Voted_User, Vote_Tally, Ballot
+from .paginators import estimate_count
+from .recount import recount_election
+from .renderers import RENDERERS, get_renderer
+from .reports import REPORT_TEMPLATE, build_report_context, find_cached_report, get_report_pdf, report_fingerprint
+from .tallies import count_tallies, count_votes, verify_tallies
+from .voter_import import VoterImporter, get_state_path
+
+# Tables read on every page view; queries against them must be answered through an index.
+HOT_TABLES = [
+    'votingapp_election',
+    'votingapp_election_candidate',
+    'votingapp_vote',
+    'votingapp_vote_tally',
+    'votingapp_voted_user',
+    'votingapp_votinguser',
+]
+
+# The manifest storage of the settings needs collectstatic to have run, which the tests do not do.
+PLAIN_STATIC_FILES = override_settings(STORAGES={
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+})
+
+
+def seed_elections(voters=20, elections=6, candidates=5):
+    """
+    Creates a group of voters, ongoing and ended elections with candidates, and ballots cast in them.
+
+    Returns:
+    tuple: The list of VotingUser instances and the list of Election instances.
+    """
+    group = Group.objects.create(name='voters')
+    voting_users = []
+    for i in range(voters):
+        user = User.objects.create_user(username=f'voter{i}@example.com', password='password')
+        user.groups.add(group)
+        voting_users.append(VotingUser.objects.create(user=user, email=user.username, nr_pesel=f'{i:011d}'))
+
+    today = datetime.date.today()
+    created = []
+    for i in range(elections):
+        end_date = today + datetime.timedelta(days=10 if i % 2 else -10)
+        election = Election.objects.create(creator=voting_users[0], type=f'Election {i}', max_votes=2,
+                                           start_date=today - datetime.timedelta(days=20), end_date=end_date)
+        election.allowed_groups.add(group)
+        candidate_ids = []
+        for j in range(candidates):
+            candidate = Candidate.objects.create(name=f'Name {j}', surname=f'Surname {i}', description='')
+            Election_Candidate.objects.create(election=election, candidate=candidate)
+            candidate_ids.append(candidate.id)
+        for k, voting_user in enumerate(voting_users[1:]):
+            cast_ballot(voting_user, election, [candidate_ids[k % candidates]])
+        created.append(election)
+    return voting_users, created
+
+
+@PLAIN_STATIC_FILES
+class QueryPlanTests(TestCase):
+    """
+    Checks that the queries issued by the views use indexes on the hot tables instead of scanning them.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.voting_users, cls.elections = seed_elections()
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.voting_users[0].user)
+
+    def explain(self, sql):
+        """
+        Returns the query plan of a query as a list of lines.
+        """
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # The seeded tables are tiny, so the planner has to be told to prefer an index whenever one exists.
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute(f'EXPLAIN {sql}')
+                return [row[0] for row in cursor.fetchall()]
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [row[-1] for row in cursor.fetchall()]
+
+    def full_scans(self, plan):
+        """
+        Returns the lines of a query plan that read a hot table without an index.
+        """
+        if connection.vendor == 'postgresql':
+            return [line for line in plan if any(f'Seq Scan on {table} ' in f'{line} ' for table in HOT_TABLES)]
+        return [line for line in plan if line.split(' USING ')[0] in [f'SCAN {table}' for table in HOT_TABLES]
+                and 'INDEX' not in line]
+
+    def assertViewUsesIndexes(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        for query in queries.captured_queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT'):
+                continue
+            # CaptureQueriesContext keeps the SQL with its parameters already interpolated.
+            plan = self.explain(sql)
+            self.assertEqual(self.full_scans(plan), [], f"Full table scan in query:\n{sql}\n" + '\n'.join(plan))
+
+    def test_election_list(self):
+        self.assertViewUsesIndexes(reverse('election_list'))
+
+    def test_election_detail(self):
+        self.assertViewUsesIndexes(reverse('election_detail', args=[self.elections[1].id]))
+
+    def test_ended_elections_report(self):
+        self.assertViewUsesIndexes(reverse('ended_elections_report', args=[self.elections[0].id]))
+
+
+@PLAIN_STATIC_FILES
+class ElectionListCacheTests(TestCase):
+    """
+    Checks that the cached election list is shared between groups and invalidated when the data behind it changes.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.voting_users, cls.elections = seed_elections(voters=3, elections=2, candidates=2)
+        cls.other_group = Group.objects.create(name='others')
+        cls.voting_users[0].user.groups.add(cls.other_group)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.voting_users[0].user)
+
+    def get_lists(self):
+        response = self.client.get(reverse('election_list'))
+        return ([election['id'] for election in response.context['ongoing_elections']],
+                [election['id'] for election in response.context['ended_elections']])
+
+    def test_elections_of_several_groups_are_listed_once(self):
+        self.elections[1].allowed_groups.add(self.other_group)
+        self.assertEqual(self.get_lists(), ([self.elections[1].id], [self.elections[0].id]))
+
+    def test_cached_list_does_not_query_elections(self):
+        self.get_lists()
+        with CaptureQueriesContext(connection) as queries:
+            self.get_lists()
+        self.assertFalse([query for query in queries.captured_queries if 'votingapp_election' in query['sql']])
+        self.assertFalse([query for query in queries.captured_queries if 'votingapp_voted_user' in query['sql']])
+
+    def test_election_changes_invalidate_the_list(self):
+        self.assertEqual(self.get_lists(), ([self.elections[1].id], [self.elections[0].id]))
+
+        election = self.elections[1]
+        election.end_date = self.elections[0].end_date
+        with self.captureOnCommitCallbacks(execute=True):
+            election.save()
+        self.assertEqual(self.get_lists(), ([], [self.elections[0].id, election.id]))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            election.allowed_groups.clear()
+        self.assertEqual(self.get_lists(), ([], [self.elections[0].id]))
+
+    def test_entries_of_every_date_are_invalidated(self):
+        group_ids = [group.id for group in self.voting_users[0].user.groups.all()]
+        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        ended = {self.elections[0].id: self.elections[0].type}
+        self.assertEqual(election_cache.get_group_elections(group_ids, tomorrow)[1], ended)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.elections[0].allowed_groups.clear()
+        self.assertEqual(election_cache.get_group_elections(group_ids, tomorrow)[1], {})
+
+    def test_entry_loaded_before_a_change_is_not_served(self):
+        group_ids = [group.id for group in self.voting_users[0].user.groups.all()]
+        today = datetime.date.today()
+        group_entries = election_cache._group_entries
+
+        def committed_while_loading(*args):
+            entries = group_entries(*args)
+            election_cache.invalidate_groups(group_ids)
+            return entries
+
+        with mock.patch.object(election_cache, '_group_entries', side_effect=committed_while_loading):
+            election_cache.get_group_elections(group_ids, today)
+        with CaptureQueriesContext(connection) as queries:
+            election_cache.get_group_elections(group_ids, today)
+        self.assertEqual(len(queries.captured_queries), 1)
+
+    def test_casting_a_ballot_invalidates_the_list(self):
+        self.assertEqual(self.get_lists(), ([self.elections[1].id], [self.elections[0].id]))
+        candidate = Election_Candidate.objects.filter(election=self.elections[1]).first().candidate
+        with self.captureOnCommitCallbacks(execute=True):
+            cast_ballot(self.voting_users[0], self.elections[1], [candidate.id])
+        self.assertEqual(self.get_lists(), ([], [self.elections[0].id]))
+
+
+@PLAIN_STATIC_FILES
+class BallotCacheTests(TestCase):
+    """
+    Checks that the ballot page is served from the cache and that candidate changes invalidate it.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.voting_users, cls.elections = seed_elections(voters=2, elections=2, candidates=2)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.voting_users[0].user)
+
+    def test_cached_ballot_only_checks_the_voter(self):
+        url = reverse('election_detail', args=[self.elections[1].id])
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        app_queries = [query['sql'] for query in queries.captured_queries if 'votingapp_' in query['sql']]
+        self.assertEqual(len(app_queries), 1)
+        self.assertIn('votingapp_voted_user', app_queries[0])
+
+        candidate = Candidate.objects.create(name='Late', surname='Entry', description='')
+        self.assertNotContains(response, f'value="{candidate.id}"')
+        with self.captureOnCommitCallbacks(execute=True):
+            Election_Candidate.objects.create(election=self.elections[1], candidate=candidate)
+        self.assertContains(self.client.get(url), f'value="{candidate.id}"')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url, {'candidate': [candidate.id]})
+        self.assertTrue(Vote.objects.filter(election=self.elections[1], candidate=candidate).exists())
+
+
+@PLAIN_STATIC_FILES
+class AsyncViewTests(TestCase):
+    """
+    Checks that the async views render the same pages as the sync ones.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.voting_users, cls.elections = seed_elections(voters=3, elections=2, candidates=2)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.voting_users[0].user)
+
+    def call_async(self, view, *args):
+        request = AsyncRequestFactory().get('/')
+        user = self.voting_users[0].user
+
+        async def auser():
+            return user
+        request.auser = auser
+        return async_to_sync(view)(request, *args)
+
+    def test_election_list(self):
+        response = self.call_async(async_views.election_list)
+        self.assertEqual(response.content, self.client.get(reverse('election_list')).content)
+
+    def test_ended_elections_report(self):
+        election_id = self.elections[0].id
+        response = self.call_async(async_views.ended_elections_report, election_id)
+        self.assertEqual(response.content,
+                         self.client.get(reverse('ended_elections_report', args=[election_id])).content)
+
+    def test_election_detail(self):
+        response = self.call_async(async_views.election_detail, self.elections[1].id)
+        self.assertEqual(response.status_code, 200)
+        for candidate in Candidate.objects.filter(election_candidate__election=self.elections[1]):
+            self.assertContains(response, f'value="{candidate.id}"')
+
+
+@PLAIN_STATIC_FILES
+class RequestMetricsTests(TestCase):
+    """
+    Checks that the request metrics count the queries of each view and are served in the Prometheus format.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.voting_users, cls.elections = seed_elections(voters=3, elections=2, candidates=2)
+
+    def setUp(self):
+        cache.clear()
+        metrics.reset_metrics()
+        self.client.force_login(self.voting_users[0].user)
+
+    def test_server_timing_header_counts_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('election_list'))
+        self.assertIn(f'desc="{len(queries.captured_queries)} queries"', response.headers['Server-Timing'])
+        self.assertIn('tpl;dur=', response.headers['Server-Timing'])
+
+    @override_settings(METRICS_ALLOWED_IPS=['127.0.0.1'])
+    def test_metrics_endpoint(self):
+        self.client.get(reverse('election_list'))
+        self.client.get('/no-such-page/')
+
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('votingapp_requests_total{view="election_list",method="GET",status="200"} 1', body)
+        self.assertIn('votingapp_request_duration_seconds_count{view="election_list"} 1', body)
+        self.assertIn('votingapp_db_queries_bucket{view="<unresolved>",le="+Inf"} 1', body)
+        self.assertNotIn('view="metrics"', body)
+
+    def test_metrics_endpoint_is_refused_by_default(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics_endpoint_requires_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        response = self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, 200)
+
+
+class VoterImportTests(TestCase):
+    """
+    Checks that rosters are imported in chunks, skipping invalid and duplicate records, and that an import resumes.
+    """
+
+    def write_roster(self, records):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'roster.ndjson')
+        with open(path, 'w') as roster:
+            for record in records:
+                roster.write(json.dumps(record) + '\n')
+        return path
+
+    def test_import(self):
+        path = self.write_roster([
+            {'email': 'a@example.com', 'nr_pesel': '00000000001', 'password': 'secret', 'groups': ['x']},
+            {'email': 'b@example.com', 'nr_pesel': '00000000002', 'groups': ['x', 'y']},
+            {'email': 'A@example.com', 'nr_pesel': '00000000003'},
+            {'email': 'c@example.com', 'nr_pesel': '00000000002'},
+            {'email': 'not an address', 'nr_pesel': '00000000004'},
+            {'email': 'd@example.com', 'nr_pesel': '00000000005'},
+        ])
+        result = VoterImporter(path, chunk_size=2, workers=0).run()
+
+        self.assertEqual((result['imported'], result['skipped'], result['invalid']), (3, 2, 1))
+        self.assertEqual(sorted(VotingUser.objects.values_list('email', flat=True)),
+                         ['a@example.com', 'b@example.com', 'd@example.com'])
+        self.assertTrue(User.objects.get(username='a@example.com').check_password('secret'))
+        self.assertFalse(User.objects.get(username='b@example.com').has_usable_password())
+        self.assertEqual(sorted(User.objects.get(username='b@example.com').groups.values_list('name', flat=True)),
+                         ['x', 'y'])
+        self.assertFalse(os.path.exists(get_state_path(path)))
+
+    def test_resume(self):
+        path = self.write_roster([{'email': f'{i}@example.com', 'nr_pesel': f'{i:011d}'} for i in range(5)])
+        with open(get_state_path(path), 'w') as state:
+            json.dump({'roster': os.path.abspath(path), 'line': 3, 'imported': 3, 'skipped': 0, 'invalid': 0}, state)
+
+        result = VoterImporter(path, chunk_size=2, workers=0).run()
+
+        self.assertEqual(result['imported'], 5)
+        self.assertEqual(sorted(VotingUser.objects.values_list('email', flat=True)),
+                         ['3@example.com', '4@example.com'])
+
+    def test_resumed_import_counts_each_line_once(self):
+        records = [{'email': f'{i}@example.com', 'nr_pesel': f'{i:011d}'} for i in range(6)]
+        records.insert(2, {'email': 'not an address', 'nr_pesel': '99999999999'})
+        path = self.write_roster(records)
+        write = VoterImporter._write
+
+        def fail_second_chunk(importer, *args):
+            if importer.state['line']:
+                raise RuntimeError("The database went away.")
+            write(importer, *args)
+
+        with mock.patch.object(VoterImporter, '_write', fail_second_chunk), self.assertRaises(RuntimeError):
+            VoterImporter(path, chunk_size=2, workers=0).run()
+        result = VoterImporter(path, chunk_size=2, workers=0).run()
+
+        self.assertEqual((result['imported'], result['skipped'], result['invalid']), (6, 0, 1))
+
+    def test_existing_address_in_another_case_is_skipped(self):
+        user = User.objects.create_user('Mixed.Case@Example.com', 'Mixed.Case@Example.com')
+        VotingUser.objects.create(user=user, email=user.email, nr_pesel='00000000009')
+        path = self.write_roster([{'email': 'mixed.case@example.com', 'nr_pesel': '00000000001'}])
+
+        result = VoterImporter(path, workers=0).run()
+
+        self.assertEqual((result['imported'], result['skipped']), (0, 1))
+        self.assertEqual(User.objects.count(), 1)
+
+
+@PLAIN_STATIC_FILES
+class PrincipalCacheTests(TestCase):
+    """
+    Checks that authenticated page views read the session and the user from the cache, and that the cached user
+    follows changes of its groups and profile.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.voting_users, cls.elections = seed_elections(voters=3, elections=2, candidates=2)
+        cls.user = cls.voting_users[0].user
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_page_view_does_not_load_the_principal(self):
+        self.client.get(reverse('election_list'))
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('election_list'))
+        tables = ['django_session', 'auth_user', 'votingapp_votinguser']
+        self.assertEqual([query['sql'] for query in queries.captured_queries
+                          if any(f'"{table}"' in query['sql'] for table in tables)], [])
+
+    def test_group_change_invalidates_the_principal(self):
+        self.client.get(reverse('election_list'))
+        group = Group.objects.create(name='late joiners')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.groups.add(group)
+        self.assertIn(group.id, principal.get_principal(self.user.id).cached_group_ids)
+
+    def test_logout_and_profile_change_invalidate_the_principal(self):
+        self.client.get(reverse('election_list'))
+        VotingUser.objects.filter(pk=self.voting_users[0].pk).update(nr_pesel='99999999999')
+        self.voting_users[0].refresh_from_db()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.voting_users[0].save()
+        self.assertEqual(principal.get_principal(self.user.id).votinguser.nr_pesel, '99999999999')
+
+        self.client.get(reverse('logout'))
+        self.assertIsNone(cache.get(principal.principal_key(self.user.id)))
+
+
+@PLAIN_STATIC_FILES
+class LargeTableAdminTests(TestCase):
+    """
+    Checks that the admin lists of the vote tables page by primary key without a query per row.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.voting_users, cls.elections = seed_elections(voters=8, elections=2, candidates=2)
+        cls.admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def setUp(self):
+        self.client.force_login(self.admin_user)
+
+    def selected_ids(self, response):
+        return [int(pk) for pk in re.findall(r'name="_selected_action" value="(\d+)"', response.content.decode())]
+
+    @mock.patch('votingapp.admin.VoteAdmin.list_per_page', 5)
+    def test_keyset_pages(self):
+        vote_ids = sorted(Vote.objects.values_list('id', flat=True), reverse=True)
+        url = reverse('admin:votingapp_vote_changelist')
+
+        first = self.client.get(url)
+        self.assertEqual(self.selected_ids(first), vote_ids[:5])
+        self.assertEqual(first.context['cl'].next_url, f'?after={vote_ids[4]}')
+        second = self.client.get(url + first.context['cl'].next_url)
+        self.assertEqual(self.selected_ids(second), vote_ids[5:10])
+        previous = self.client.get(url + second.context['cl'].previous_url)
+        self.assertEqual(self.selected_ids(previous), vote_ids[:5])
+        self.assertIsNone(previous.context['cl'].previous_url)
+
+    def test_rows_do_not_query_related_objects(self):
+        for model in ('vote', 'voted_user', 'election_candidate'):
+            with self.subTest(model=model):
+                url = reverse(f'admin:votingapp_{model}_changelist')
+                self.client.get(url)
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url)
+                self.assertGreater(len(self.selected_ids(response)), 3)
+                self.assertLess(len(queries), 8)
+
+
+class BallotExportTests(TestCase):
+    """
+    Checks that the ballots of ended elections are streamed to users who may view votes.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.voting_users, cls.elections = seed_elections(voters=4, elections=2, candidates=2)
+        cls.auditor = User.objects.create_user('auditor@example.com', password='password')
+        cls.auditor.user_permissions.add(Permission.objects.get(codename='view_vote'))
+
+    def setUp(self):
+        self.client.force_login(self.auditor)
+
+    def test_export(self):
+        ended = self.elections[0]
+        url = reverse('election_ballots_export', args=[ended.id])
+
+        response = self.client.get(url)
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        rows = gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()
+        self.assertEqual(rows[0], 'vote_id,ballot_id,election_id,candidate_id,candidate,date,archived_ballot')
+        self.assertEqual(len(rows) - 1, Vote.objects.filter(election=ended).count())
+
+        response = self.client.get(url, {'format': 'ndjson', 'compress': 'none'})
+        ballots = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(sorted(ballot['vote_id'] for ballot in ballots),
+                         sorted(Vote.objects.filter(election=ended).values_list('id', flat=True)))
+
+    def test_export_of_purged_election(self):
+        ended = self.elections[0]
+        candidate_ids = sorted(Vote.objects.filter(election=ended).values_list('candidate_id', flat=True))
+        with tempfile.TemporaryDirectory() as directory, override_settings(BALLOT_ARCHIVE_DIR=directory):
+            archives.compact_election(ended, purge=True)
+            self.assertFalse(Vote.objects.filter(election=ended).exists())
+
+            response = self.client.get(reverse('election_ballots_export', args=[ended.id]),
+                                       {'format': 'ndjson', 'compress': 'none'})
+            ballots = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+            self.assertEqual(sorted(ballot['candidate_id'] for ballot in ballots), candidate_ids)
+            with archives.open_archive(ended.id) as archive:
+                self.assertEqual({ballot['archived_ballot'] for ballot in ballots},
+                                 set(range(1, archive.ballot_count + 1)))
+            self.assertTrue(all(ballot['candidate'].startswith('Name ') for ballot in ballots))
+
+            export = os.path.join(directory, 'ballots.csv')
+            call_command('export_ballots', ended.id, output=export, stderr=io.StringIO())
+            with open(export) as export_file:
+                self.assertEqual(len(export_file.readlines()) - 1, len(candidate_ids))
+
+    def test_export_is_restricted(self):
+        ongoing = self.elections[1]
+        self.assertEqual(self.client.get(reverse('election_ballots_export', args=[ongoing.id])).status_code, 403)
+        self.client.force_login(self.voting_users[0].user)
+        url = reverse('election_ballots_export', args=[self.elections[0].id])
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+
+@override_settings(VOTE_TALLY_SHARDS=4)
+class VoteTallyTests(TestCase):
+    """
+    Checks that the sharded tallies add up to the votes cast.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.voting_users, cls.elections = seed_elections(voters=1, elections=2, candidates=3)
+        cls.election = cls.elections[1]
+        cls.candidate_ids = list(cls.election.election_candidate_set.values_list('candidate_id', flat=True))
+        cls.late_voters = [
+            VotingUser.objects.create(user=User.objects.create_user(f'late{i}@example.com'),
+                                      email=f'late{i}@example.com', nr_pesel=f'9999999999{i}')
+            for i in range(6)
+        ]
+
+    def test_ballots_are_tallied_across_shards(self):
+        with mock.patch('votingapp.tallies.random.randrange', side_effect=[0, 1, 2, 3, 0, 1]) as randrange:
+            for i, voting_user in enumerate(self.late_voters):
+                cast_ballot(voting_user, self.election, [self.candidate_ids[0], self.candidate_ids[1 + i % 2]])
+        randrange.assert_called_with(4)
+
+        shards = Vote_Tally.objects.filter(election=self.election, candidate_id=self.candidate_ids[0])
+        self.assertEqual(sorted(shards.values_list('shard', flat=True)), [0, 1, 2, 3])
+        self.assertEqual(count_tallies(self.election.id),
+                         {self.candidate_ids[0]: 6, self.candidate_ids[1]: 3, self.candidate_ids[2]: 3})
+        self.assertEqual(count_tallies(self.election.id), count_votes(self.election.id))
+        self.assertEqual(verify_tallies(self.election.id), {})
+
+    def test_mismatching_tallies_are_reported(self):
+        cast_ballot(self.late_voters[0], self.election, self.candidate_ids[:1])
+        Vote.objects.filter(election=self.election, candidate_id=self.candidate_ids[0]).delete()
+
+        self.assertEqual(verify_tallies(self.election.id), {self.candidate_ids[0]: (1, 0)})
+
+
+class CastBallotTests(TestCase):
+    """
+    Checks the statements and the duplicate check of casting a ballot.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.voting_users, cls.elections = seed_elections(voters=3, elections=2, candidates=4)
+        cls.election = cls.elections[1]
+        cls.election.max_votes = 4
+        cls.election.save()
+        cls.candidate_ids = list(cls.election.election_candidate_set.values_list('candidate_id', flat=True))
+        cls.late_voters = [
+            VotingUser.objects.create(user=User.objects.create_user(f'late{i}@example.com'),
+                                      email=f'late{i}@example.com', nr_pesel=f'9999999999{i}')
+            for i in range(2)
+        ]
+
+    def test_query_count_does_not_grow_with_selections(self):
+        # The candidate check, the Voted_User claim, one insert of the votes and one tally upsert, between the
+        # savepoint of the transaction and its release.
+        with self.assertNumQueries(6):
+            cast_ballot(self.late_voters[0], self.election, self.candidate_ids[:1])
+        with self.assertNumQueries(6):
+            cast_ballot(self.late_voters[1], self.election, self.candidate_ids[:self.election.max_votes])
+
+        self.assertEqual(Vote.objects.filter(election=self.election, candidate_id=self.candidate_ids[0]).count(), 3)
+        self.assertEqual(verify_tallies(self.election.id), {})
+
+    def test_second_ballot_is_refused(self):
+        voting_user = self.late_voters[0]
+        cast_ballot(voting_user, self.election, self.candidate_ids[:2])
+        votes = Vote.objects.filter(election=self.election).count()
+        tallies = count_tallies(self.election.id)
+
+        with self.assertRaises(AlreadyVotedError):
+            cast_ballot(voting_user, self.election, self.candidate_ids[2:])
+
+        self.assertEqual(Vote.objects.filter(election=self.election).count(), votes)
+        self.assertEqual(count_tallies(self.election.id), tallies)
+        self.assertEqual(Voted_User.objects.filter(user=voting_user, election=self.election).count(), 1)
+
+
+class BallotStorageTests(TestCase):
+    """
+    Checks that ballots stored as packed Ballot rows count the same as Vote rows.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.voting_users, cls.elections = seed_elections(voters=5, elections=1, candidates=3)
+
+    def test_cast_ballot(self):
+        election = self.elections[0]
+        voting_user = VotingUser.objects.create(user=User.objects.create_user('packed@example.com'),
+                                                email='packed@example.com', nr_pesel='99999999999')
+        candidate_ids = list(election.election_candidate_set.values_list('candidate_id', flat=True))
+        votes = Vote.objects.filter(election=election).count()
+
+        with override_settings(BALLOT_STORAGE='ballots'):
+            cast_ballot(voting_user, election, [candidate_ids[2], candidate_ids[0]])
+
+        self.assertEqual(Vote.objects.filter(election=election).count(), votes)
+        ballot = Ballot.objects.get(election=election)
+        self.assertEqual(ballot.candidate_ids, sorted([candidate_ids[0], candidate_ids[2]]))
+        self.assertEqual(verify_tallies(election.id), {})
+
+    def test_convert_and_revert(self):
+        election = self.elections[0]
+        counts = count_votes(election.id)
+
+        convert_votes(election.id, election.max_votes)
+        self.assertFalse(Vote.objects.filter(election=election).exists())
+        self.assertTrue(Ballot.objects.filter(election=election).exists())
+        self.assertEqual(count_votes(election.id), counts)
+
+        revert_ballots(election.id)
+        self.assertFalse(Ballot.objects.filter(election=election).exists())
+        self.assertEqual(count_votes(election.id), counts)
+
+
+@PLAIN_STATIC_FILES
+class IngestLogTests(TestCase):
+    """
+    Checks that ballots accepted through the ingestion log are stored once, including when the log is replayed.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.voting_users, cls.elections = seed_elections(voters=3, elections=2, candidates=3)
+
+    def setUp(self):
+        log_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(log_dir.cleanup)
+        settings_override = override_settings(BALLOT_INGESTION='log', INGEST_LOG_DIR=log_dir.name,
+                                              INGEST_FLUSH_INTERVAL=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(ingest.close_log)
+
+    def test_submit_flush_and_replay(self):
+        election = self.elections[1]
+        voting_user = VotingUser.objects.create(user=User.objects.create_user('logged@example.com'),
+                                                email='logged@example.com', nr_pesel='99999999998')
+        candidate_ids = list(election.election_candidate_set.values_list('candidate_id', flat=True))
+        counts = count_votes(election.id)
+
+        cast_ballot(voting_user, election, candidate_ids[:2])
+        self.assertFalse(Voted_User.objects.filter(user=voting_user, election=election).exists())
+        with self.assertRaises(AlreadyVotedError):
+            cast_ballot(voting_user, election, candidate_ids[2:])
+        with self.assertRaises(AlreadyVotedError):
+            cast_ballot(self.voting_users[1], election, candidate_ids[:1])
+
+        log = ingest.get_log()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(log.flush(), 1)
+        self.assertTrue(Voted_User.objects.filter(user=voting_user, election=election).exists())
+        counts.update({candidate_id: counts.get(candidate_id, 0) + 1 for candidate_id in candidate_ids[:2]})
+        self.assertEqual(count_votes(election.id), counts)
+        self.assertEqual(verify_tallies(election.id), {})
+
+        # A crash after the ballots were stored but before the checkpoint was written replays them, with a torn record.
+        ingest.close_log()
+        (Path(log.directory) / ingest.CHECKPOINT).unlink()
+        with open(ingest.segment_path(log.directory, 1), 'ab') as segment:
+            segment.write(ingest.encode_record(election.id, voting_user.pk, candidate_ids, datetime.date.today())[:-3])
+        replayed = ingest.IngestLog(log.directory, flush_interval=0)
+        try:
+            self.assertEqual(replayed.flush(), 0)
+            with self.assertRaises(AlreadyVotedError):
+                replayed.submit(election.id, voting_user.pk, candidate_ids[2:], datetime.date.today())
+        finally:
+            replayed.close()
+        self.assertEqual(count_votes(election.id), counts)
+        self.assertEqual(ingest.log_status(log.directory)['pending_bytes'], 0)
+
+    def test_short_write_does_not_lose_later_ballots(self):
+        election = self.elections[1]
+        candidate_ids = list(election.election_candidate_set.values_list('candidate_id', flat=True))
+        voters = [VotingUser.objects.create(user=User.objects.create_user(f'torn{i}@example.com'),
+                                            email=f'torn{i}@example.com', nr_pesel=f'9999999991{i}')
+                  for i in range(3)]
+        log = ingest.get_log()
+        log.submit(election.id, voters[0].pk, candidate_ids[:1], datetime.date.today())
+
+        write = os.write
+        with mock.patch('votingapp.ingest.os.write', side_effect=lambda fd, data: write(fd, data[:5])), \
+                self.assertRaisesMessage(ingest.IngestError, 'Short write'):
+            log.submit(election.id, voters[1].pk, candidate_ids[:1], datetime.date.today())
+        for voter in voters[1:]:
+            log.submit(election.id, voter.pk, candidate_ids[:1], datetime.date.today())
+
+        self.assertEqual(log.flush(), 3)
+        self.assertTrue(all(Voted_User.objects.filter(user=voter, election=election).exists() for voter in voters))
+        self.assertEqual(ingest.log_status(log.directory)['damaged'], [])
+
+    def test_failed_sync_lets_the_voter_retry(self):
+        election = self.elections[1]
+        voting_user = self.voting_users[0]
+        candidate_ids = list(election.election_candidate_set.values_list('candidate_id', flat=True))
+        log = ingest.get_log()
+
+        with mock.patch('votingapp.ingest.os.fsync', side_effect=OSError(5, 'Input/output error')), \
+                self.assertRaisesMessage(ingest.IngestError, 'Cannot sync'):
+            log.submit(election.id, voting_user.pk, candidate_ids[:1], datetime.date.today())
+        log.submit(election.id, voting_user.pk, candidate_ids[1:2], datetime.date.today())
+
+        self.assertEqual(log.flush(), 1)
+        self.assertTrue(Voted_User.objects.filter(user=voting_user, election=election).exists())
+
+    def test_damaged_record_does_not_stall_the_flush(self):
+        election = self.elections[1]
+        candidate_ids = list(election.election_candidate_set.values_list('candidate_id', flat=True))
+        voters = [VotingUser.objects.create(user=User.objects.create_user(f'damaged{i}@example.com'),
+                                            email=f'damaged{i}@example.com', nr_pesel=f'9999999990{i}')
+                  for i in range(3)]
+        log = ingest.get_log()
+        for voter in voters[:2]:
+            log.submit(election.id, voter.pk, candidate_ids[:1], datetime.date.today())
+        with open(ingest.segment_path(log.directory, 1), 'r+b') as segment:
+            segment.seek(-2, os.SEEK_END)
+            segment.write(b'!!')
+
+        with self.assertLogs('votingapp.ingest', 'ERROR'):
+            self.assertEqual(log.flush(), 1)
+        log.submit(election.id, voters[2].pk, candidate_ids[:1], datetime.date.today())
+        self.assertEqual(log.flush(), 1)
+        self.assertEqual([Voted_User.objects.filter(user=voter, election=election).exists() for voter in voters],
+                         [True, False, True])
+        status = ingest.log_status(log.directory)
+        self.assertEqual((status['pending_bytes'], len(status['damaged'])), (0, 1))
+
+    def test_log_is_used_by_one_process(self):
+        log = ingest.get_log()
+        with self.assertRaisesMessage(ingest.IngestError, f'(PID {os.getpid()})'):
+            ingest.IngestLog(log.directory, flush_interval=0)
+        # Another worker starting while this one holds the log.
+        with mock.patch.object(ingest, '_log', None), self.assertRaises(ImproperlyConfigured):
+            ingest.start_if_enabled()
+
+        # A worker forked after the log was opened.
+        self.addCleanup(setattr, ingest, '_inherited_from', None)
+        ingest._after_fork()
+        with self.assertRaisesMessage(ingest.IngestError, f'opened by process {os.getpid()}'):
+            ingest.get_log()
+
+    def test_unavailable_log_asks_to_retry(self):
+        election = self.elections[1]
+        voting_user = self.voting_users[0]
+        candidate_id = election.election_candidate_set.values_list('candidate_id', flat=True).first()
+        self.client.force_login(voting_user.user)
+
+        with mock.patch('votingapp.ingest.get_log', side_effect=ingest.IngestError("The log is closed.")), \
+                self.assertLogs('votingapp.views', 'ERROR'):
+            response = self.client.post(reverse('election_detail', args=[election.id]), {'candidate': [candidate_id]})
+            self.assertEqual((response.status_code, response['Retry-After']), (503, '5'))
+            self.assertContains(response, f'value="{candidate_id}"', status_code=503)
+
+            request = AsyncRequestFactory().post('/', {'candidate': [candidate_id]})
+
+            async def auser():
+                return voting_user.user
+            request.auser = auser
+            request._messages = CookieStorage(request)
+            response = async_to_sync(async_views.election_detail)(request, election.id)
+            self.assertEqual(response.status_code, 503)
+        self.assertFalse(Voted_User.objects.filter(user=voting_user, election=election).exists())
+
+
+class ReportCacheTests(TestCase):
+    """
+    Checks that rendered reports are served from the cache until their content changes, and that the least recently
+    served reports are evicted first.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.voting_users, cls.elections = seed_elections(voters=3, elections=3, candidates=2)
+
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        settings_override = override_settings(REPORT_CACHE_DIR=cache_dir.name, REPORT_CACHE_MAX_BYTES=250)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        render_patch = mock.patch('votingapp.reports.render_pdf', return_value=b'%PDF' + bytes(96))
+        self.render_pdf = render_patch.start()
+        self.addCleanup(render_patch.stop)
+
+    def test_hit_and_fingerprint_change(self):
+        election = self.elections[1]
+        path = get_report_pdf(REPORT_TEMPLATE, build_report_context(election))
+        self.assertEqual(get_report_pdf(REPORT_TEMPLATE, build_report_context(election)), path)
+        self.assertEqual(self.render_pdf.call_count, 1)
+
+        candidate_id = election.election_candidate_set.values_list('candidate_id', flat=True).first()
+        cast_ballot(self.voting_users[0], election, [candidate_id])
+        context = build_report_context(election)
+        self.assertIsNone(find_cached_report(REPORT_TEMPLATE, context))
+        self.assertNotEqual(get_report_pdf(REPORT_TEMPLATE, context), path)
+        self.assertEqual(self.render_pdf.call_count, 2)
+
+    def test_least_recently_served_reports_are_evicted(self):
+        contexts = [build_report_context(election) for election in self.elections]
+        first, second = (get_report_pdf(REPORT_TEMPLATE, context) for context in contexts[:2])
+        now = time.time()
+        os.utime(first, (now - 20, now - 20))
+        os.utime(second, (now - 10, now - 10))
+        # Serving the first report makes the second one the least recently served.
+        self.assertEqual(find_cached_report(REPORT_TEMPLATE, contexts[0]), first)
+
+        third = get_report_pdf(REPORT_TEMPLATE, contexts[2])
+        self.assertEqual([path.exists() for path in (first, second, third)], [True, False, True])
+
+
+@PLAIN_STATIC_FILES
+class ReportJobTests(TestCase):
+    """
+    Checks that PDF requests are answered with a report job that identical requests share, and that the job queue is
+    bounded.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.voting_users, cls.elections = seed_elections(voters=3, elections=1, candidates=2)
+
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        settings_override = override_settings(REPORT_CACHE_DIR=cache_dir.name, REPORT_WORKERS=1)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(report_jobs._jobs.clear)
+        self.url = reverse('ended_elections_report', args=[self.elections[0].id]) + '?pdf=1'
+
+    def test_identical_requests_share_a_job(self):
+        executor = mock.Mock()
+        executor.submit.side_effect = lambda function, template_path, context, path: concurrent.futures.Future()
+        with mock.patch.object(report_jobs, '_get_executor', return_value=executor):
+            first, second = self.client.get(self.url), self.client.get(self.url)
+        self.assertEqual((first.status_code, second.status_code), (202, 202))
+        self.assertEqual(first['Location'], second['Location'])
+        self.assertEqual(executor.submit.call_count, 1)
+
+        # The worker stores the PDF in the report cache and finishes the job.
+        _, template_path, context, path = executor.submit.call_args.args
+        reports.store_report(path, b'%PDF-1.4')
+        report_jobs._jobs[(context['election'].id, report_jobs.job_id(template_path, context))].set_result(path)
+        response = self.client.get(first['Location'])
+        self.assertEqual((response.status_code, b''.join(response.streaming_content)), (200, b'%PDF-1.4'))
+
+    @override_settings(REPORT_QUEUE_DEPTH=0)
+    def test_full_queue_is_refused(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], views.REPORT_RETRY_AFTER)
+
+    @override_settings(REPORT_WORKERS=0)
+    def test_evicted_report_is_rendered_again(self):
+        missing = Path(reports.get_cache_dir()) / 'election_0_evicted.pdf'
+        with mock.patch('votingapp.views.find_cached_report', return_value=missing), \
+                mock.patch('votingapp.reports.render_pdf', return_value=b'%PDF-1.4') as render_pdf:
+            response = self.client.get(self.url)
+        self.assertEqual((response.status_code, b''.join(response.streaming_content)), (200, b'%PDF-1.4'))
+        self.assertEqual(render_pdf.call_count, 1)
+
+class ReportRendererTests(TestCase):
+    """
+    Checks that every report backend renders a report, and that the backend is part of the report fingerprint.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.voting_users, cls.elections = seed_elections(voters=3, elections=1, candidates=2)
+
+    def test_backends(self):
+        context = build_report_context(self.elections[0])
+        for name in RENDERERS:
+            self.assertTrue(get_renderer(name).render(REPORT_TEMPLATE, context).startswith(b'%PDF'), name)
+
+        with override_settings(REPORT_RENDERER='canvas'):
+            canvas_fingerprint = report_fingerprint(REPORT_TEMPLATE, context)
+        with override_settings(REPORT_RENDERER='pisa'):
+            self.assertNotEqual(report_fingerprint(REPORT_TEMPLATE, context), canvas_fingerprint)
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', "Partitioning needs PostgreSQL, e.g. from docker-compose.yml.")
+class PartitioningTests(TestCase):
+    """
+    Checks that the ballot tables are partitioned by election and that partitions can be archived and restored.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.voting_users, cls.elections = seed_elections(voters=4, elections=2, candidates=2)
+
+    def setUp(self):
+        election_ids = [election.id for election in self.elections]
+        for table in partitions.TABLES:
+            partitions.partition_table(table, election_ids)
+
+    def test_new_election_gets_partitions(self):
+        election = Election.objects.create(creator=self.voting_users[0], type='Partitioned', max_votes=1,
+                                           start_date=datetime.date.today(), end_date=datetime.date.today())
+        election.allowed_groups.set(Group.objects.all())
+        candidate = Candidate.objects.create(name='Name', surname='Surname', description='')
+        Election_Candidate.objects.create(election=election, candidate=candidate)
+        cast_ballot(self.voting_users[1], election, [candidate.id])
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM {partitions.partition_name("votingapp_vote", election.id)}')
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+    def test_archive_and_restore(self):
+        ended = self.elections[0]
+        votes = Vote.objects.filter(election=ended).count()
+        self.assertEqual(len(partitions.archive_partitions(ended.id)), len(partitions.TABLES))
+        self.assertFalse(Vote.objects.filter(election=ended).exists())
+        self.assertTrue(Vote.objects.filter(election=self.elections[1]).exists())
+
+        partitions.restore_partitions(ended.id)
+        self.assertEqual(Vote.objects.filter(election=ended).count(), votes)
+
+    def test_partitioned_table_count_is_estimated(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE votingapp_vote')
+        self.assertEqual(estimate_count(Vote.objects.all()), Vote.objects.count())
+
+    def test_archive_command(self):
+        ended = self.elections[0]
+        call_command('partitions', 'archive', election=[ended.id], stdout=io.StringIO())
+
+        archived = {name for _, name, _, archived, _, _ in partitions.partition_status() if archived}
+        self.assertEqual(archived, {partitions.partition_name(table, ended.id) for table in partitions.TABLES})
+        self.assertFalse(Vote.objects.filter(election=ended).exists())
+        # The default partition stays attached and keeps taking the rows of elections without a partition.
+        self.assertTrue(partitions.is_partitioned('votingapp_vote'))
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM pg_inherits WHERE inhrelid = %s::regclass',
+                           [partitions.default_partition_name('votingapp_vote')])
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+
+class BallotArchiveTests(TestCase):
+    """
+    Checks that ended elections can be compacted into archives that reports and recounts are read from.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.voting_users, cls.elections = seed_elections(voters=6, elections=2, candidates=3)
+
+    def setUp(self):
+        archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(archive_dir.cleanup)
+        settings_override = override_settings(BALLOT_ARCHIVE_DIR=archive_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_compact_and_read(self):
+        ended = self.elections[0]
+        context = build_report_context(ended)
+        counts = count_votes(ended.id)
+
+        result = archives.compact_election(ended, purge=True)
+        self.assertEqual(result['purged'], sum(counts.values()))
+        self.assertFalse(Vote.objects.filter(election=ended).exists())
+
+        with self.assertNumQueries(0):
+            archived_context = build_report_context(ended)
+        self.assertEqual(archived_context['candidate_votes'], context['candidate_votes'])
+        self.assertEqual(archived_context['voting_percentage'], context['voting_percentage'])
+
+        with archives.open_archive(ended.id) as archive:
+            self.assertTrue(archive.verify())
+            self.assertEqual(archive.count_ballots(), counts)
+            self.assertEqual(verify_tallies(ended.id, archive.count_ballots()), {})
+
+    def test_rejects_ongoing_and_corrupt(self):
+        with self.assertRaises(archives.ArchiveError):
+            archives.compact_election(self.elections[1])
+
+        path = archives.compact_election(self.elections[0])['path']
+        data = bytearray(path.read_bytes())
+        data[-1] ^= 0xff
+        path.write_bytes(bytes(data))
+        with archives.open_archive(self.elections[0].id) as archive:
+            self.assertFalse(archive.verify())
+
+
+class RecountTests(TestCase):
+    """
+    Checks that the NumPy recount agrees with the tallies whatever the ballots are read from.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.voting_users, cls.elections = seed_elections(voters=6, elections=1, candidates=3)
+
+    def test_recount_sources(self):
+        election = self.elections[0]
+        expected = count_votes(election.id)
+        with tempfile.TemporaryDirectory() as directory, override_settings(BALLOT_ARCHIVE_DIR=directory):
+            recount = recount_election(election, source='db', workers=0)
+            self.assertEqual(recount['counts'], expected)
+            self.assertEqual(recount['differences'], {})
+            self.assertEqual(recount['voted_users'], len(self.voting_users) - 1)
+
+            export = os.path.join(directory, 'ballots.csv.gz')
+            with open(export, 'wb') as export_file:
+                export_file.writelines(export_chunks(election.id, compress=True))
+            self.assertEqual(recount_election(election, path=export, source='file', workers=0)['counts'], expected)
+
+            archives.compact_election(election, purge=True)
+            recount = recount_election(election, workers=0)
+            self.assertEqual((recount['source'], recount['counts']), ('archive', expected))
+
+    def test_differences(self):
+        election = self.elections[0]
+        Vote.objects.filter(election=election).first().delete()
+        self.assertTrue(recount_election(election, workers=0)['differences'])
+
+
+@PLAIN_STATIC_FILES
+@override_settings(LIVE_RESULTS_INTERVAL=0.01)
+class LiveResultsTests(TestCase):
+    """
+    Checks that committed ballots are pushed to the subscribers of the live results.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.voting_users, cls.elections = seed_elections(voters=3, elections=2, candidates=2)
+        cls.late_voter = VotingUser.objects.create(user=User.objects.create_user('late@example.com'),
+                                                   email='late@example.com', nr_pesel='99999999999')
+
+    def test_stream(self):
+        ongoing = self.elections[1]
+        candidate_id = ongoing.election_candidate_set.values_list('candidate_id', flat=True).first()
+
+        async def watch():
+            first, second = await live_results.hub.subscribe(ongoing.id), await live_results.hub.subscribe(ongoing.id)
+            snapshot = await first.get()
+            self.assertEqual(await second.get(), snapshot)
+
+            def vote():
+                with self.captureOnCommitCallbacks(execute=True):
+                    cast_ballot(self.late_voter, ongoing, [candidate_id])
+            await sync_to_async(vote)()
+
+            update = await asyncio.wait_for(first.get(), timeout=5)
+            self.assertEqual(await second.get(), update)
+            live_results.hub.unsubscribe(ongoing.id, first)
+            live_results.hub.unsubscribe(ongoing.id, second)
+            return snapshot, update
+
+        snapshot, update = async_to_sync(watch)()
+        data = json.loads(update.decode().split('data: ', 1)[1])
+        self.assertEqual(data['total_votes'], json.loads(snapshot.decode().split('data: ', 1)[1])['total_votes'] + 1)
+        self.assertEqual(sum(data['delta'].values()), 1)
+
+    def test_subscriber_joining_while_the_channel_closes(self):
+        election_id = self.elections[1].id
+        hub = live_results.LiveResultsHub()
+        loads = []
+
+        async def load_results(election_id, names=None):
+            loaded = asyncio.Event()
+            loads.append(loaded)
+            await loaded.wait()
+            return {}, {'Name 0 Surname 1': len(loads)}
+
+        async def subscribe_while_closing():
+            with mock.patch.object(live_results, 'sync_to_async', lambda function: load_results):
+                first = asyncio.ensure_future(hub.subscribe(election_id))
+                second = asyncio.ensure_future(hub.subscribe(election_id))
+                while len(loads) < 2:
+                    await asyncio.sleep(0)
+                # The first subscriber leaves while the second one is still loading the results.
+                loads[0].set()
+                hub.unsubscribe(election_id, await first)
+                loads[1].set()
+                queue = await second
+            try:
+                return queue in hub._channels[election_id].subscribers
+            finally:
+                hub._task.cancel()
+
+        self.assertTrue(async_to_sync(subscribe_while_closing)())
+
+    def test_stream_ends_with_the_election(self):
+        ongoing = self.elections[1]
+        closes_soon = live_results.closing_time(ongoing) - datetime.timedelta(seconds=0.05)
+
+        async def watch():
+            return [event async for event in live_results.stream_results(ongoing)]
+
+        with mock.patch('votingapp.live_results.timezone.now', return_value=closes_soon):
+            events = async_to_sync(watch)()
+        self.assertEqual([event.decode().split('event: ', 1)[1].split('\n', 1)[0] for event in events],
+                         ['results', 'results', 'end'])
+        self.assertNotIn(ongoing.id, live_results.hub._channels)
+
+        response = self.client.get(reverse('election_live_results', args=[self.elections[0].id]))
+        self.assertEqual(response.status_code, 204)
+
+    def test_report_links_stream_while_open(self):
+        response = self.client.get(reverse('ended_elections_report', args=[self.elections[1].id]))
+        self.assertContains(response, reverse('election_live_results', args=[self.elections[1].id]))
+        response = self.client.get(reverse('ended_elections_report', args=[self.elections[0].id]))
+        self.assertNotContains(response, 'data-live-results')
+
+        # The test client is a WSGI client, which gets the current results and a reconnection delay.
+        response = self.client.get(reverse('election_live_results', args=[self.elections[1].id]))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertTrue(response.content.startswith(b'retry: '))
+
+
+@PLAIN_STATIC_FILES
+class ReportHttpCachingTests(TestCase):
+    """
+    Checks that report pages can be revalidated without building the report, and that only final ones are long-lived.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.voting_users, cls.elections = seed_elections(voters=3, elections=2, candidates=2)
+        cls.late_voter = VotingUser.objects.create(user=User.objects.create_user('late@example.com'),
+                                                   email='late@example.com', nr_pesel='99999999999')
+
+    def test_ended_election(self):
+        url = reverse('ended_elections_report', args=[self.elections[0].id])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('Last-Modified', response)
+
+        # The election and its tallies are read, but not the report's results and turnout.
+        with self.assertNumQueries(2):
+            revalidated = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated['ETag'], response['ETag'])
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+
+    def test_ongoing_election(self):
+        ongoing = self.elections[1]
+        url = reverse('ended_elections_report', args=[ongoing.id])
+        response = self.client.get(url)
+        self.assertIn('s-maxage=10', response['Cache-Control'])
+        self.assertNotIn('Last-Modified', response)
+
+        cast_ballot(self.late_voter, ongoing, ongoing.election_candidate_set.values_list('candidate_id', flat=True)[:1])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'])
+class ReplicaRoutingTests(SimpleTestCase):
+    """
+    Checks which requests read from a replica and that a write keeps the client on the primary.
+    """
+
+    def route(self, request):
+        aliases = []
+
+        def view(request):
+            aliases.append(db_routing.ReplicaRouter().db_for_read(Election))
+            with db_routing.primary():
+                aliases.append(db_routing.ReplicaRouter().db_for_read(Election))
+            return HttpResponse()
+        response = ReplicaRoutingMiddleware(view)(request)
+        return aliases, response
+
+    def test_read_only_views_use_replicas(self):
+        factory = RequestFactory()
+        self.assertEqual(self.route(factory.get(reverse('election_list')))[0], ['replica1', None])
+        self.assertEqual(self.route(factory.get(reverse('ended_elections_report', args=[1])))[0], ['replica1', None])
+        self.assertEqual(self.route(factory.get(reverse('admin:auth_user_changelist')))[0], ['replica1', None])
+        self.assertEqual(self.route(factory.get(reverse('election_detail', args=[1])))[0], [None, None])
+
+    def test_writes_stick_to_the_primary(self):
+        factory = RequestFactory()
+        aliases, response = self.route(factory.post(reverse('election_detail', args=[1])))
+        self.assertEqual(aliases, [None, None])
+        cookie = response.cookies[db_routing.STICKY_COOKIE]
+        self.assertEqual(cookie['max-age'], db_routing.get_sticky_seconds())
+
+        request = factory.get(reverse('election_list'))
+        request.COOKIES[db_routing.STICKY_COOKIE] = cookie.value
+        self.assertEqual(self.route(request)[0], [None, None])
+
+
+class StartupTests(SimpleTestCase):
+    """
+    Checks that a web worker does not load the PDF and recount stacks before it needs them.
+    """
+
+    def test_workers_do_not_import_heavy_modules(self):
+        for entry in ('wsgi', 'asgi'):
+            self.assertEqual(measure_startup(entry)['heavy_modules'], [], entry)
+
+
+class LoggingHandlerTests(SimpleTestCase):
+    """
+    Checks that the queued log handler rotates the shared log file by size and age, counts the records it drops, and
+    that DEBUG records are sampled.
+    """
+
+    def setUp(self):
+        log_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(log_dir.cleanup)
+        self.filename = os.path.join(log_dir.name, 'votingApp.log')
+
+    def handler(self, **options):
+        handler = QueuedRotatingFileHandler(self.filename, flush_interval=0.01, **options)
+        self.addCleanup(handler.close)
+        return handler
+
+    @staticmethod
+    def record(message):
+        return logging.makeLogRecord({'msg': message, 'levelno': logging.INFO, 'levelname': 'INFO'})
+
+    def write(self, handler, *messages):
+        # Closing the handler writes the queued records; the next record starts a new writer thread.
+        for message in messages:
+            handler.handle(self.record(message))
+        handler.close()
+
+    def read(self, suffix=''):
+        with open(self.filename + suffix, encoding='utf-8') as log_file:
+            return log_file.read().splitlines()
+
+    def test_rotates_by_size(self):
+        handler = self.handler(max_bytes=20, backup_count=2)
+        for message in ('first ' * 5, 'second ' * 5, 'third'):
+            self.write(handler, message)
+        self.assertEqual(self.read(), ['third'])
+        self.assertEqual(self.read('.1'), ['second ' * 5])
+        self.assertEqual(self.read('.2'), ['first ' * 5])
+
+    def test_rotates_by_age_across_processes(self):
+        # Two handlers stand for two processes writing to the same file.
+        first, second = self.handler(rotate_seconds=3600), self.handler(rotate_seconds=3600)
+        first._write([self.record('yesterday')])
+        yesterday = time.time() - 24 * 3600
+        os.utime(self.filename, (yesterday, yesterday))
+
+        second._write([self.record('today')])
+        first._write([self.record('today again')])
+        first._close_stream()
+        second._close_stream()
+        self.assertEqual(self.read('.1'), ['yesterday'])
+        self.assertEqual(self.read(), ['today', 'today again'])
+
+    def test_counts_dropped_records(self):
+        handler = self.handler(queue_size=2)
+        # Holds the writer thread back, so the queue fills up.
+        with mock.patch.object(threading.Thread, 'start'):
+            for i in range(5):
+                handler.handle(self.record(f'message {i}'))
+        self.assertEqual(handler.dropped, 3)
+        handler._thread.start()
+        handler.close()
+        self.assertEqual(self.read(), ['3 log records were dropped because the log queue was full', 'message 0',
+                                       'message 1'])
+
+    def test_samples_debug_records(self):
+        logger = logging.getLogger('votingapp.tests.sampling')
+        logger.propagate = False
+        self.addCleanup(setattr, logger, 'propagate', True)
+        logger.setLevel(logging.DEBUG)
+        self.addCleanup(logger.setLevel, logging.NOTSET)
+        handler = self.handler(level=logging.DEBUG)
+        handler.addFilter(DebugSamplingFilter(rate=0.5))
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+
+        with mock.patch('votingsite.logging_handlers.random.random', side_effect=[0.2, 0.7]):
+            logger.debug('kept')
+            logger.debug('dropped')
+            logger.info('always kept')
+        handler.close()
+        self.assertEqual(self.read(), ['kept', 'always kept'])
@@ -1,5 +1,12 @@
+from django.conf import settings
 from django.urls import path
-from .views import login_view, register_view, election_list, election_detail, logout_view, ended_elections_report
+from .async_views import election_live_results
+from .metrics import metrics_view
+from .views import login_view, register_view, election_list, election_detail, logout_view, ended_elections_report, \
+    report_job, election_ballots_export
+
+if settings.ASYNC_VIEWS:
+    from .async_views import election_list, election_detail, ended_elections_report  # noqa: F811
 
 urlpatterns = [
     path('', login_view, name='login'),
@@ -8,5 +15,9 @@ urlpatterns = [
     path('elections/<int:election_id>/', election_detail, name='election_detail'),
     path('logout/', logout_view, name='logout'),
     path('elections/<int:election_id>/report/', ended_elections_report, name='ended_elections_report'),
+    path('elections/<int:election_id>/report/jobs/<str:job_id>/', report_job, name='report_job'),
+    path('elections/<int:election_id>/ballots/', election_ballots_export, name='election_ballots_export'),
+    path('elections/<int:election_id>/results/live/', election_live_results, name='election_live_results'),
+    path('metrics', metrics_view, name='metrics'),
 
-]
\ No newline at end of file
+]
@@ -3,7 +3,8 @@ This file defines the view functions for the voting application.
 
 The views handle user authentication (login, logout, registration),
 election list display (ongoing and ended elections based on user groups),
-voting process (candidate selection and vote casting), and ended election report generation (HTML and PDF).
+voting process (candidate selection and vote casting), ended election report generation (HTML and PDF)
+and the export of the raw ballots of ended elections for audits.
 
 Logging is set up to track user actions and potential issues.
 """
@@ -13,20 +14,31 @@ import logging
 from django import forms
 from django.contrib import messages
 from django.contrib.auth import login, logout
-from django.contrib.auth.decorators import login_required
+from django.contrib.auth.decorators import login_required, permission_required
 from django.contrib.auth.forms import AuthenticationForm
 from django.contrib.auth.models import User
-from django.http import HttpResponse
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, \
+    StreamingHttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
-from django.template.loader import get_template
+from django.template.loader import render_to_string
+from django.urls import reverse
 from django.utils import timezone
-from xhtml2pdf import pisa
 
-from votingapp.models import Election, Candidate, Vote
+from votingapp.models import Election
+from . import ballot_cache, election_cache, exports, http_caching, principal, report_jobs
+from .ballots import AlreadyVotedError, InvalidCandidateError, cast_ballot
+from .ingest import IngestError
 from .models import Voted_User, VotingUser
+from .reports import REPORT_TEMPLATE, build_report_context, find_cached_report
 
 logger = logging.getLogger(__name__)
 
+# Seconds a client waits before polling a report job again.
+REPORT_RETRY_AFTER = '2'
+
+# Seconds a voter waits before submitting a ballot again when the ingestion log cannot take it.
+INGEST_RETRY_AFTER = '5'
+
 
 class RegistrationForm(forms.ModelForm):
     """
@@ -54,7 +66,7 @@ class RegistrationForm(forms.ModelForm):
         voting_user.user = user
         if commit:
             voting_user.save()
-        logger.info(f"New user registered: {username}")
+        logger.info("New user registered: %s", username)
         return voting_user
 
 
@@ -83,11 +95,11 @@ def login_view(request):
         if form.is_valid():
             user = form.get_user()
             login(request, user)
-            logger.info(f"User logged in: {user.username}")
+            logger.info("User logged in: %s", user.username)
             return redirect('election_list')
         else:
             logger.warning("Login failed with provided credentials.")
-            logger.debug(f"Login attempt failed with data: {request.POST}")
+            logger.debug("Login attempt failed for username: %s", request.POST.get('username'))
     else:
         form = AuthenticationForm()
         logger.debug("Rendering login form.")
@@ -121,7 +133,7 @@ def register_view(request):
             return redirect('login')
         else:
             logger.warning("User registration failed.")
-            logger.debug(f"Registration form data: {request.POST}")
+            logger.debug("Registration form errors in fields: %s", ", ".join(form.errors))
     else:
         form = RegistrationForm()
         logger.debug("Rendering registration form.")
@@ -142,7 +154,7 @@ def logout_view(request):
 
     user = request.user
     logout(request)
-    logger.info(f"User logged out: {user.username}")
+    logger.info("User logged out: %s", user.username)
     return redirect('login')
 
 
@@ -161,25 +173,28 @@ def election_list(request):
     election_list.html: Displays the list of ongoing and ended elections.
 
     Context:
-    ongoing_elections (QuerySet): The list of ongoing elections the user is authorized to vote in.
-    ended_elections (QuerySet): The list of ended elections the user was authorized to vote in.
+    ongoing_elections (list): The ongoing elections the user is authorized to vote in, as dictionaries with the id
+                              and type.
+    ended_elections (list): The ended elections the user was authorized to vote in, as dictionaries with the id and
+                            type.
     """
     user = request.user
     try:
         voting_user = user.votinguser
     except VotingUser.DoesNotExist:
         messages.error(request, 'You are not authorized to access this page.')
-        logger.warning(f"Unauthorized access attempt by user: {user.username}")
+        logger.warning("Unauthorized access attempt by user: %s", user.username)
         return redirect('login')
 
-    user_groups = voting_user.user.groups.all()
-    voted_elections = Voted_User.objects.filter(user=voting_user).values_list('election_id', flat=True)
+    group_ids = principal.get_group_ids(user)
     current_date = timezone.now().date()
-    ongoing_elections = Election.objects.filter(end_date__gte=current_date, allowed_groups__in=user_groups)
-    ongoing_elections = ongoing_elections.exclude(id__in=voted_elections)
-    ended_elections = Election.objects.filter(end_date__lt=current_date, allowed_groups__in=user_groups)
+    ongoing, ended = election_cache.get_group_elections(group_ids, current_date)
+    voted_elections = election_cache.get_voted_election_ids(voting_user.id)
+    ongoing_elections = [{'id': election_id, 'type': ongoing[election_id]}
+                         for election_id in sorted(ongoing) if election_id not in voted_elections]
+    ended_elections = [{'id': election_id, 'type': ended[election_id]} for election_id in sorted(ended)]
 
-    logger.info(f"Election list accessed by user: {user.username}")
+    logger.info("Election list accessed by user: %s", user.username)
 
     return render(request, 'election_list.html',
                   {'ongoing_elections': ongoing_elections, 'ended_elections': ended_elections})
@@ -189,6 +204,9 @@ def generate_pdf(template_path, context):
     """
     Generates a PDF file with a report about a given election.
 
+    Reports are rendered once per report content by the report job workers and then served from the report cache.
+    While a report is being rendered, the client gets a 202 response pointing to the report job, which it polls.
+
     Parameters:
     template_path (str): The path to the HTML template.
     context (dict): The context to be put in the document.
@@ -196,17 +214,63 @@ def generate_pdf(template_path, context):
     Returns:
     HttpResponse:
         - The PDF file as a downloadable response.
+        - A 202 response with the URL of the report job if the PDF is not ready yet.
+        - A 503 response if too many reports are being generated.
         - An error message if PDF generation fails.
     """
-    template = get_template(template_path)
-    html = template.render(context).encode('utf-8')
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = 'attachment; filename="election_report.pdf"'
-    pisa_status = pisa.CreatePDF(html, dest=response, encoding='utf-8')
-    if pisa_status.err:
+    election = context['election']
+    path = find_cached_report(template_path, context)
+    if path is not None:
+        try:
+            return pdf_response(path)
+        except FileNotFoundError:
+            # Evicted from the report cache by another process since it was looked up.
+            logger.debug("Cached PDF report of election ID %s was evicted, rendering it again.", election.id)
+
+    try:
+        job = report_jobs.submit(template_path, context)
+    except report_jobs.ReportQueueFull:
+        logger.warning("Report queue full, PDF request refused for election ID: %s", election.id)
+        response = HttpResponse('Too many reports are being generated, please try again later.', status=503)
+        response['Retry-After'] = REPORT_RETRY_AFTER
+        return response
+
+    if not job.done():
+        return report_job_accepted(template_path, context)
+
+    if job.exception() is not None:
         logger.error("Error generating PDF.")
-        return HttpResponse('We had some errors <pre>' + str(pisa_status.err) + '</pre>', status=500)
+        return HttpResponse('We had some errors <pre>' + str(job.exception()) + '</pre>', status=500)
     logger.debug("PDF generated successfully.")
+    try:
+        return pdf_response(job.result())
+    except FileNotFoundError:
+        # Evicted right after it was rendered; polling the job renders it again.
+        return report_job_accepted(template_path, context)
+
+
+def pdf_response(path):
+    """
+    Returns a response serving a PDF report from the report cache.
+
+    Raises:
+    FileNotFoundError: If the report is no longer in the cache.
+    """
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename='election_report.pdf',
+                        content_type='application/pdf')
+
+
+def report_job_accepted(template_path, context):
+    """
+    Returns the 202 response pointing the client to the job rendering a report.
+    """
+    election = context['election']
+    job_url = reverse('report_job', args=[election.id, report_jobs.job_id(template_path, context)])
+    response = HttpResponse(render_to_string('report_job.html', {
+        'election': election, 'job_url': job_url, 'retry_after': REPORT_RETRY_AFTER,
+    }), status=202)
+    response['Location'] = job_url
+    response['Retry-After'] = REPORT_RETRY_AFTER
     return response
 
 
@@ -220,7 +284,9 @@ def ended_elections_report(request, election_id):
 
     Returns:
     HttpResponse:
-        - Renders the ended elections report page if 'pdf' is not in GET parameters.
+        - Renders the ended elections report page if 'pdf' is not in GET parameters, with the HTTP caching headers of
+          http_caching.py.
+        - A 304 response if the client already holds the current report page.
         - Returns the PDF report if 'pdf' is in GET parameters.
 
     Template:
@@ -234,38 +300,52 @@ def ended_elections_report(request, election_id):
     """
 
     election = get_object_or_404(Election, pk=election_id)
-    votes = Vote.objects.filter(election=election)
-    total_votes = votes.count()
-    candidate_votes = {}
-    for vote in votes:
-        candidate_full_name = f"{vote.candidate.name} {vote.candidate.surname}"
-        if candidate_full_name in candidate_votes:
-            candidate_votes[candidate_full_name] += 1
-        else:
-            candidate_votes[candidate_full_name] = 1
 
-    eligible_voters_count = User.objects.filter(groups__in=election.allowed_groups.all()).distinct().count()
-    voted_users_count = Voted_User.objects.filter(election=election).count()
+    if 'pdf' in request.GET:
+        logger.debug("Generating PDF report for election ID: %s", election_id)
+        return generate_pdf(REPORT_TEMPLATE, build_report_context(election))
 
-    if eligible_voters_count == 0:
-        voting_percentage = 0
-    else:
-        voting_percentage = (voted_users_count / eligible_voters_count) * 100
+    validators = http_caching.report_validators(election)
+    response = http_caching.not_modified(request, election, validators)
+    if response is not None:
+        return response
 
-    context = {
-        'election': election,
-        'total_votes': total_votes,
-        'candidate_votes': candidate_votes,
-        'voting_percentage': voting_percentage,
-        'date': timezone.now().strftime('%Y-%m-%d')
-    }
+    logger.info("Ended elections report accessed for election ID: %s", election_id)
+    context = build_report_context(election)
+    response = render(request, 'ended_elections_report.html',
+                      {**context, 'live_results_url': live_results_url(election)})
+    return http_caching.patch_report_headers(response, election, validators)
 
-    if 'pdf' in request.GET:
-        logger.debug(f"Generating PDF report for election ID: {election_id}")
-        return generate_pdf('election_report_template.html', context)
 
-    logger.info(f"Ended elections report accessed for election ID: {election_id}")
-    return render(request, 'ended_elections_report.html', context)
+def live_results_url(election):
+    """
+    Returns the URL of the live results of an election if it is still open, or None once it has ended.
+    """
+    if election.end_date < timezone.now().date():
+        return None
+    return reverse('election_live_results', args=[election.id])
+
+
+def report_job(request, election_id, job_id):
+    """
+    Reports the progress of a PDF report job, and serves the PDF once it is ready.
+
+    Parameters:
+    request (HttpRequest): The HTTP request object containing metadata about the request.
+    election_id (int): The primary key of the election the report is about.
+    job_id (str): The ID of the report job, as returned by report_jobs.job_id.
+
+    Returns:
+    HttpResponse:
+        - The response of generate_pdf for the job.
+        - Redirects to a new PDF request if the results of the election changed since the job was submitted.
+    """
+    election = get_object_or_404(Election, pk=election_id)
+    context = build_report_context(election)
+    if report_jobs.job_id(REPORT_TEMPLATE, context) != job_id:
+        logger.debug("Report job %s for election ID %s is outdated.", job_id, election_id)
+        return redirect(f"{reverse('ended_elections_report', args=[election_id])}?pdf=1")
+    return generate_pdf(REPORT_TEMPLATE, context)
 
 
 def election_detail(request, election_id):
@@ -273,7 +353,7 @@ def election_detail(request, election_id):
     Handles the display and submission of election details and voting process.
 
     This view function manages the following tasks:
-    1. Retrieves the election and associated candidates based on the provided election ID.
+    1. Retrieves the election and its rendered candidate list from the ballot cache (see ballot_cache.py).
     2. Checks if the user is authorized to vote and if they have already voted in the election.
     3. Processes the voting form submission by validating the selected candidates and recording the votes.
 
@@ -296,7 +376,7 @@ def election_detail(request, election_id):
 
     Context:
     election (Election): The election instance being displayed.
-    candidates (QuerySet): The list of candidates associated with the election.
+    candidates_html (str): The rendered list of the candidates of the election.
 
     Examples:
     - A user accesses the election detail page: GET request to '/election/<election_id>/'
@@ -304,20 +384,22 @@ def election_detail(request, election_id):
 
     """
 
-    election = get_object_or_404(Election, pk=election_id)
-    candidates = Candidate.objects.filter(election_candidate__election=election)
+    ballot = ballot_cache.get_ballot(election_id)
+    if ballot is None:
+        raise Http404("No Election matches the given query.")
+    election, candidate_ids, candidates_html = ballot
     user = request.user
 
     try:
         voting_user = user.votinguser
     except VotingUser.DoesNotExist:
         messages.error(request, 'You are not authorized to access this page.')
-        logger.warning(f"Unauthorized access attempt by user: {user.username}")
+        logger.warning("Unauthorized access attempt by user: %s", user.username)
         return redirect('login')
 
     if Voted_User.objects.filter(user=voting_user, election=election).exists():
         messages.error(request, 'You have already voted in this election.')
-        logger.info(f"User {user.username} attempted to vote again in election ID: {election_id}")
+        logger.info("User %s attempted to vote again in election ID: %s", user.username, election_id)
         return redirect('election_list')
 
     if request.method == 'POST':
@@ -326,19 +408,72 @@ def election_detail(request, election_id):
 
         if len(selected_candidates) > max_votes:
             messages.error(request, f'Please select maximally {max_votes} candidates.')
-            logger.warning(f"User {user.username} selected too many candidates in election ID: {election_id}")
+            logger.warning("User %s selected too many candidates in election ID: %s", user.username, election_id)
         elif len(selected_candidates) == 0:
             messages.error(request, f'Please select at least one candidate')
-            logger.warning(f"User {user.username} selected zero candidates in election ID: {election_id}")
+            logger.warning("User %s selected zero candidates in election ID: %s", user.username, election_id)
         else:
-            for candidate_id in selected_candidates:
-                candidate = get_object_or_404(Candidate, pk=candidate_id)
-                Vote.objects.create(candidate=candidate, election=election, date=timezone.now())
+            try:
+                cast_ballot(voting_user, election, selected_candidates, candidate_ids)
+            except InvalidCandidateError:
+                logger.warning("User %s selected an invalid candidate in election ID: %s", user.username, election_id)
+                raise Http404("No Candidate matches the given query.")
+            except AlreadyVotedError:
+                messages.error(request, 'You have already voted in this election.')
+                logger.info("User %s attempted to vote again in election ID: %s", user.username, election_id)
+                return redirect('election_list')
+            except IngestError:
+                # The ballot was not accepted, so the voter can submit it again.
+                messages.error(request, 'Your vote could not be recorded. Please try again in a moment.')
+                logger.exception("The ballot of user %s in election ID %s could not be logged", user.username,
+                                 election_id)
+                response = render(request, 'election_detail.html',
+                                  {'election': election, 'candidates_html': candidates_html}, status=503)
+                response['Retry-After'] = INGEST_RETRY_AFTER
+                return response
 
-            Voted_User.objects.create(user=voting_user, election=election)
             messages.success(request, 'Your vote has been submitted successfully.')
-            logger.info(f"User {user.username} successfully voted in election ID: {election_id}")
+            logger.info("User %s successfully voted in election ID: %s", user.username, election_id)
             return redirect('election_list')
 
-    logger.debug(f"Rendering election detail page for election ID: {election_id}")
-    return render(request, 'election_detail.html', {'election': election, 'candidates': candidates})
+    logger.debug("Rendering election detail page for election ID: %s", election_id)
+    return render(request, 'election_detail.html', {'election': election, 'candidates_html': candidates_html})
+
+
+@permission_required('votingapp.view_vote', raise_exception=True)
+def election_ballots_export(request, election_id):
+    """
+    Streams the raw ballots of an ended election for audits, as CSV or NDJSON, gzip-compressed by default.
+
+    Parameters:
+    request (HttpRequest): The HTTP request object containing metadata about the request.
+    election_id (int): The primary key of the election to export.
+
+    Query parameters:
+    format: 'csv' (default) or 'ndjson'.
+    compress: 'gzip' (default) or 'none'.
+
+    Returns:
+    StreamingHttpResponse: The export as a downloadable file.
+    HttpResponseForbidden: If the election has not ended yet.
+    HttpResponseBadRequest: If the format or compression is unknown.
+
+    Raises:
+    PermissionDenied: If the user may not view votes.
+    Http404: If the election does not exist.
+    """
+    election = get_object_or_404(Election, pk=election_id)
+    export_format = request.GET.get('format', 'csv')
+    compression = request.GET.get('compress', 'gzip')
+    if export_format not in exports.FORMATS or compression not in ('gzip', 'none'):
+        return HttpResponseBadRequest('Unknown export format or compression.')
+    if election.end_date >= timezone.now().date():
+        return HttpResponseForbidden('Ballots can only be exported once the election has ended.')
+
+    compress = compression == 'gzip'
+    response = StreamingHttpResponse(exports.export_chunks(election.id, export_format, compress),
+                                     content_type='application/gzip' if compress else exports.FORMATS[export_format])
+    filename = exports.export_filename(election.id, export_format, compress)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    logger.info("Ballots of election ID %s exported by user: %s", election_id, request.user.username)
+    return response
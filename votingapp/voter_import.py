@@ -0,0 +1,339 @@
+"""
+This file imports voter rosters in bulk, for onboarding more voters than the registration form can handle.
+
+A roster is a CSV file with a header row or an NDJSON file with one JSON object per line. Each record has the fields:
+    email: The e-mail address, which is also the username. Required.
+    nr_pesel: The 11-digit PESEL number. Required.
+    password: A plain-text password, hashed during the import. Optional.
+    password_hash: An already hashed password in Django's format, stored as is. Optional.
+    groups: The names of the groups the voter belongs to, separated by ';' in CSV files or as a list in NDJSON files.
+            Optional; missing groups are created.
+A voter without a password or password hash gets an unusable password and has to reset it.
+
+The roster is streamed in chunks, so its size is not limited by memory. Passwords are hashed on a pool of worker
+processes while the previous chunk is written, and each chunk is written in its own transaction with bulk inserts
+of the users, voters and group memberships. Records whose e-mail address or PESEL number already exists, in the
+database or earlier in the roster, are skipped; invalid records are reported and skipped.
+
+After each chunk the line reached is saved in a state file next to the roster. If the import fails, running it again
+continues after the last written chunk; since existing voters are skipped, reprocessing a chunk is harmless either way.
+"""
+
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import re
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User, Group
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction
+from django.db.models.functions import Lower
+
+from .import_worker import hash_passwords, init_worker
+from .models import VotingUser
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 1000
+
+PESEL_RE = re.compile(r'^\d{11}$')
+EMAIL_MAX_LENGTH = VotingUser._meta.get_field('email').max_length
+
+
+class RosterError(Exception):
+    """
+    Raised when a roster cannot be read, or when its state file belongs to another roster.
+    """
+
+
+def detect_format(path):
+    """
+    Returns 'csv' or 'ndjson' depending on the extension of the roster file.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        return 'csv'
+    if extension in ('.ndjson', '.jsonl'):
+        return 'ndjson'
+    raise RosterError(f"Cannot tell the format of {path}; use a .csv, .ndjson or .jsonl file or give the format.")
+
+
+def read_roster(path, roster_format=None):
+    """
+    Streams the records of a roster file.
+
+    Parameters:
+    path (str): The path of the roster.
+    roster_format (str): 'csv' or 'ndjson'; detected from the extension if not given.
+
+    Yields:
+    tuple: The line number of the record and the record as a dictionary, or the line number and a RosterError if the
+           line cannot be parsed.
+    """
+    roster_format = roster_format or detect_format(path)
+    with open(path, newline='', encoding='utf-8') as roster:
+        if roster_format == 'csv':
+            reader = csv.DictReader(roster)
+            for record in reader:
+                yield reader.line_num, record
+            return
+
+        for line_number, line in enumerate(roster, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield line_number, RosterError(f"Invalid JSON: {e}")
+                continue
+            if not isinstance(record, dict):
+                yield line_number, RosterError("Expected a JSON object.")
+                continue
+            yield line_number, record
+
+
+def clean_record(record):
+    """
+    Validates and normalizes a roster record.
+
+    Parameters:
+    record (dict): The record as read from the roster.
+
+    Returns:
+    dict: The email, nr_pesel, password, password_hash and groups of the voter.
+
+    Raises:
+    ValidationError: If the record is invalid.
+    """
+    email = (record.get('email') or '').strip().lower()
+    nr_pesel = str(record.get('nr_pesel') or '').strip()
+    validate_email(email)
+    if len(email) > EMAIL_MAX_LENGTH:
+        raise ValidationError(f"The e-mail address is longer than {EMAIL_MAX_LENGTH} characters.")
+    if not PESEL_RE.match(nr_pesel):
+        raise ValidationError("The PESEL number must consist of 11 digits.")
+
+    groups = record.get('groups') or []
+    if isinstance(groups, str):
+        groups = groups.split(';')
+    return {
+        'email': email,
+        'nr_pesel': nr_pesel,
+        'password': record.get('password') or None,
+        'password_hash': record.get('password_hash') or None,
+        'groups': sorted({name.strip() for name in groups if name.strip()}),
+    }
+
+
+def get_state_path(path):
+    """
+    Returns the path of the file recording the progress of importing the given roster.
+    """
+    return f'{path}.import-state.json'
+
+
+def load_state(state_path, path):
+    if not os.path.exists(state_path):
+        return None
+    with open(state_path) as state_file:
+        state = json.load(state_file)
+    if state.get('roster') != os.path.abspath(path):
+        raise RosterError(f"{state_path} records the import of {state.get('roster')}, not of {path}.")
+    return state
+
+
+def save_state(state_path, state):
+    temporary_path = f'{state_path}.tmp'
+    with open(temporary_path, 'w') as state_file:
+        json.dump(state, state_file)
+    os.replace(temporary_path, state_path)
+
+
+def _existing(records):
+    """
+    Returns the e-mail addresses and PESEL numbers among the records that are already taken.
+
+    The addresses of the records are lower-case (see clean_record), so they are compared with the lower-cased
+    addresses of the existing users, which may have been registered in any case.
+    """
+    emails = [record['email'] for record in records]
+    pesels = [record['nr_pesel'] for record in records]
+    taken_emails = set(User.objects.annotate(lower_username=Lower('username'))
+                       .filter(lower_username__in=emails).values_list('lower_username', flat=True))
+    taken_emails.update(VotingUser.objects.annotate(lower_email=Lower('email'))
+                        .filter(lower_email__in=emails).values_list('lower_email', flat=True))
+    taken_pesels = set(VotingUser.objects.filter(nr_pesel__in=pesels).values_list('nr_pesel', flat=True))
+    return taken_emails, taken_pesels
+
+
+def _drop_existing(records):
+    taken_emails, taken_pesels = _existing(records)
+    return [record for record in records
+            if record['email'] not in taken_emails and record['nr_pesel'] not in taken_pesels]
+
+
+class VoterImporter:
+    """
+    Imports a roster file. See the module documentation for the format and the behaviour.
+
+    Parameters:
+    path (str): The path of the roster.
+    roster_format (str): 'csv' or 'ndjson'; detected from the extension if not given.
+    chunk_size (int): The number of records written per transaction.
+    workers (int): The number of password hashing processes; 0 hashes in this process. Defaults to the CPU count.
+    groups (list): Names of groups every imported voter is added to, in addition to the groups in the roster.
+    restart (bool): Whether to ignore the saved progress and start from the beginning of the roster.
+    report (callable): Called with a message after each chunk and for each invalid record.
+    """
+
+    def __init__(self, path, roster_format=None, chunk_size=DEFAULT_CHUNK_SIZE, workers=None, groups=(),
+                 restart=False, report=None):
+        self.path = path
+        self.roster_format = roster_format
+        self.chunk_size = chunk_size
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.groups = list(groups)
+        self.state_path = get_state_path(path)
+        self.restart = restart
+        self.report = report or (lambda message: None)
+        self.group_ids = {}
+        self.state = None
+
+    def run(self):
+        """
+        Imports the roster.
+
+        Returns:
+        dict: The numbers of imported, skipped (already existing) and invalid records and the last line read.
+        """
+        state = None if self.restart else load_state(self.state_path, self.path)
+        self.state = state or {'roster': os.path.abspath(self.path), 'line': 0, 'imported': 0, 'skipped': 0,
+                               'invalid': 0}
+        if state:
+            self.report(f"Resuming the import after line {state['line']}.")
+
+        executor = None
+        if self.workers > 0:
+            # Spawned rather than forked, so the workers do not inherit the database connection of this process.
+            executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                           initializer=init_worker)
+        try:
+            pending = None
+            for last_line, records, invalid, duplicates in self._chunks():
+                # Hash the passwords of this chunk while the previous one is written.
+                new_records = _drop_existing(records)
+                hashing = self._start_hashing(new_records, executor)
+                if pending:
+                    self._write(*pending)
+                pending = (last_line, new_records, invalid, duplicates + len(records) - len(new_records), hashing)
+            if pending:
+                self._write(*pending)
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+        return self.state
+
+    def _chunks(self):
+        """
+        Yields the valid records of the roster after the saved position, in chunks, with the line number reached, the
+        number of invalid records and the number of records duplicating an earlier record of the same chunk. The
+        numbers are only added to the state when the chunk is written, so a resumed import does not count the lines
+        read ahead again.
+        """
+        records = []
+        emails = set()
+        pesels = set()
+        invalid = 0
+        duplicates = 0
+        last_line = self.state['line']
+        for line_number, record in read_roster(self.path, self.roster_format):
+            if line_number <= self.state['line']:
+                continue
+            last_line = line_number
+            try:
+                if isinstance(record, RosterError):
+                    raise ValidationError(str(record))
+                record = clean_record(record)
+            except ValidationError as e:
+                invalid += 1
+                self.report(f"Line {line_number}: {' '.join(e.messages)}")
+                continue
+
+            if record['email'] in emails or record['nr_pesel'] in pesels:
+                duplicates += 1
+                continue
+            emails.add(record['email'])
+            pesels.add(record['nr_pesel'])
+            records.append(record)
+
+            if len(records) >= self.chunk_size:
+                yield last_line, records, invalid, duplicates
+                records = []
+                emails = set()
+                pesels = set()
+                invalid = 0
+                duplicates = 0
+        yield last_line, records, invalid, duplicates
+
+    def _start_hashing(self, records, executor):
+        """
+        Starts hashing the plain-text passwords of the records.
+
+        Returns:
+        list: Futures whose results are the hashes, in the order of the records.
+        """
+        passwords = [record['password'] for record in records if record['password'] and not record['password_hash']]
+        if executor is None:
+            future = Future()
+            future.set_result(hash_passwords(passwords))
+            return [future]
+        batch_size = max(1, -(-len(passwords) // self.workers))
+        return [executor.submit(hash_passwords, passwords[start:start + batch_size])
+                for start in range(0, len(passwords), batch_size)]
+
+    def _write(self, last_line, records, invalid, skipped, hashing):
+        hashes = iter([password_hash for future in hashing for password_hash in future.result()])
+        unusable = make_password(None)
+        for record in records:
+            if record['password_hash']:
+                continue
+            record['password_hash'] = next(hashes) if record['password'] else unusable
+
+        with transaction.atomic():
+            # Voters imported concurrently since the chunk was read are skipped as well.
+            fresh = _drop_existing(records)
+            users = User.objects.bulk_create([
+                User(username=record['email'], email=record['email'], password=record['password_hash'])
+                for record in fresh
+            ])
+            VotingUser.objects.bulk_create([
+                VotingUser(user=user, email=record['email'], nr_pesel=record['nr_pesel'])
+                for user, record in zip(users, fresh)
+            ])
+            memberships = [
+                User.groups.through(user_id=user.id, group_id=self._group_id(name))
+                for user, record in zip(users, fresh) for name in sorted(set(record['groups']) | set(self.groups))
+            ]
+            User.groups.through.objects.bulk_create(memberships)
+
+        self.state['line'] = last_line
+        self.state['imported'] += len(fresh)
+        self.state['skipped'] += skipped + len(records) - len(fresh)
+        self.state['invalid'] += invalid
+        save_state(self.state_path, self.state)
+        logger.info("Imported %s voters from %s up to line %s", len(fresh), self.path, last_line)
+        self.report(f"Line {last_line}: {self.state['imported']} imported, {self.state['skipped']} skipped, "
+                    f"{self.state['invalid']} invalid.")
+
+    def _group_id(self, name):
+        if name not in self.group_ids:
+            self.group_ids[name] = Group.objects.get_or_create(name=name)[0].id
+        return self.group_ids[name]
@@ -12,5 +12,11 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'votingsite.settings')
+# Route the busiest views to their native async versions, see votingapp/async_views.py.
+os.environ.setdefault('VOTINGAPP_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
+
+# Store the ballots left in the ingestion log by a previous run, see votingapp/ingest.py.
+from votingapp.ingest import start_if_enabled  # noqa: E402
+start_if_enabled()
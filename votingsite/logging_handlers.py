@@ -0,0 +1,229 @@
+"""
+Logging handlers and filters for votingsite.
+
+QueuedRotatingFileHandler keeps file I/O out of the request thread: emitting a record only puts it on a bounded
+in-memory queue. A background thread formats the queued records and writes them to the log file in batches, rotating
+the file by size and by age. When the queue is full, records are dropped and counted instead of blocking the request,
+and the number of dropped records is written to the log once there is room again.
+
+The log file is shared by every process of the site (the web workers and the report, recount and import workers), so
+the decision to rotate is taken from the file itself, its size and the time it was last written to, under a lock file
+next to it, and a process whose file was rotated by another one reopens the new file before its next write.
+
+DebugSamplingFilter lets through only a configurable fraction of the DEBUG records, which bounds the logging cost per
+request when debug logging is enabled in production.
+"""
+
+import copy
+import fcntl
+import logging
+import os
+import queue
+import random
+import threading
+import time
+
+_STOP = object()
+
+
+class QueuedRotatingFileHandler(logging.Handler):
+    """
+    A file handler writing records from a background thread, in batches, with size- and time-based rotation.
+
+    Parameters:
+    filename (str): The path of the log file.
+    max_bytes (int): Rotate the file once it grows beyond this size; 0 disables size-based rotation.
+    rotate_seconds (int): Rotate the file on the first write in a new period of this many seconds, counted from the
+                          epoch (so daily rotation happens at midnight UTC); 0 disables time-based rotation.
+    backup_count (int): The number of rotated files to keep (filename.1 is the newest).
+    batch_size (int): The maximum number of records written with one write call.
+    flush_interval (float): The maximum time in seconds a record waits in the queue before being written.
+    queue_size (int): The maximum number of records waiting to be written; further records are dropped.
+    fsync (bool): Whether to fsync the file after each batch.
+    """
+
+    def __init__(self, filename, max_bytes=10 * 1024 * 1024, rotate_seconds=0, backup_count=5, batch_size=256,
+                 flush_interval=1.0, queue_size=10000, fsync=False, encoding='utf-8', level=logging.NOTSET):
+        super().__init__(level)
+        self.filename = os.path.abspath(filename)
+        self.max_bytes = max_bytes
+        self.rotate_seconds = rotate_seconds
+        self.backup_count = backup_count
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.fsync = fsync
+        self.encoding = encoding
+        self.dropped = 0
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._stream = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        # The writer thread does not survive a fork, so a forked worker process starts its own.
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(self.queue_size)
+            self._stream = None
+            self._thread = threading.Thread(target=self._run, name='QueuedRotatingFileHandler', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def emit(self, record):
+        """
+        Queues a record for writing. Never blocks; drops the record if the queue is full.
+        """
+        try:
+            self._ensure_started()
+            # The message is interpolated now, because its arguments may change once the caller moves on.
+            # Formatting the full line (timestamp, traceback, ...) is left to the writer thread.
+            record = copy.copy(record)
+            record.msg = record.getMessage()
+            record.args = None
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def _run(self):
+        pending = []
+        deadline = None
+        while True:
+            timeout = self.flush_interval if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is not None and item is not _STOP:
+                if not pending:
+                    deadline = time.monotonic() + self.flush_interval
+                pending.append(item)
+                if len(pending) < self.batch_size and time.monotonic() < deadline:
+                    continue
+
+            if pending or self.dropped:
+                self._write(pending)
+                pending = []
+                deadline = None
+            if item is _STOP:
+                self._close_stream()
+                return
+
+    def _write(self, records):
+        lines = []
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            lines.append(f"{dropped} log records were dropped because the log queue was full\n")
+        for record in records:
+            try:
+                lines.append(self.format(record) + '\n')
+            except Exception:
+                self.handleError(record)
+
+        try:
+            self._rotate_if_due()
+            stream = self._open_stream()
+            stream.write(''.join(lines))
+            stream.flush()
+            if self.fsync:
+                os.fsync(stream.fileno())
+        except Exception:
+            if records:
+                self.handleError(records[-1])
+
+    def _open_stream(self):
+        if self._stream is not None:
+            # Another process may have rotated the file since it was opened.
+            opened = os.fstat(self._stream.fileno())
+            try:
+                current = os.stat(self.filename)
+            except FileNotFoundError:
+                current = None
+            if current is None or (current.st_dev, current.st_ino) != (opened.st_dev, opened.st_ino):
+                self._close_stream()
+        if self._stream is None:
+            self._stream = open(self.filename, 'a', encoding=self.encoding)
+        return self._stream
+
+    def _close_stream(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+    def _should_rotate(self):
+        try:
+            stat = os.stat(self.filename)
+        except FileNotFoundError:
+            return False
+        if self.max_bytes and stat.st_size >= self.max_bytes:
+            return True
+        if self.rotate_seconds:
+            return stat.st_mtime // self.rotate_seconds < time.time() // self.rotate_seconds
+        return False
+
+    def _rotate_if_due(self):
+        if not self._should_rotate():
+            return
+        with open(f"{self.filename}.lock", 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # Checked again, since another process may have rotated the file while this one waited for the lock.
+            if self._should_rotate():
+                self._rotate()
+
+    def _rotate(self):
+        self._close_stream()
+        if self.backup_count <= 0:
+            os.remove(self.filename)
+            return
+        for index in range(self.backup_count - 1, 0, -1):
+            source = f"{self.filename}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.filename}.{index + 1}")
+        os.replace(self.filename, f"{self.filename}.1")
+
+    def flush(self):
+        """
+        Waits until the queued records have been written, for at most a few flush intervals.
+        """
+        if self._pid != os.getpid():
+            return
+        deadline = time.monotonic() + 5 * self.flush_interval
+        while not self._queue.empty() and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def close(self):
+        """
+        Writes the queued records, stops the writer thread and closes the file.
+        """
+        if self._pid == os.getpid() and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout=10 * self.flush_interval)
+        self._pid = None
+        super().close()
+
+
+class DebugSamplingFilter(logging.Filter):
+    """
+    Lets through only a fraction of the records below a level (DEBUG by default); records at or above it always pass.
+
+    Parameters:
+    rate (float): The fraction of records to keep, between 0 and 1.
+    below_level (int): Records below this level are sampled.
+    """
+
+    def __init__(self, rate=1.0, below_level=logging.INFO):
+        super().__init__()
+        self.rate = float(rate)
+        self.below_level = below_level
+
+    def filter(self, record):
+        if record.levelno >= self.below_level or self.rate >= 1:
+            return True
+        return random.random() < self.rate
@@ -35,6 +35,9 @@ ALLOWED_HOSTS = ['*']
 # Logger
 # See https://docs.djangoproject.com/en/5.0/howto/logging/
 
+# Fraction of DEBUG records that are logged when the level of a logger is lowered to DEBUG.
+LOG_DEBUG_SAMPLE_RATE = float(os.environ.get('VOTINGAPP_LOG_DEBUG_SAMPLE_RATE', '0.01'))
+
 LOGGING = {
     "version": 1,  # the dictConfig format version
     "disable_existing_loggers": False,  # retain the default loggers
@@ -50,17 +53,34 @@ LOGGING = {
         },
     },
 
+    "filters": {
+        "debug_sampling": {
+            "()": "votingsite.logging_handlers.DebugSamplingFilter",
+            "rate": LOG_DEBUG_SAMPLE_RATE,
+        },
+    },
+
     "handlers": {
+        # Written from a background thread in batches, see votingsite/logging_handlers.py.
         "votingApp": {
-            "class": "logging.FileHandler",
+            "class": "votingsite.logging_handlers.QueuedRotatingFileHandler",
             "filename": "votingApp.log",
-            "level": "INFO",
+            # DEBUG records are dropped by a handler below their level before its filters run, so the handler takes
+            # every level and the loggers decide; debug_sampling lets INFO and above through.
+            "level": "DEBUG",
             "formatter": "verbose",
+            "filters": ["debug_sampling"],
+            "max_bytes": 10 * 1024 * 1024,
+            "rotate_seconds": 24 * 60 * 60,
+            "backup_count": 7,
+            "batch_size": 256,
+            "flush_interval": 1.0,
+            "queue_size": 10000,
         },
     },
 
     "loggers": {
-        "votingapp.views": {
+        "votingapp": {
             "level": "INFO",
             "handlers": ["votingApp"],
             "propagate": False,
@@ -68,6 +88,131 @@ LOGGING = {
     },
 }
 
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# The local-memory cache is private to each worker process. When running several workers, point the default cache to
+# a shared backend (e.g. 'django.core.cache.backends.redis.RedisCache') so that invalidations reach all of them.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'votingapp',
+    }
+}
+
+# Lifetime in seconds of the cached election lists, see votingapp/election_cache.py.
+ELECTION_LIST_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Sessions and the authenticated user
+# Sessions are read from the cache and written through to the database. The user, its VotingUser and its groups are
+# cached together by CachedModelBackend, see votingapp/principal.py; ModelBackend stays listed so that sessions
+# created before it was introduced remain valid. With the per-process local-memory cache, a logout or password change
+# reaches the caches of other worker processes only when their entries expire, after PRINCIPAL_CACHE_TIMEOUT seconds
+# for the user and the default cache timeout for the session; a shared cache backend removes this delay.
+
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+AUTHENTICATION_BACKENDS = [
+    'votingapp.principal.CachedModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
+PRINCIPAL_CACHE_TIMEOUT = 5 * 60
+
+# PDF reports
+# Generated reports are cached on disk, see votingapp/reports.py.
+
+REPORT_CACHE_DIR = BASE_DIR / 'report_cache'
+
+REPORT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Reports are rendered on a pool of REPORT_WORKERS processes (0 renders them in the request thread), with at most
+# REPORT_QUEUE_DEPTH jobs waiting per web process, see votingapp/report_jobs.py.
+
+REPORT_WORKERS = 2
+
+REPORT_QUEUE_DEPTH = 32
+
+# The backend rendering the PDF reports: 'pisa' (the HTML template through xhtml2pdf) or 'canvas' (drawn directly with
+# reportlab), or the dotted path of a votingapp.renderers.ReportRenderer subclass, see votingapp/renderers.py.
+
+REPORT_RENDERER = os.environ.get('VOTINGAPP_REPORT_RENDERER', 'pisa')
+
+# Report pages
+# Report pages carry an ETag and are cached by browsers and shared caches for REPORT_FINAL_MAX_AGE seconds once the
+# election has ended, and by shared caches only for REPORT_ONGOING_MAX_AGE seconds before, see
+# votingapp/http_caching.py.
+
+REPORT_FINAL_MAX_AGE = 24 * 60 * 60
+
+REPORT_ONGOING_MAX_AGE = 10
+
+# Async views
+# Serve the busiest views with the native async versions from votingapp/async_views.py. Enabled by asgi.py, since under
+# WSGI every async view would need its own event loop.
+
+ASYNC_VIEWS = os.environ.get('VOTINGAPP_ASYNC_VIEWS', '0') == '1'
+
+# Ballot storage
+# 'votes' stores one Vote row per selected candidate, 'ballots' one Ballot row per ballot with the selections packed
+# into it, see votingapp/ballots.py. After switching, the `ballots` management command converts the existing ballots.
+
+BALLOT_STORAGE = os.environ.get('VOTINGAPP_BALLOT_STORAGE', 'votes')
+
+# Ballot ingestion
+# 'direct' stores every ballot in its own transaction, 'log' appends it to a write-behind log in INGEST_LOG_DIR that is
+# stored in batches of up to INGEST_FLUSH_BATCH ballots every INGEST_FLUSH_INTERVAL seconds, see votingapp/ingest.py.
+# The log keeps its index of voters in memory, so only one server process may use it: run a single worker process
+# (for example gunicorn --workers 1 --threads 16) without --preload. Other processes fail at startup.
+
+BALLOT_INGESTION = os.environ.get('VOTINGAPP_BALLOT_INGESTION', 'direct')
+
+INGEST_LOG_DIR = BASE_DIR / 'ingest_log'
+
+INGEST_FLUSH_INTERVAL = 0.5
+
+INGEST_FLUSH_BATCH = 5000
+
+INGEST_SEGMENT_BYTES = 64 * 1024 * 1024
+
+# Ballot archives
+# Ended elections compacted by the `compact_ballots` management command are stored here, see votingapp/archives.py.
+
+BALLOT_ARCHIVE_DIR = BASE_DIR / 'ballot_archives'
+
+# Vote partitioning
+# On PostgreSQL, the `partitions` management command partitions the Vote, Voted_User and Ballot tables by election
+# (or converts them back) and archives the partitions of ended elections to VOTE_ARCHIVE_SCHEMA, see
+# votingapp/partitions.py.
+
+VOTE_ARCHIVE_SCHEMA = 'votingapp_archive'
+
+# Vote tallies
+# Number of counter rows kept per candidate and election, see votingapp/tallies.py.
+
+VOTE_TALLY_SHARDS = 8
+
+# Live results
+# Changes of the results of watched elections are streamed every LIVE_RESULTS_INTERVAL seconds, and every watched
+# election is re-read every LIVE_RESULTS_REFRESH seconds to pick up ballots cast in other server processes, see
+# votingapp/live_results.py.
+
+LIVE_RESULTS_INTERVAL = 1.0
+
+LIVE_RESULTS_REFRESH = 10.0
+
+# Request metrics
+# Per-view query counts and timings, sent in Server-Timing headers and served at /metrics, see votingapp/metrics.py.
+# /metrics is refused until one of the following is set: VOTINGAPP_METRICS_TOKEN, which Prometheus then sends as a
+# bearer token, or VOTINGAPP_METRICS_ALLOWED_IPS, a comma-separated list of the addresses it scrapes from. Do not list
+# 127.0.0.1 behind a reverse proxy on the same host, since every proxied request comes from there.
+
+METRICS_SERVER_TIMING = True
+
+METRICS_TOKEN = os.environ.get('VOTINGAPP_METRICS_TOKEN', '')
+
+METRICS_ALLOWED_IPS = list(filter(None, os.environ.get('VOTINGAPP_METRICS_ALLOWED_IPS', '').split(',')))
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -83,6 +228,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'votingapp.middleware.RequestMetricsMiddleware',
+    'votingapp.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -116,17 +263,51 @@ WSGI_APPLICATION = 'votingsite.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
+DATABASE = {
+    'ENGINE': 'django.db.backends.postgresql',
+    'NAME': os.environ.get('VOTINGAPP_DB_NAME', 'voting-app-db'),
+    'USER': os.environ.get('VOTINGAPP_DB_USER', 'votingappadmin'),
+    'PASSWORD': os.environ.get('VOTINGAPP_DB_PASSWORD', 'Admin123!'),
+    'HOST': os.environ.get('VOTINGAPP_DB_HOST', 'voting-app-server.postgres.database.azure.com'),
+    'PORT': os.environ.get('VOTINGAPP_DB_PORT', '5432'),
+    # Connections are kept open for CONN_MAX_AGE seconds instead of being set up (TCP, TLS and authentication) for
+    # every request, and checked before they are reused after a request.
+    'CONN_MAX_AGE': int(os.environ.get('VOTINGAPP_DB_CONN_MAX_AGE', '600')),
+    'CONN_HEALTH_CHECKS': True,
+    # Behind a transaction-pooling proxy such as PgBouncer (VOTINGAPP_DB_POOLER=1), cursors cannot outlive a
+    # transaction, so the exports and recounts fetch their chunks with client-side cursors.
+    'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('VOTINGAPP_DB_POOLER', '0') == '1',
+    'OPTIONS': {
+        'sslmode': os.environ.get('VOTINGAPP_DB_SSLMODE', 'prefer'),
+        'connect_timeout': 5,
+        'keepalives': 1,
+        'keepalives_idle': 60,
+    },
+}
+
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.postgresql',
-        'NAME': 'voting-app-db',
-        'USER': 'votingappadmin',
-        'PASSWORD': 'Admin123!',
-        'HOST': 'voting-app-server.postgres.database.azure.com',
-        'PORT': '5432',
-    }
+    'default': DATABASE,
 }
 
+# Read replicas
+# VOTINGAPP_DB_REPLICAS lists the replicas of the database as comma-separated host[:port] pairs. The reads of the
+# read-only pages go to them, and the reads of a client stay on the primary for REPLICA_STICKY_SECONDS seconds after it
+# changed something, see votingapp/db_routing.py. docker-compose.yml can start a local primary with a replica.
+
+DATABASE_REPLICAS = []
+
+for number, address in enumerate(filter(None, os.environ.get('VOTINGAPP_DB_REPLICAS', '').split(',')), start=1):
+    host, _, port = address.strip().partition(':')
+    DATABASES[f'replica{number}'] = {**DATABASE, 'HOST': host, 'PORT': port or DATABASE['PORT'],
+                                     'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(f'replica{number}')
+
+DATABASE_ROUTERS = ['votingapp.db_routing.ReplicaRouter']
+
+REPLICA_VIEWS = ['election_list', 'ended_elections_report']
+
+REPLICA_STICKY_SECONDS = 15
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
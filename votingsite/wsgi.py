@@ -15,4 +15,8 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'votingsite.settings')
 
 application = get_wsgi_application()
 
+# Store the ballots left in the ingestion log by a previous run, see votingapp/ingest.py.
+from votingapp.ingest import start_if_enabled  # noqa: E402
+start_if_enabled()
+
 app = application